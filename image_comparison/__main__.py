@@ -0,0 +1,7 @@
+import sys
+
+from image_comparison.cli import main
+
+
+if __name__ == "__main__":
+    sys.exit(main())
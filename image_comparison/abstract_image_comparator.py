@@ -9,11 +9,15 @@ def check_image_loaded(img, image_path) -> np.ndarray:
     :return: loaded image itself
     """
     if img is None:
-        raise ValueError("Error loading image from: " + image_path)
+        raise ValueError("Error loading image from: " + str(image_path))
     return img
 
 
 class AbstractImageComparison:
+    """
+    Base class of the comparators. Images are file paths, encoded image buffers (bytes, bytearray, memoryview),
+    np.ndarray images in BGR channel order or PIL images (see image_source module).
+    """
     def __init__(self, image_path_1, image_path_2):
         self.image_path_1 = image_path_1
         self.image_path_2 = image_path_2
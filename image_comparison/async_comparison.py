@@ -0,0 +1,215 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from image_comparison.abstract_image_comparator import check_image_loaded
+from image_comparison.image_cache import (
+    get_image_cache, build_cache_key, load_cached_image, MODE_COLOURED, MODE_GREYSCALE, MODE_PIL,
+)
+from image_comparison.decode_planner import reduced_cache_mode, decode_reduced_pil, decode_reduced_pil_buffer
+from image_comparison.image_hash_comparrison import HASH_METHODS, _decode_image, get_hash_min_decoded_side
+from image_comparison.image_source import is_image_path, open_pil_image_buffer
+from image_comparison.metrics import check_metrics, compare_pair
+from image_comparison.opencv_image_comparator import _decode_image_colored, _decode_image_greyscale
+from image_comparison.threshold_comparison import GREYSCALE_METRICS
+
+
+###########################
+# THIS MODULE CONTAINS ASYNCIO API OF THE COMPARATORS FOR SERVICES.
+# FILES ARE READ IN A POOL OF I/O THREADS, DECODING AND METRICS RUN IN A BOUNDED POOL OF CPU THREADS
+# (OPENCV, NUMPY AND PIL RELEASE THE GIL). REQUESTS ABOVE THE CONCURRENCY LIMIT WAIT IN THE EVENT LOOP,
+# WHERE THEY CAN BE CANCELLED WITHOUT TAKING AN EXECUTOR SLOT.
+DEFAULT_MAX_IO_WORKERS = 16
+
+# cv2.imdecode flags giving the same images as the decoders of files used by the comparators
+_DECODE_FLAGS = {
+    MODE_COLOURED: cv2.IMREAD_COLOR,
+    MODE_GREYSCALE: cv2.IMREAD_GRAYSCALE,
+}
+_FILE_DECODERS = {
+    MODE_COLOURED: _decode_image_colored,
+    MODE_GREYSCALE: _decode_image_greyscale,
+    MODE_PIL: _decode_image,
+}
+
+
+class ComparisonQueueFullError(RuntimeError):
+    """
+    Raised when more requests wait for a free worker than the comparator accepts.
+    """
+
+
+def get_metric_image_mode(metric):
+    """
+    :return: mode of the images loaded by the comparator method of the metric
+        (tuple for images decoded at reduced resolution, see decode_planner)
+    """
+    if metric in HASH_METHODS:
+        min_side = get_hash_min_decoded_side(metric)
+        return MODE_PIL if min_side is None else reduced_cache_mode(MODE_PIL, min_side)
+    return MODE_GREYSCALE if metric in GREYSCALE_METRICS else MODE_COLOURED
+
+
+def decode_image_bytes(data: bytes, mode, image_path=None):
+    """
+    Decodes image file bytes.
+    :param data: content of the image file
+    :param mode: MODE_COLOURED, MODE_GREYSCALE, MODE_PIL or mode of reduced PIL images
+    :param image_path: path used in the error message
+    :return: decoded image
+    """
+    if mode == MODE_PIL:
+        return open_pil_image_buffer(data)
+    if isinstance(mode, tuple):
+        return decode_reduced_pil_buffer(data, mode[1])
+    return check_image_loaded(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _DECODE_FLAGS[mode]), image_path)
+
+
+def read_uncached_image(image_path, mode):
+    """
+    Reads bytes of the image file unless the decoded image is already cached.
+    :param image_path: path to the image file, or in-memory image (see image_source module)
+    :return: file content, or None when the image is cached or is not a file
+    """
+    if not is_image_path(image_path):
+        return None
+    key = build_cache_key(image_path, mode)
+    if key is not None and key in get_image_cache():
+        return None
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+
+def decode_file(image_path, mode):
+    if isinstance(mode, tuple):
+        return decode_reduced_pil(image_path, mode[1])
+    return _FILE_DECODERS[mode](image_path)
+
+
+def load_image_from_bytes(image_path, mode, data):
+    """
+    Puts image decoded from the already read bytes into the image cache (the file is decoded
+    again only when the image did not fit into the cache or its entry was evicted meanwhile).
+    In-memory images are not cached, they are decoded by the comparator.
+    """
+    if not is_image_path(image_path):
+        return
+    load_cached_image(image_path, mode, lambda path: (
+        decode_file(path, mode) if data is None else decode_image_bytes(data, mode, path)))
+
+
+def _decode_and_compare(image_path_1, data_1, image_path_2, data_2, metric, image_mask):
+    mode = get_metric_image_mode(metric)
+    load_image_from_bytes(image_path_1, mode, data_1)
+    load_image_from_bytes(image_path_2, mode, data_2)
+    return compare_pair(image_path_1, image_path_2, metric, image_mask)
+
+
+class AsyncImageComparator:
+    """
+    Asyncio API of OpenCVImageComparator, SciKitImageComparator and ImageHashComparison metrics.
+    At most max_workers comparisons are computed at once. At most twice as many requests are in flight
+    (reading files or waiting for a worker), so files of the next requests are read while the current ones
+    are computed, but read images never pile up in memory; further requests wait in the event loop.
+    When max_queued is set, requests beyond max_queued waiting ones fail with ComparisonQueueFullError,
+    so a service can reject load instead of queueing it without limit.
+    Cancelled requests free their slot immediately if their computation did not start yet,
+    otherwise as soon as the running computation finishes, so the CPUs are never oversubscribed.
+    Use as async context manager or call close.
+    """
+    def __init__(self, max_workers=None, max_io_workers=DEFAULT_MAX_IO_WORKERS, max_queued=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_in_flight = self.max_workers * 2
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="image-comparison")
+        self._io_executor = ThreadPoolExecutor(max_io_workers, thread_name_prefix="image-comparison-io")
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._queued = 0
+
+    @property
+    def queued(self) -> int:
+        """
+        :return: number of requests waiting for a free slot
+        """
+        return self._queued
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shuts the executors down, cancelling computations which did not start yet.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._io_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _acquire_slot(self):
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        if self.max_queued is not None and self._queued >= self.max_queued:
+            raise ComparisonQueueFullError(f"More than {self.max_queued} comparisons are waiting.")
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+
+    def _release_slot_when_done(self, future):
+        loop = asyncio.get_running_loop()
+
+        def release(_):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._slots.release)
+        future.add_done_callback(release)
+
+    async def read_images(self, image_path_1, image_path_2, metric) -> tuple:
+        """
+        Reads bytes of both image files in the I/O pool, skipping images which are already cached.
+        :return: tuple of file contents (None for cached images)
+        """
+        mode = get_metric_image_mode(metric)
+        loop = asyncio.get_running_loop()
+        return tuple(await asyncio.gather(
+            loop.run_in_executor(self._io_executor, read_uncached_image, image_path_1, mode),
+            loop.run_in_executor(self._io_executor, read_uncached_image, image_path_2, mode)))
+
+    async def compare(self, image_path_1, image_path_2, metric, image_mask=None):
+        """
+        Compares two images without blocking the event loop.
+        :param image_path_1: File path to the first image
+        :param image_path_2: File path to the second image
+        :param metric: metric name (see metrics.COMPARATOR_METRICS)
+        :param image_mask: optional masked_comparison.ImageMask
+        :return: value returned by the comparator method
+        :raises ComparisonQueueFullError: when max_queued requests are already waiting
+        """
+        check_metrics([metric])
+        await self._acquire_slot()
+        future = None
+        try:
+            data_1, data_2 = await self.read_images(image_path_1, image_path_2, metric)
+            future = self._executor.submit(_decode_and_compare, image_path_1, data_1, image_path_2, data_2, metric,
+                                           image_mask)
+            return await asyncio.wrap_future(future)
+        finally:
+            if future is None or future.cancel() or future.done():
+                self._slots.release()
+            else:
+                # Running computation can not be interrupted, its slot is released when it finishes
+                self._release_slot_when_done(future)
+
+    async def compare_many(self, jobs, image_mask=None) -> list:
+        """
+        Compares many image pairs concurrently (limited by max_workers).
+        :param jobs: iterable of (image_path_1, image_path_2, metric) tuples
+        :param image_mask: optional masked_comparison.ImageMask applied to all pairs
+        :return: list of values in the order of jobs; exceptions are returned in place of failed values
+        """
+        return await asyncio.gather(*(self.compare(*job, image_mask=image_mask) for job in jobs),
+                                    return_exceptions=True)
@@ -0,0 +1,262 @@
+import csv
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+
+from image_comparison.metrics import compare_pair
+from image_comparison.threshold_comparison import (
+    compare_with_threshold, create_verdict, get_threshold_score, is_passed, STAGE_FULL,
+)
+
+
+###########################
+# THIS MODULE CONTAINS PARALLEL BATCH COMPARISON OF MANY IMAGE PAIRS
+# USING A POOL OF WORKER PROCESSES
+DEFAULT_CHUNK_SIZE = 16
+# Files matched by walk_directory_pairs, compared case-insensitively
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def load_manifest(manifest_path, default_metrics=()):
+    """
+    Reads comparison jobs from CSV or JSON lines manifest file.
+    CSV manifest has image_path_1, image_path_2 and metric columns (with header),
+    JSON lines manifest has one object with the same keys per line.
+    Relative image paths are resolved against the manifest directory.
+    :param manifest_path: path to .csv or .jsonl file
+    :param default_metrics: metrics of the rows without metric column or value, one job per metric
+    :return: generator of (image_path_1, image_path_2, metric) tuples
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline="") as manifest:
+        if manifest_path.endswith(".csv"):
+            rows = csv.DictReader(manifest)
+        else:
+            rows = (json.loads(line) for line in manifest if line.strip())
+        for row in rows:
+            metrics = [row["metric"]] if row.get("metric") else default_metrics
+            if not metrics:
+                raise ValueError(f"Manifest row without metric: {row}")
+            for metric in metrics:
+                yield (os.path.join(base_dir, row["image_path_1"]),
+                       os.path.join(base_dir, row["image_path_2"]),
+                       metric)
+
+
+def iter_image_files(root_dir, extensions=IMAGE_EXTENSIONS):
+    """
+    Walks the directory tree lazily in sorted order, so the same tree always gives the same order.
+    :param root_dir: root directory of the tree
+    :param extensions: lowercase extensions of the yielded files
+    :return: generator of paths of the image files relative to root_dir
+    """
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(tuple(extensions)):
+                yield os.path.relpath(os.path.join(dir_path, file_name), root_dir)
+
+
+def walk_directory_pairs(dir_1, dir_2, extensions=IMAGE_EXTENSIONS):
+    """
+    Matches image files of two directory trees by their relative paths. The first tree is walked first,
+    then files present only in the second tree are yielded; the trees are never listed as a whole.
+    :param dir_1: root directory of the first tree
+    :param dir_2: root directory of the second tree
+    :param extensions: lowercase extensions of the matched files
+    :return: generator of (relative_path, image_path_1, image_path_2) tuples, where path of a file missing
+        in one of the trees is None
+    """
+    for relative_path in iter_image_files(dir_1, extensions):
+        image_path_2 = os.path.join(dir_2, relative_path)
+        yield relative_path, os.path.join(dir_1, relative_path), image_path_2 if os.path.isfile(image_path_2) else None
+    for relative_path in iter_image_files(dir_2, extensions):
+        if not os.path.isfile(os.path.join(dir_1, relative_path)):
+            yield relative_path, None, os.path.join(dir_2, relative_path)
+
+
+def create_result_record(index, job, result=None, error=None, verdict=None) -> dict:
+    """
+    :param index: position of the job in the batch
+    :param job: (image_path_1, image_path_2, metric) tuple
+    :param result: value returned by the comparator method
+    :param error: error description when comparison failed
+    :param verdict: verdict of the threshold comparison (see threshold_comparison.create_verdict),
+        adds passed and stage keys to the record
+    :return: dictionary describing the result of one job
+    """
+    image_path_1, image_path_2, metric = job
+    record = {
+        "index": index,
+        "image_path_1": image_path_1,
+        "image_path_2": image_path_2,
+        "metric": metric,
+        "result": result,
+        "error": error,
+    }
+    if verdict is not None:
+        record["result"] = verdict["score"]
+        record["passed"] = verdict["passed"]
+        record["stage"] = verdict["stage"]
+    return record
+
+
+def run_job(index, job, image_mask=None, thresholds=None) -> dict:
+    """
+    Runs single comparison job, converting raised exception into an error record.
+    :param index: position of the job in the batch
+    :param job: (image_path_1, image_path_2, metric) tuple
+    :param image_mask: optional masked_comparison.ImageMask applied to the images
+    :param thresholds: optional dictionary of metric thresholds; jobs of these metrics are decided
+        by threshold_comparison.compare_with_threshold
+    :return: result record
+    """
+    image_path_1, image_path_2, metric = job
+    try:
+        for image_path in (image_path_1, image_path_2):
+            if image_path is None:
+                raise FileNotFoundError("Image is missing")
+        if not thresholds or metric not in thresholds:
+            return create_result_record(index, job, result=compare_pair(*job, image_mask=image_mask))
+        threshold = thresholds[metric]
+        if image_mask is None:
+            verdict = compare_with_threshold(image_path_1, image_path_2, metric, threshold)
+        else:
+            # Shortcuts of compare_with_threshold look at all pixels, so masked metrics are always calculated
+            value = compare_pair(*job, image_mask=image_mask)
+            passed = is_passed(metric, get_threshold_score(metric, value), threshold)
+            verdict = create_verdict(passed, STAGE_FULL, value)
+        return create_result_record(index, job, verdict=verdict)
+    except Exception as e:
+        return create_result_record(index, job, error=f"{type(e).__name__}: {e}")
+
+
+def _run_chunk(chunk, image_mask=None, thresholds=None) -> list:
+    return [run_job(index, job, image_mask, thresholds) for index, job in chunk]
+
+
+def _chunks(jobs, chunk_size, skip_indexes=frozenset()):
+    indexed_jobs = ((index, job) for index, job in enumerate(jobs) if index not in skip_indexes)
+    while True:
+        chunk = list(islice(indexed_jobs, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_isolated(worker, chunk, worker_args, crash_record) -> list:
+    """
+    Runs items of a chunk one by one in a single worker process, so an item which kills the worker is known.
+    """
+    records = []
+    executor = ProcessPoolExecutor(max_workers=1)
+    try:
+        for item in chunk:
+            try:
+                records.extend(executor.submit(worker, [item], *worker_args).result())
+            except BrokenProcessPool as e:
+                records.append(crash_record(item, f"{type(e).__name__}: {e}"))
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=1)
+    finally:
+        executor.shutdown()
+    return records
+
+
+def run_chunks_in_pool(worker, chunks, worker_args=(), crash_record=None, max_workers=None, ordered=False):
+    """
+    Runs chunks of items in a pool of worker processes, keeping only a limited number of chunks in flight.
+    When a worker process dies, the pool is replaced and the chunks lost with it are submitted again;
+    a chunk lost twice is run item by item (see _run_isolated), so only the item killing the worker fails.
+    :param worker: picklable function called as worker(chunk, *worker_args), returning list of records
+    :param chunks: iterable of lists of items
+    :param worker_args: additional arguments of the worker
+    :param crash_record: function called as crash_record(item, error) in this process, returning record of
+        an item which could not be processed
+    :param max_workers: number of worker processes, defaults to number of CPUs
+    :param ordered: when True, records are yielded in the order of chunks, otherwise as soon as they complete
+    :return: generator of records
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    # Chunks being calculated and (when ordered) completed chunks waiting for an earlier one
+    max_in_flight = max_workers * 2
+    chunks = enumerate(chunks)
+    pending = {}
+    completed = {}
+    lost = set()
+    # Positions of submitted chunks in submission order, which is the order of chunks
+    submitted = deque()
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def renew_executor(broken_executor):
+        # Every chunk of the broken pool fails, later ones go to a new pool
+        nonlocal executor
+        if broken_executor is executor:
+            executor.shutdown(wait=False)
+            executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def submit(position, chunk):
+        try:
+            future = executor.submit(worker, chunk, *worker_args)
+        except BrokenProcessPool:
+            renew_executor(executor)
+            future = executor.submit(worker, chunk, *worker_args)
+        pending[future] = (position, chunk, executor)
+
+    try:
+        while True:
+            for position, chunk in islice(chunks, max_in_flight - len(pending) - len(completed)):
+                submit(position, chunk)
+                if ordered:
+                    submitted.append(position)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, chunk, chunk_executor = pending.pop(future)
+                try:
+                    records = future.result()
+                except BrokenProcessPool:
+                    renew_executor(chunk_executor)
+                    if position not in lost:
+                        lost.add(position)
+                        submit(position, chunk)
+                        continue
+                    records = _run_isolated(worker, chunk, worker_args, crash_record)
+                except Exception as e:
+                    records = [crash_record(item, f"{type(e).__name__}: {e}") for item in chunk]
+                lost.discard(position)
+                if not ordered:
+                    yield from records
+                    continue
+                completed[position] = records
+                while submitted and submitted[0] in completed:
+                    yield from completed.pop(submitted.popleft())
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def run_batch(jobs, max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE, ordered=False, image_mask=None,
+              thresholds=None, skip_indexes=frozenset()):
+    """
+    Runs comparison jobs in a pool of worker processes.
+    Jobs are dispatched in chunks and only a limited number of chunks is in flight,
+    so arbitrary long iterables (or manifests, see load_manifest) can be processed with flat memory usage.
+    Failure of a single job is reported as an error record and does not abort the batch,
+    also when the job kills its worker process (see run_chunks_in_pool).
+    :param jobs: iterable of (image_path_1, image_path_2, metric) tuples
+    :param max_workers: number of worker processes, defaults to number of CPUs
+    :param chunk_size: number of jobs sent to a worker at once
+    :param ordered: when True, results are yielded in the order of jobs, otherwise as soon as they complete
+    :param image_mask: optional masked_comparison.ImageMask applied to all pairs; it is sent to the workers
+        with every chunk and rasterized once per image size for the chunk
+    :param thresholds: optional dictionary of metric thresholds, results of these metrics get pass/fail verdicts
+    :param skip_indexes: positions of jobs which are not run, e.g. completed before a crash;
+        the remaining jobs keep their positions
+    :return: generator of result records (see create_result_record)
+    """
+    return run_chunks_in_pool(_run_chunk, _chunks(jobs, chunk_size, skip_indexes), (image_mask, thresholds),
+                              lambda item, error: create_result_record(*item, error=error), max_workers, ordered)
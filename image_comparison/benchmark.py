@@ -0,0 +1,314 @@
+import argparse
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from image_comparison.feature_store import get_feature_store, set_feature_store
+from image_comparison.image_cache import get_image_cache
+from image_comparison.image_hash_comparrison import ImageHashComparison
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.pixel_store import get_pixel_store, set_pixel_store
+from image_comparison.scikit_image_comparator import SciKitImageComparator
+
+
+###########################
+# THIS MODULE CONTAINS BENCHMARK SUITE OF THE COMPARATORS.
+# SYNTHETIC IMAGE PAIRS ARE GENERATED LOCALLY, EVERY PUBLIC METHOD OF THE COMPARATORS IS TIMED ON EVERY PAIR
+# AND THE RESULTS CAN BE CHECKED AGAINST A STORED BASELINE.
+# THE FEATURE AND PIXEL STORES ARE DISABLED WHILE THE BENCHMARK RUNS (UNLESS KEPT), SO RUNS AFTER THE FIRST ONE
+# DO NOT TIME LOOKUPS OF STORED RESULTS.
+# RUN AS: python -m image_comparison.benchmark --output results.json [--baseline baseline.json]
+DEFAULT_BENCHMARK_SIZES = (256, 1024, 2048, 4096, 8192)
+DEFAULT_BENCHMARK_CHANNELS = (3,)
+DEFAULT_BENCHMARK_FORMATS = ("png", "jpg")
+DEFAULT_REPEAT = 5
+DEFAULT_MAX_REGRESSION_PERCENT = 10.0
+# Statistic of the latencies compared against the baseline
+DEFAULT_REGRESSION_STATISTIC = "p50"
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+BENCHMARKED_COMPARATORS = (OpenCVImageComparator, SciKitImageComparator, ImageHashComparison)
+
+
+def get_public_methods(comparator_class) -> list:
+    """
+    :return: names of the public methods of the comparator class, sorted
+    """
+    return sorted(name for name, _ in inspect.getmembers(comparator_class, inspect.isfunction)
+                  if not name.startswith("_"))
+
+
+def generate_synthetic_image(size: int, channels: int = 3, seed: int = 0) -> np.ndarray:
+    """
+    Generates image with smooth gradients, rectangles and noise, so that both codecs and metrics
+    do realistic amount of work (flat or pure noise images are unusually cheap or expensive to encode).
+    :param size: width and height of the image
+    :param channels: 1 (grayscale), 3 (BGR) or 4 (BGRA)
+    :param seed: seed of the random generator
+    :return: uint8 image
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 191, size, dtype=np.float32)
+    image = np.empty((size, size, channels), dtype=np.uint8)
+    for channel in range(channels):
+        plane = gradient[None, :] if channel % 2 == 0 else gradient[:, None]
+        image[:, :, channel] = np.broadcast_to(plane, (size, size))
+    for _ in range(16):
+        x, y = rng.integers(0, size, 2)
+        width, height = rng.integers(size // 32 + 1, size // 4 + 2, 2)
+        image[y:y + height, x:x + width] = rng.integers(0, 256, channels, dtype=np.uint8)
+    image = cv2.add(image, rng.integers(0, 64, image.shape, dtype=np.uint8)).reshape(image.shape)
+    return image[:, :, 0] if channels == 1 else image
+
+
+def change_synthetic_image(image: np.ndarray, seed: int = 1) -> np.ndarray:
+    """
+    :return: copy of the image with one changed block, the second image of a benchmarked pair
+    """
+    rng = np.random.default_rng(seed)
+    changed = image.copy()
+    size = image.shape[0]
+    x, y = rng.integers(0, size - size // 8, 2)
+    changed[y:y + size // 8, x:x + size // 8] = 255 - changed[y:y + size // 8, x:x + size // 8]
+    return changed
+
+
+def create_benchmark_case(name: str, image_path_1: str, image_path_2: str, size: int, channels: int,
+                          image_format: str) -> dict:
+    """
+    :return: dictionary describing one benchmarked image pair
+    """
+    return {"name": name, "image_path_1": image_path_1, "image_path_2": image_path_2, "size": size,
+            "channels": channels, "format": image_format}
+
+
+def write_benchmark_images(directory, sizes=DEFAULT_BENCHMARK_SIZES, channels=DEFAULT_BENCHMARK_CHANNELS,
+                           formats=DEFAULT_BENCHMARK_FORMATS) -> list:
+    """
+    Writes synthetic image pairs for every combination of size, channel count and format.
+    JPEG does not support alpha, so 4 channel images are written only in the other formats.
+    :param directory: output directory
+    :return: list of benchmark cases (see create_benchmark_case)
+    """
+    cases = []
+    for size in sizes:
+        for channel_count in channels:
+            image = generate_synthetic_image(size, channel_count)
+            changed = change_synthetic_image(image)
+            for image_format in formats:
+                if channel_count == 4 and image_format in ("jpg", "jpeg"):
+                    continue
+                name = f"{size}x{size}_{channel_count}ch_{image_format}"
+                image_path_1 = os.path.join(directory, f"{name}_1.{image_format}")
+                image_path_2 = os.path.join(directory, f"{name}_2.{image_format}")
+                cv2.imwrite(image_path_1, image)
+                cv2.imwrite(image_path_2, changed)
+                cases.append(create_benchmark_case(name, image_path_1, image_path_2, size, channel_count,
+                                                   image_format))
+    return cases
+
+
+def _run_method(comparator_class, method_name, image_path_1, image_path_2):
+    # Images are decoded in every run, a warm image cache would only measure the metric
+    get_image_cache().clear()
+    comparator = comparator_class(image_path_1, image_path_2)
+    return getattr(comparator, method_name)()
+
+
+def measure_peak_memory(comparator_class, method_name, image_path_1, image_path_2) -> int:
+    """
+    Measures peak memory allocated while the method runs, in an extra untimed run (tracing slows allocations down).
+    Numpy arrays, including the ones returned by OpenCV, are traced; internal buffers of OpenCV and PIL are not.
+    :return: peak traced memory in bytes
+    """
+    tracemalloc.start()
+    try:
+        _run_method(comparator_class, method_name, image_path_1, image_path_2)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize_latencies(latencies, pixels: int) -> dict:
+    """
+    :param latencies: measured durations in seconds
+    :param pixels: number of pixels of one image of the pair
+    :return: dictionary with mean, min, max and percentile latencies and throughput
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    summary = {"mean": float(latencies.mean()), "min": float(latencies.min()), "max": float(latencies.max())}
+    for percentile in LATENCY_PERCENTILES:
+        summary[f"p{percentile}"] = float(np.percentile(latencies, percentile))
+    summary["comparisons_per_second"] = 1 / summary["mean"]
+    summary["megapixels_per_second"] = pixels / 1e6 / summary["mean"]
+    return summary
+
+
+def benchmark_method(comparator_class, method_name, case: dict, repeat: int = DEFAULT_REPEAT,
+                     measure_memory: bool = True) -> dict:
+    """
+    Times one comparator method on one image pair. Every run decodes the images (the image cache is cleared).
+    :param comparator_class: comparator class
+    :param method_name: name of the public method
+    :param case: benchmark case (see create_benchmark_case)
+    :param repeat: number of timed runs
+    :param measure_memory: whether to measure peak memory in an extra run
+    :return: result record with the case, method, latency summary and peak memory (or error description)
+    """
+    record = {"case": case["name"], "size": case["size"], "channels": case["channels"], "format": case["format"],
+              "comparator": comparator_class.__name__, "method": method_name, "repeat": repeat}
+    latencies = []
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _run_method(comparator_class, method_name, case["image_path_1"], case["image_path_2"])
+            latencies.append(time.perf_counter() - start)
+        record["peak_memory_bytes"] = measure_peak_memory(
+            comparator_class, method_name, case["image_path_1"], case["image_path_2"]) if measure_memory else None
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    record.update(summarize_latencies(latencies, case["size"] * case["size"]))
+    return record
+
+
+def run_benchmark(cases, comparator_classes=BENCHMARKED_COMPARATORS, repeat: int = DEFAULT_REPEAT,
+                  methods=None, measure_memory: bool = True, progress=None, keep_stores: bool = False) -> dict:
+    """
+    Benchmarks every public method of the comparators on every case. The feature and pixel stores
+    (e.g. enabled by the environment variables) are disabled during the benchmark and restored afterwards.
+    :param cases: benchmark cases (see write_benchmark_images)
+    :param comparator_classes: benchmarked comparator classes
+    :param repeat: number of timed runs of every method
+    :param methods: optional names of the methods to benchmark, all public methods when omitted
+    :param measure_memory: whether to measure peak memory
+    :param progress: optional callable called with every result record
+    :param keep_stores: when True, the feature and pixel stores stay enabled and their lookups are timed
+    :return: dictionary with the environment description and list of result records
+    """
+    feature_store, pixel_store = get_feature_store(), get_pixel_store()
+    if not keep_stores:
+        set_feature_store(None)
+        set_pixel_store(None)
+    results = []
+    try:
+        for case in cases:
+            for comparator_class in comparator_classes:
+                for method_name in get_public_methods(comparator_class):
+                    if methods is not None and method_name not in methods:
+                        continue
+                    record = benchmark_method(comparator_class, method_name, case, repeat, measure_memory)
+                    if progress is not None:
+                        progress(record)
+                    results.append(record)
+    finally:
+        set_feature_store(feature_store)
+        set_pixel_store(pixel_store)
+    return {"environment": get_environment(), "results": results}
+
+
+def get_environment() -> dict:
+    """
+    :return: description of the machine and library versions, stored with the results
+    """
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "numpy": np.__version__, "opencv": cv2.__version__, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def save_results(results: dict, output_path):
+    with open(output_path, "w") as output:
+        json.dump(results, output, indent=2)
+
+
+def load_results(results_path) -> dict:
+    with open(results_path) as results_file:
+        return json.load(results_file)
+
+
+def _result_key(record) -> tuple:
+    return record["case"], record["comparator"], record["method"]
+
+
+def find_regressions(results: dict, baseline: dict, max_regression_percent: float = DEFAULT_MAX_REGRESSION_PERCENT,
+                     statistic: str = DEFAULT_REGRESSION_STATISTIC) -> list:
+    """
+    Compares the results with the baseline. Only results present in both runs without errors are compared.
+    :param results: results of run_benchmark
+    :param baseline: results of an earlier run
+    :param max_regression_percent: allowed slowdown of the statistic in percent
+    :param statistic: compared latency statistic, e.g. "p50", "p95" or "mean"
+    :return: list of regressions, dictionaries with case, comparator, method, baseline and current values
+        and the slowdown in percent
+    """
+    baseline_records = {_result_key(record): record for record in baseline["results"] if "error" not in record}
+    regressions = []
+    for record in results["results"]:
+        baseline_record = baseline_records.get(_result_key(record))
+        if baseline_record is None or "error" in record:
+            continue
+        slowdown = (record[statistic] / baseline_record[statistic] - 1) * 100
+        if slowdown > max_regression_percent:
+            regressions.append({"case": record["case"], "comparator": record["comparator"],
+                                "method": record["method"], "baseline": baseline_record[statistic],
+                                "current": record[statistic], "slowdown_percent": slowdown})
+    return regressions
+
+
+def _print_record(record):
+    if "error" in record:
+        print(f"{record['case']} {record['comparator']}.{record['method']}: {record['error']}")
+    else:
+        print(f"{record['case']} {record['comparator']}.{record['method']}: p50 {record['p50'] * 1000:.2f} ms, "
+              f"{record['megapixels_per_second']:.1f} MP/s")
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(prog="python -m image_comparison.benchmark",
+                                     description="Benchmarks the comparator methods on synthetic images.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_BENCHMARK_SIZES)
+    parser.add_argument("--channels", type=int, nargs="+", choices=(1, 3, 4), default=DEFAULT_BENCHMARK_CHANNELS)
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_BENCHMARK_FORMATS)
+    parser.add_argument("--methods", nargs="+", help="benchmark only these methods")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    parser.add_argument("--keep-stores", action="store_true",
+                        help="keep the feature and pixel stores enabled, timing lookups of stored results")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION_PERCENT,
+                        help="allowed slowdown against the baseline in percent")
+    parser.add_argument("--statistic", default=DEFAULT_REGRESSION_STATISTIC)
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None) -> int:
+    """
+    Runs the benchmark from the command line.
+    :return: exit code, 1 when a regression against the baseline was found
+    """
+    args = parse_arguments(arguments)
+    with tempfile.TemporaryDirectory(prefix="image-comparison-benchmark-") as directory:
+        cases = write_benchmark_images(directory, args.sizes, args.channels, args.formats)
+        results = run_benchmark(cases, repeat=args.repeat, methods=args.methods,
+                                measure_memory=not args.no_memory, progress=_print_record,
+                                keep_stores=args.keep_stores)
+    if args.output:
+        save_results(results, args.output)
+    if not args.baseline:
+        return 0
+    regressions = find_regressions(results, load_results(args.baseline), args.max_regression, args.statistic)
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']} {regression['comparator']}.{regression['method']}: "
+              f"{regression['baseline'] * 1000:.2f} ms -> {regression['current'] * 1000:.2f} ms "
+              f"(+{regression['slowdown_percent']:.1f}%)")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
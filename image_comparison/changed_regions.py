@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+
+###########################
+# THIS MODULE CONTAINS DETECTION OF CHANGED REGIONS IN DIFFERENCE MAPS.
+# THE MAP IS MAX-POOLED INTO CELLS, CONNECTED COMPONENTS ARE FOUND ON THE SMALL CELL MAP
+# AND ONLY PIXELS INSIDE THE DETECTED BOXES ARE ANALYSED AT FULL RESOLUTION.
+# Absolute difference (0-255) above which a pixel is changed
+DEFAULT_DIFF_THRESHOLD = 25
+# Local SSIM below which a pixel is changed
+DEFAULT_SSIM_THRESHOLD = 0.9
+# Size of the cells of the downsampled map; changes closer than one cell are merged into one region
+DEFAULT_REGION_CELL_SIZE = 8
+
+
+def create_region(x: int, y: int, width: int, height: int, area: int, score: float, max_difference) -> dict:
+    """
+    :param x: left column of the bounding box
+    :param y: top row of the bounding box
+    :param width: width of the bounding box
+    :param height: height of the bounding box
+    :param area: number of changed pixels in the region
+    :param score: mean of the score map over the changed pixels
+    :param max_difference: maximal value of the difference map in the region
+    :return: dictionary describing the changed region
+    """
+    return {"x": x, "y": y, "width": width, "height": height, "area": area, "score": score,
+            "max_difference": max_difference}
+
+
+def max_pool(image: np.ndarray, cell_size: int) -> np.ndarray:
+    """
+    Downsamples single channel map taking the maximum of every cell. Partial cells at the right and bottom
+    borders are padded with zeros.
+    :return: map with one value per cell
+    """
+    height, width = image.shape
+    rows, columns = -(-height // cell_size), -(-width // cell_size)
+    if (rows * cell_size, columns * cell_size) != (height, width):
+        padded = np.zeros((rows * cell_size, columns * cell_size), dtype=image.dtype)
+        padded[:height, :width] = image
+        image = padded
+    return image.reshape(rows, cell_size, columns, cell_size).max(axis=(1, 3))
+
+
+def abs_diff_map(image1: np.ndarray, image2: np.ndarray) -> np.ndarray:
+    """
+    :return: absolute difference of the images, for coloured images the maximum over channels
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Error: Images must be of the same size and type.")
+    diff = cv2.absdiff(image1, image2)
+    return diff.max(axis=2) if diff.ndim == 3 else diff
+
+
+def find_changed_regions(difference_map: np.ndarray, threshold, score_map: np.ndarray = None,
+                         cell_size: int = DEFAULT_REGION_CELL_SIZE, min_area: int = 1) -> list:
+    """
+    Finds regions of pixels with difference above the threshold.
+    Connected components are labelled on the max-pooled cell map (8-connectivity), then for every component
+    the changed pixels of its cells are counted at full resolution and its bounding box is tightened to them.
+    :param difference_map: single channel map, higher values mean larger difference
+    :param threshold: difference above which a pixel is changed
+    :param score_map: map averaged over the changed pixels of a region, difference_map when omitted
+    :param cell_size: size of the cells of the downsampled map
+    :param min_area: regions with fewer changed pixels are dropped
+    :return: list of regions (see create_region) sorted by area, largest first
+    """
+    score_map = difference_map if score_map is None else score_map
+    cells = (max_pool(difference_map, cell_size) > threshold).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(cells, connectivity=8)
+    height, width = difference_map.shape
+    regions = []
+    for label in range(1, count):
+        column, row, columns, rows = (int(value) for value in stats[label, :4])
+        top, left = row * cell_size, column * cell_size
+        bottom, right = min((row + rows) * cell_size, height), min((column + columns) * cell_size, width)
+        # Other components may reach into the bounding box, so only cells of this component are analysed
+        own_cells = labels[row:row + rows, column:column + columns] == label
+        own_pixels = np.repeat(np.repeat(own_cells, cell_size, axis=0), cell_size, axis=1)[:bottom - top, :right - left]
+        window = difference_map[top:bottom, left:right]
+        changed = (window > threshold) & own_pixels
+        area = int(np.count_nonzero(changed))
+        if area < min_area:
+            continue
+        changed_rows = np.flatnonzero(changed.any(axis=1))
+        changed_columns = np.flatnonzero(changed.any(axis=0))
+        regions.append(create_region(
+            left + int(changed_columns[0]), top + int(changed_rows[0]),
+            int(changed_columns[-1] - changed_columns[0]) + 1, int(changed_rows[-1] - changed_rows[0]) + 1,
+            area, float(score_map[top:bottom, left:right][changed].mean()), window[changed].max().item()))
+    regions.sort(key=lambda region: region["area"], reverse=True)
+    return regions
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+from image_comparison.batch_comparison import (
+    run_batch, load_manifest, walk_directory_pairs, IMAGE_EXTENSIONS, DEFAULT_CHUNK_SIZE,
+)
+from image_comparison.metrics import check_metrics, COMPARATOR_METRICS, METRIC_SSIM_GRAY
+from image_comparison.tree_diff import diff_trees, TreeDiffSummary, STATUS_CHANGED, STATUS_IDENTICAL
+
+
+###########################
+# THIS MODULE CONTAINS THE COMMAND LINE INTERFACE, RUN AS python -m image_comparison.
+# PAIRS ARE READ FROM A MANIFEST OR MATCHED BY RELATIVE PATH IN TWO DIRECTORY TREES, COMPARED IN A POOL
+# OF WORKER PROCESSES AND WRITTEN AS JSON LINES AS SOON AS THEY COMPLETE, SO MEMORY DOES NOT GROW WITH
+# THE NUMBER OF PAIRS. AN INTERRUPTED RUN IS CONTINUED WITH --resume: JOBS WHOSE INDEX IS ALREADY
+# IN THE OUTPUT FILE ARE SKIPPED, SO THE INPUT MUST BE THE SAME (DIRECTORY TREES ARE WALKED IN SORTED ORDER).
+# WITH --tree-diff THE TWO TREES ARE DIFFED FILE BY FILE INSTEAD (SEE tree_diff MODULE).
+DEFAULT_CLI_METRIC = METRIC_SSIM_GRAY
+# Output is flushed after that many records; after a crash at most these records are calculated again
+FLUSH_INTERVAL = 64
+
+
+def parse_thresholds(values, metrics) -> dict:
+    """
+    :param values: "METRIC=VALUE" strings, or "VALUE" strings applied to all metrics
+    :param metrics: metrics selected on the command line
+    :return: dictionary of metric thresholds
+    """
+    thresholds = {}
+    for value in values or ():
+        metric, separator, threshold = value.rpartition("=")
+        if not separator:
+            thresholds.update((metric, float(threshold)) for metric in metrics)
+            continue
+        check_metrics([metric])
+        thresholds[metric] = float(threshold)
+    return thresholds
+
+
+def iter_directory_jobs(dir_1, dir_2, metrics, extensions=IMAGE_EXTENSIONS):
+    """
+    :return: generator of jobs comparing files matched by relative path, one job per metric;
+        path of a file missing in one of the trees is None, so its jobs end with an error record
+    """
+    for _, image_path_1, image_path_2 in walk_directory_pairs(dir_1, dir_2, extensions):
+        for metric in metrics:
+            yield image_path_1, image_path_2, metric
+
+
+def to_json_value(value):
+    """
+    JSON encoder fallback for numpy scalars and arrays returned by the comparators.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def load_completed_records(output_path) -> dict:
+    """
+    Reads the records of a partial output file. A truncated last line (written when the process was killed,
+    possibly before its newline) is removed from the file, so new records can be appended.
+    :param output_path: JSON lines output of an interrupted run, None for a new run
+    :return: dictionary with set of job "indexes" and number of "failed" records and records with "errors"
+    """
+    completed = {"indexes": set(), "failed": 0, "errors": 0}
+    if output_path is None or not os.path.exists(output_path):
+        return completed
+    valid_bytes = 0
+    with open(output_path, "rb") as output:
+        for line in output:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+                completed["indexes"].add(record["index"])
+            except (ValueError, KeyError):
+                break
+            completed["failed"] += record.get("passed") is False
+            completed["errors"] += record.get("error") is not None
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(output_path):
+        with open(output_path, "r+b") as output:
+            output.truncate(valid_bytes)
+    return completed
+
+
+def load_completed_indexes(output_path) -> set:
+    """
+    :return: set of job indexes in a partial output file (see load_completed_records)
+    """
+    return load_completed_records(output_path)["indexes"]
+
+
+def create_summary(records_count, skipped_count, failed_count, errors_count) -> dict:
+    """
+    :return: dictionary describing the finished run
+    """
+    return {"compared": records_count, "skipped": skipped_count, "failed": failed_count, "errors": errors_count}
+
+
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(prog="python -m image_comparison",
+                                     description="Compares image pairs and writes the results as JSON lines.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV or JSON lines file with image_path_1, image_path_2 "
+                                           "and optional metric of every pair")
+    source.add_argument("--dirs", nargs=2, metavar=("DIR_1", "DIR_2"),
+                        help="compare files with the same relative path in two directory trees")
+    parser.add_argument("--metric", nargs="+", dest="metrics", choices=sorted(COMPARATOR_METRICS),
+                        help=f"metrics of pairs without metric in the manifest, {DEFAULT_CLI_METRIC} by default")
+    parser.add_argument("--threshold", nargs="+", dest="thresholds", metavar="[METRIC=]VALUE",
+                        help="pass/fail threshold, minimal similarity or maximal distance depending on the metric")
+    parser.add_argument("--workers", type=int, help="number of worker processes, number of CPUs by default")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--ordered", action="store_true", help="write results in the order of the pairs")
+    parser.add_argument("--extensions", nargs="+", default=IMAGE_EXTENSIONS,
+                        help="extensions of the files compared in directory trees")
+    parser.add_argument("--output", help="JSON lines file with the results, standard output by default")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip pairs already in the output file and append the remaining results")
+    parser.add_argument("--tree-diff", action="store_true",
+                        help="diff the --dirs trees: byte-identical and pixel-identical files are not compared, "
+                             "metrics are calculated only for changed files")
+    parser.add_argument("--summary", help="JSON file with the tree diff summary")
+    args = parser.parse_args(arguments)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+    if args.tree_diff and not args.dirs:
+        parser.error("--tree-diff needs --dirs")
+    if args.tree_diff and args.resume:
+        parser.error("--tree-diff can not be resumed")
+    args.metrics = args.metrics or [DEFAULT_CLI_METRIC]
+    try:
+        args.thresholds = parse_thresholds(args.thresholds, args.metrics)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def _open_output(args):
+    if not args.output:
+        return sys.stdout
+    return open(args.output, "a" if args.resume else "w")
+
+
+def _close_output(output):
+    if output is sys.stdout:
+        output.flush()
+    else:
+        output.close()
+
+
+def run_tree_diff(args) -> int:
+    """
+    Diffs the directory trees, writing one record per file and the summary.
+    :return: exit code, 1 when any file is missing, added, could not be compared or changed
+        (with thresholds, only changed files failing them count)
+    """
+    extensions = tuple(extension.lower() for extension in args.extensions)
+    records = diff_trees(*args.dirs, args.metrics, args.thresholds, extensions, args.workers, args.chunk_size)
+    # Records of the files are needed only by the summary file, the printed summary has just the counts
+    summary = TreeDiffSummary(keep_files=bool(args.summary))
+    output = _open_output(args)
+    try:
+        for records_count, record in enumerate(records, start=1):
+            output.write(json.dumps(record, default=to_json_value) + "\n")
+            summary.add(record)
+            if records_count % FLUSH_INTERVAL == 0:
+                output.flush()
+    finally:
+        _close_output(output)
+    if args.summary:
+        with open(args.summary, "w") as summary_file:
+            json.dump(summary.to_dict(), summary_file, default=to_json_value, indent=2)
+    print(json.dumps({"counts": summary.counts, "identical_tiers": summary.identical_tiers,
+                      "failed": summary.failed}), file=sys.stderr)
+    different = sum(count for status, count in summary.counts.items() if status != STATUS_IDENTICAL)
+    if args.thresholds:
+        different -= summary.counts[STATUS_CHANGED] - summary.failed
+    return 1 if different else 0
+
+
+def main(arguments=None) -> int:
+    """
+    Runs the comparison from the command line. The summary is printed to standard error.
+    :return: exit code, 1 when any pair failed its threshold or could not be compared
+    """
+    args = parse_arguments(arguments)
+    if args.tree_diff:
+        return run_tree_diff(args)
+    if args.manifest:
+        jobs = load_manifest(args.manifest, args.metrics)
+    else:
+        extensions = tuple(extension.lower() for extension in args.extensions)
+        jobs = iter_directory_jobs(*args.dirs, args.metrics, extensions)
+    completed = load_completed_records(args.output if args.resume else None)
+    records = run_batch(jobs, max_workers=args.workers, chunk_size=args.chunk_size, ordered=args.ordered,
+                        thresholds=args.thresholds, skip_indexes=completed["indexes"])
+
+    output = _open_output(args)
+    records_count = 0
+    # Records of the interrupted run are part of the result
+    failed_count, errors_count = completed["failed"], completed["errors"]
+    try:
+        for record in records:
+            output.write(json.dumps(record, default=to_json_value) + "\n")
+            records_count += 1
+            errors_count += record["error"] is not None
+            failed_count += record.get("passed") is False
+            if records_count % FLUSH_INTERVAL == 0:
+                output.flush()
+    finally:
+        _close_output(output)
+    summary = create_summary(records_count, len(completed["indexes"]), failed_count, errors_count)
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if failed_count or errors_count else 0
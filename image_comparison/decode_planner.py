@@ -0,0 +1,86 @@
+import io
+
+from PIL import Image
+from image_comparison.image_cache import load_cached_image, MODE_PIL
+
+
+###########################
+# THIS MODULE CONTAINS PLANNING OF REDUCED-RESOLUTION DECODING.
+# JPEG CODECS CAN DECODE DIRECTLY AT 1/2, 1/4 OR 1/8 OF THE SIZE (DCT SCALING), WHICH IS SEVERAL TIMES FASTER
+# THAN DECODING THE FULL IMAGE. METRICS WHICH DOWNSCALE THE IMAGE ANYWAY DECLARE THE SMALLEST IMAGE SIDE
+# THEY NEED (SEE image_hash_comparrison.HASH_MIN_DECODED_SIDES) AND THE PLANNER PICKS THE LARGEST DECODE SCALE
+# KEEPING BOTH SIDES AT LEAST THAT LONG. OTHER FORMATS AND IN-MEMORY IMAGES ARE ALWAYS DECODED IN FULL.
+# Reduced decoding changes the decoded pixels, so it is disabled by default (see set_reduced_decoding).
+DECODE_SCALES = (1, 2, 4, 8)
+
+_reduced_decoding = False
+
+
+def set_reduced_decoding(enabled: bool):
+    """
+    Enables or disables reduced-resolution decoding for metrics which support it, when not chosen per call.
+    """
+    global _reduced_decoding
+    _reduced_decoding = bool(enabled)
+
+
+def get_reduced_decoding() -> bool:
+    return _reduced_decoding
+
+
+def resolve_reduced_decoding(reduced_decode=None) -> bool:
+    """
+    :param reduced_decode: True or False chosen per call, or None for the global setting
+    :return: whether reduced-resolution decoding is used
+    """
+    return _reduced_decoding if reduced_decode is None else bool(reduced_decode)
+
+
+def plan_decode_scale(image_size: tuple, min_side: int) -> int:
+    """
+    :param image_size: (width, height) of the full image
+    :param min_side: minimal length of both sides of the decoded image
+    :return: largest of DECODE_SCALES keeping both sides at least min_side long (1 for small images)
+    """
+    width, height = image_size
+    return max(scale for scale in DECODE_SCALES if scale == 1 or -(-min(width, height) // scale) >= min_side)
+
+
+def decode_reduced_pil(image_file, min_side: int) -> Image.Image:
+    """
+    Decodes PIL image, JPEG images at the largest scale planned for min_side (Image.draft).
+    :param image_file: path to the image file or binary file object
+    :param min_side: minimal length of both sides of the decoded image
+    :return: PIL image
+    """
+    img = Image.open(image_file)
+    if img.format == "JPEG":
+        scale = plan_decode_scale(img.size, min_side)
+        if scale > 1:
+            width, height = img.size
+            # draft picks the smallest DCT scale giving at least the requested size, so the sides are rounded up
+            img.draft(img.mode, (-(-width // scale), -(-height // scale)))
+    img.load()
+    return img
+
+
+def decode_reduced_pil_buffer(buffer, min_side: int) -> Image.Image:
+    return decode_reduced_pil(io.BytesIO(buffer), min_side)
+
+
+def reduced_cache_mode(mode, min_side: int) -> tuple:
+    """
+    :return: image cache mode of images decoded for min_side; the scale depends only on the file and min_side
+    """
+    return f"{mode}_reduced", min_side
+
+
+def load_reduced_image(image_path, min_side: int) -> Image.Image:
+    """
+    Loads PIL image decoded at reduced resolution through the process wide image cache.
+    :param image_path: path to the image file
+    :param min_side: minimal length of both sides of the decoded image
+    :return: PIL image
+    """
+    return load_cached_image(image_path, reduced_cache_mode(MODE_PIL, min_side),
+                             lambda path: decode_reduced_pil(path, min_side))
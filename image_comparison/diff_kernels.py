@@ -0,0 +1,147 @@
+import math
+import threading
+
+import cv2
+import numpy as np
+
+
+###########################
+# THIS MODULE CONTAINS FUSED KERNEL OF PIXEL DIFFERENCE METRICS.
+# SUM, MEAN, MSE, PSNR AND MAXIMUM OF ABSOLUTE DIFFERENCES OF 8 BITS IMAGES ARE CALCULATED IN ONE PASS
+# OVER ROW BANDS SMALL ENOUGH TO STAY IN THE CPU CACHE. EVERY BAND IS WRITTEN INTO THREAD-LOCAL SCRATCH
+# BUFFERS REUSED BY ALL CALLS (ABSOLUTE DIFFERENCES AS uint8, THEIR SQUARES AS uint16), SO NO IMAGE SIZED
+# TEMPORARIES ARE ALLOCATED. SUMS ARE ACCUMULATED AS INTEGERS, WHICH ARE EXACT, SO THE RESULTS ARE THE SAME
+# AS OF THE FLOAT64 NUMPY FORMULAS (FLOAT64 SUMS OF INTEGERS ARE EXACT BELOW 2 ** 53).
+# Other dtypes are calculated by the numpy formulas.
+DEFAULT_KERNEL_BAND_BYTES = 256 * 1024
+UINT8_PEAK_VALUE = 255
+
+_scratch = threading.local()
+
+
+def create_diff_statistics(total, mean, mse: float, max_diff, peak_value=UINT8_PEAK_VALUE) -> dict:
+    """
+    :param total: sum of absolute differences (np.uint64 for integer images)
+    :param mean: mean absolute difference
+    :param mse: mean of squared differences
+    :param max_diff: maximal absolute difference
+    :param peak_value: maximal pixel value, used by PSNR
+    :return: dictionary with sum, mean, MSE, PSNR in dB (inf for identical images) and maximal absolute difference
+    """
+    return {"sum": total, "mean": mean, "mse": mse, "psnr": psnr_from_mse(mse, peak_value), "max_diff": max_diff}
+
+
+def integer_diff_statistics(total: int, squared_total: int, max_diff: int, count: int) -> dict:
+    """
+    :param total: exact sum of absolute differences of 8 bits images (see diff_totals)
+    :param squared_total: exact sum of squared differences
+    :param max_diff: maximal absolute difference
+    :param count: number of compared pixel values
+    :return: dictionary of statistics (see create_diff_statistics)
+    """
+    # np.mean of integers and of their float64 squares sums them exactly, so dividing the exact sums is the same
+    return create_diff_statistics(np.uint64(total), np.float64(total) / count, float(np.float64(squared_total) / count),
+                                  max_diff)
+
+
+def psnr_from_mse(mse: float, peak_value=UINT8_PEAK_VALUE) -> float:
+    """
+    :return: peak signal-to-noise ratio in dB, inf for identical images
+    """
+    return math.inf if mse == 0 else 10 * math.log10(peak_value * peak_value / mse)
+
+
+def _get_scratch_buffers(band_shape: tuple) -> tuple:
+    size = math.prod(band_shape)
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None or buffers[0].size < size:
+        buffers = (np.empty(size, dtype=np.uint8), np.empty(size, dtype=np.uint16))
+        _scratch.buffers = buffers
+    return buffers[0][:size].reshape(band_shape), buffers[1][:size].reshape(band_shape)
+
+
+def _get_kernel_band_rows(image: np.ndarray, band_bytes: int) -> int:
+    row_bytes = max(1, math.prod(image.shape[1:]))
+    return max(1, band_bytes // row_bytes)
+
+
+def _accumulate_band(abs_diff: np.ndarray, squares: np.ndarray) -> tuple:
+    # Rows of the band as single channel 2D arrays, cv2.norm limits the number of channels
+    abs_diff = abs_diff.reshape(abs_diff.shape[0], -1)
+    squares = cv2.multiply(abs_diff, abs_diff, dst=squares.reshape(abs_diff.shape), dtype=cv2.CV_16U)
+    return int(cv2.norm(abs_diff, cv2.NORM_L1)), int(cv2.norm(squares, cv2.NORM_L1)), \
+        int(cv2.norm(abs_diff, cv2.NORM_INF))
+
+
+def _is_kernel_supported(img: np.ndarray) -> bool:
+    return img.dtype == np.uint8 and img.ndim in (2, 3) and img.size > 0
+
+
+def _numpy_diff_statistics(abs_diff: np.ndarray) -> dict:
+    peak_value = np.iinfo(abs_diff.dtype).max if np.issubdtype(abs_diff.dtype, np.integer) else 1.0
+    return create_diff_statistics(np.sum(abs_diff), np.mean(abs_diff), float(np.mean(abs_diff.astype("float") ** 2)),
+                                  abs_diff.max(initial=0), peak_value)
+
+
+def diff_totals(image1: np.ndarray, image2: np.ndarray, band_bytes=DEFAULT_KERNEL_BAND_BYTES) -> tuple:
+    """
+    Calculates exact sums of absolute differences of two 8 bits images and of their squares. Sums of parts
+    of the images (e.g. tiles) add up to the sums of the whole images, see integer_diff_statistics.
+    :param image1: first image
+    :param image2: second image of the same shape and dtype
+    :param band_bytes: size of one band of the first image
+    :return: (sum of absolute differences, sum of squared differences, maximal absolute difference)
+    """
+    if image1.shape != image2.shape or image1.dtype != image2.dtype:
+        raise ValueError("Error: Images must be of the same size and type.")
+    if not _is_kernel_supported(image1):
+        raise ValueError("Error: Only 8 bits images are supported.")
+    band_rows = _get_kernel_band_rows(image1, band_bytes)
+    scratch_diff, scratch_squares = _get_scratch_buffers((min(band_rows, image1.shape[0]),) + image1.shape[1:])
+    total = squared_total = max_diff = 0
+    for start in range(0, image1.shape[0], band_rows):
+        band_1, band_2 = image1[start:start + band_rows], image2[start:start + band_rows]
+        rows = band_1.shape[0]
+        abs_diff = cv2.absdiff(band_1, band_2, dst=scratch_diff[:rows])
+        band_total, band_squared_total, band_max_diff = _accumulate_band(abs_diff, scratch_squares[:rows])
+        total += band_total
+        squared_total += band_squared_total
+        max_diff = max(max_diff, band_max_diff)
+    return total, squared_total, max_diff
+
+
+def diff_statistics(image1: np.ndarray, image2: np.ndarray, band_bytes=DEFAULT_KERNEL_BAND_BYTES) -> dict:
+    """
+    Calculates statistics of absolute differences of two images in one pass, without allocating
+    the difference image.
+    :param image1: first image
+    :param image2: second image of the same shape and dtype
+    :param band_bytes: size of one band of the first image
+    :return: dictionary of statistics (see create_diff_statistics)
+    """
+    if image1.shape != image2.shape or image1.dtype != image2.dtype:
+        raise ValueError("Error: Images must be of the same size and type.")
+    if not _is_kernel_supported(image1):
+        return _numpy_diff_statistics(cv2.absdiff(image1, image2))
+    return integer_diff_statistics(*diff_totals(image1, image2, band_bytes), image1.size)
+
+
+def abs_diff_statistics(abs_diff: np.ndarray, band_bytes=DEFAULT_KERNEL_BAND_BYTES) -> dict:
+    """
+    Calculates statistics of an already calculated absolute difference image (see diff_statistics).
+    :param abs_diff: result of cv2.absdiff
+    :param band_bytes: size of one band of the difference image
+    :return: dictionary of statistics (see create_diff_statistics)
+    """
+    if not _is_kernel_supported(abs_diff):
+        return _numpy_diff_statistics(abs_diff)
+    band_rows = _get_kernel_band_rows(abs_diff, band_bytes)
+    _, scratch_squares = _get_scratch_buffers((min(band_rows, abs_diff.shape[0]),) + abs_diff.shape[1:])
+    total = squared_total = max_diff = 0
+    for start in range(0, abs_diff.shape[0], band_rows):
+        band = abs_diff[start:start + band_rows]
+        band_total, band_squared_total, band_max_diff = _accumulate_band(band, scratch_squares[:band.shape[0]])
+        total += band_total
+        squared_total += band_squared_total
+        max_diff = max(max_diff, band_max_diff)
+    return integer_diff_statistics(total, squared_total, max_diff, abs_diff.size)
@@ -0,0 +1,321 @@
+import functools
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from image_comparison import instrumentation
+from image_comparison.decode_planner import get_reduced_decoding
+from image_comparison.image_cache import build_cache_key
+from image_comparison.ssim_statistics import get_ssim_backend
+
+
+###########################
+# THIS MODULE CONTAINS PERSISTENT CONTENT-ADDRESSED STORE OF COMPUTED FEATURES.
+# FEATURES ARE KEYED BY THE DIGEST OF THE IMAGE FILE CONTENT, ALGORITHM AND ITS PARAMETERS, SO THEY ARE SHARED
+# BY ALL COPIES OF A FILE AND NEVER RETURNED FOR A CHANGED FILE. THE STORE IS A SQLITE DATABASE IN WAL MODE,
+# SO ANY NUMBER OF PROCESSES CAN READ AND WRITE IT CONCURRENTLY; VALUES ARE NUMPY .npz BLOBS.
+# THE STORE IS DISABLED UNLESS set_feature_store IS CALLED OR FEATURE_STORE_ENVIRONMENT_VARIABLE IS SET.
+# Per-image features are hashes, histograms and decoded image sizes. Metrics which need all pixels
+# (MSE, absolute difference, SSIM) store the result of the pair, keyed by the digests of both files.
+FEATURE_STORE_ENVIRONMENT_VARIABLE = "IMAGE_COMPARISON_FEATURE_STORE"
+DEFAULT_STORE_MAX_BYTES = 1024 * 1024 * 1024
+# The size of the store is checked after that many writes of one process, so it can exceed
+# max_bytes by the values written meanwhile. Eviction removes least recently used values
+# until the store is below EVICTION_TARGET_FRACTION of max_bytes.
+EVICTION_CHECK_INTERVAL = 32
+EVICTION_TARGET_FRACTION = 0.9
+# Access time of a value is updated at most once per interval, so reads rarely write
+ACCESS_UPDATE_INTERVAL = 60.0
+SQLITE_BUSY_TIMEOUT = 30.0
+DIGEST_MEMO_MAX_ENTRIES = 65536
+_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+COUNTER_STORE_HITS = "feature_store_hits"
+COUNTER_STORE_MISSES = "feature_store_misses"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS features (
+    key TEXT PRIMARY KEY,
+    algorithm TEXT NOT NULL,
+    value BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_last_access ON features (last_access);
+"""
+
+
+def encode_feature(parts) -> bytes:
+    """
+    Serializes feature values into .npz blob (no pickling).
+    Python scalars are marked, so they are restored as Python scalars and numpy scalars as numpy scalars.
+    :param parts: list of arrays and scalars
+    :return: blob
+    """
+    buffer = io.BytesIO()
+    arrays = {}
+    for index, part in enumerate(parts):
+        prefix = "p" if type(part) in (bool, int, float) else "n"
+        arrays[f"{prefix}{index}"] = np.asarray(part)
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_feature(blob: bytes) -> list:
+    """
+    :return: list of arrays and scalars serialized by encode_feature
+    """
+    with np.load(io.BytesIO(blob), allow_pickle=False) as arrays:
+        parts = []
+        for name in sorted(arrays.files, key=lambda name: int(name[1:])):
+            array = arrays[name]
+            if name[0] == "p":
+                parts.append(array.item())
+            else:
+                parts.append(array[()] if array.ndim == 0 else array)
+        return parts
+
+
+def build_feature_key(digests, algorithm: str, params: dict) -> str:
+    """
+    :param digests: content digest of the image, or tuple of digests for features of a pair of images
+    :param algorithm: name of the feature algorithm
+    :param params: JSON serializable parameters the feature depends on
+    :return: key of the feature
+    """
+    digests = (digests,) if isinstance(digests, str) else tuple(digests)
+    return f"{'/'.join(digests)}:{algorithm}:{json.dumps(params, sort_keys=True, default=str)}"
+
+
+_digest_memo = OrderedDict()
+_digest_lock = threading.Lock()
+
+
+def get_file_digest(image_path):
+    """
+    Calculates BLAKE2b digest of the file content. Digests are memoized per process by path,
+    modification time and size, so the file is read once while it does not change.
+    :param image_path: path to the image file
+    :return: hexadecimal digest, or None for in-memory images and files which can not be read
+    """
+    memo_key = build_cache_key(image_path, "digest")
+    if memo_key is None:
+        return None
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+        if digest is not None:
+            _digest_memo.move_to_end(memo_key)
+            return digest
+    hasher = hashlib.blake2b(digest_size=20)
+    try:
+        with open(image_path, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(_DIGEST_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    except OSError:
+        return None
+    digest = hasher.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+        if len(_digest_memo) > DIGEST_MEMO_MAX_ENTRIES:
+            _digest_memo.popitem(last=False)
+    return digest
+
+
+class FeatureStore:
+    """
+    SQLite store of serialized features bounded by the total size of the values.
+    Every thread (and process) uses its own connection; the database is in WAL mode,
+    so readers are not blocked by writers and writers wait for each other up to SQLITE_BUSY_TIMEOUT.
+    """
+    def __init__(self, path, max_bytes: int = DEFAULT_STORE_MAX_BYTES):
+        self.path = os.fspath(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked worker processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str):
+        """
+        :return: stored blob or None
+        """
+        connection = self._connection()
+        row = connection.execute("SELECT value, last_access FROM features WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > ACCESS_UPDATE_INTERVAL:
+            connection.execute("UPDATE features SET last_access = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, algorithm: str, value: bytes):
+        """
+        Stores the blob, evicting least recently used values when the store grows above max_bytes.
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO features (key, algorithm, value, nbytes, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, algorithm, value, len(value), time.time()))
+        self._writes += 1
+        if self._writes % EVICTION_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def get_feature(self, key: str):
+        """
+        :return: decoded feature parts (see decode_feature) or None
+        """
+        blob = self.get(key)
+        instrumentation.count(COUNTER_STORE_MISSES if blob is None else COUNTER_STORE_HITS)
+        return None if blob is None else decode_feature(blob)
+
+    def put_feature(self, key: str, algorithm: str, parts):
+        self.put(key, algorithm, encode_feature(parts))
+
+    def get_or_compute(self, key: str, algorithm: str, factory) -> list:
+        """
+        :param factory: callable returning list of feature parts, called when the feature is not stored
+        :return: feature parts
+        """
+        parts = self.get_feature(key)
+        if parts is None:
+            parts = list(factory())
+            self.put_feature(key, algorithm, parts)
+        return parts
+
+    @property
+    def current_bytes(self) -> int:
+        return self._connection().execute("SELECT COALESCE(SUM(nbytes), 0) FROM features").fetchone()[0]
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def evict(self):
+        """
+        Removes least recently used values until the store is below EVICTION_TARGET_FRACTION of max_bytes.
+        """
+        connection = self._connection()
+        excess = self.current_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        excess += int(self.max_bytes * (1 - EVICTION_TARGET_FRACTION))
+        keys = []
+        for key, nbytes in connection.execute("SELECT key, nbytes FROM features ORDER BY last_access"):
+            keys.append((key,))
+            excess -= nbytes
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM features WHERE key = ?", keys)
+
+    def stats(self) -> dict:
+        """
+        :return: dictionary with number of values per algorithm, current size and size limit
+        """
+        rows = self._connection().execute("SELECT algorithm, COUNT(*) FROM features GROUP BY algorithm")
+        return {"algorithms": dict(rows.fetchall()), "current_bytes": self.current_bytes, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        self._connection().execute("DELETE FROM features")
+
+    def close(self):
+        """
+        Closes the connection of the calling thread.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+_feature_store = None
+_environment_checked = False
+
+
+def set_feature_store(store):
+    """
+    Installs the process wide feature store used by the comparators.
+    :param store: FeatureStore, path of the database file, or None to disable the store
+    """
+    global _feature_store, _environment_checked
+    _feature_store = FeatureStore(store) if isinstance(store, (str, os.PathLike)) else store
+    _environment_checked = True
+
+
+def get_feature_store():
+    """
+    :return: process wide feature store, opened from FEATURE_STORE_ENVIRONMENT_VARIABLE on the first call
+        when it is set, or None when the store is disabled
+    """
+    global _environment_checked
+    if not _environment_checked:
+        _environment_checked = True
+        path = os.environ.get(FEATURE_STORE_ENVIRONMENT_VARIABLE)
+        if path:
+            set_feature_store(path)
+    return _feature_store
+
+
+def load_image_feature(image_path, algorithm: str, params: dict, factory) -> list:
+    """
+    Returns feature of one image from the feature store, calculating and storing it when missing.
+    Without the store, or for in-memory images, the factory is just called.
+    :param image_path: image the feature is calculated from
+    :param algorithm: name of the feature algorithm
+    :param params: JSON serializable parameters the feature depends on
+    :param factory: callable returning list of feature parts
+    :return: feature parts
+    """
+    store = get_feature_store()
+    digest = None if store is None else get_file_digest(image_path)
+    if digest is None:
+        return list(factory())
+    return store.get_or_compute(build_feature_key(digest, algorithm, params), algorithm, factory)
+
+
+def get_global_params() -> dict:
+    """
+    :return: process wide settings which change the results of the comparators
+    """
+    return {"ssim_backend": get_ssim_backend(), "reduced_decoding": get_reduced_decoding()}
+
+
+def stored_result(metric: str):
+    """
+    Decorator of comparator methods storing the result of the pair in the feature store.
+    The key contains digests of both images, the metric, arguments of the call and the global settings,
+    so an unchanged pair is not decoded again.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            store = get_feature_store()
+            if store is None:
+                return method(self, *args, **kwargs)
+            digest_1, digest_2 = get_file_digest(self.image_path_1), get_file_digest(self.image_path_2)
+            if digest_1 is None or digest_2 is None:
+                return method(self, *args, **kwargs)
+            params = {"args": args, "kwargs": kwargs, **get_global_params()}
+            key = build_feature_key((digest_1, digest_2), metric, params)
+            parts = store.get_feature(key)
+            if parts is not None:
+                return tuple(parts) if len(parts) > 1 else parts[0]
+            result = method(self, *args, **kwargs)
+            store.put_feature(key, metric, list(result) if isinstance(result, tuple) else [result])
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,80 @@
+import numpy as np
+import imagehash
+from image_comparison.image_hash_comparrison import pack_image_hash
+
+
+###########################
+# THIS MODULE CONTAINS VECTORIZED HAMMING DISTANCE CALCULATIONS
+# FOR MANY PACKED 64 BITS IMAGE HASHES
+# Memory used by the intermediate distances of one block
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def pack_image_hashes(hashes) -> np.ndarray:
+    """
+    Packs image hashes into uint64 array.
+    :param hashes: iterable of imagehash.ImageHash or already packed integers, or uint64 array
+    :return: 1D np.ndarray of np.uint64
+    """
+    if isinstance(hashes, np.ndarray):
+        return np.ascontiguousarray(hashes, dtype=np.uint64).ravel()
+    return np.array([pack_image_hash(image_hash) if isinstance(image_hash, imagehash.ImageHash) else image_hash
+                     for image_hash in hashes], dtype=np.uint64)
+
+
+def _block_rows(columns: int, block_bytes: int, bytes_per_element: int) -> int:
+    return max(1, block_bytes // (max(columns, 1) * bytes_per_element))
+
+
+def _distances_block(queries: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    return np.bitwise_count(queries[:, None] ^ hashes[None, :])
+
+
+def hamming_distance_matrix(hashes_1, hashes_2=None, block_bytes=DEFAULT_BLOCK_BYTES) -> np.ndarray:
+    """
+    Calculates Hamming distances between every pair of hashes using XOR and popcount.
+    Rows are processed in blocks, so temporary memory is bounded by block_bytes.
+    :param hashes_1: N hashes (see pack_image_hashes)
+    :param hashes_2: M hashes, when omitted distances between hashes_1 are calculated
+    :param block_bytes: memory limit of the temporary arrays
+    :return: N x M np.ndarray of np.uint8 distances
+    """
+    hashes_1 = pack_image_hashes(hashes_1)
+    hashes_2 = hashes_1 if hashes_2 is None else pack_image_hashes(hashes_2)
+    distances = np.empty((hashes_1.size, hashes_2.size), dtype=np.uint8)
+    # XOR result (8 bytes) and distance (1 byte) per element of the block
+    rows = _block_rows(hashes_2.size, block_bytes, 9)
+    for start in range(0, hashes_1.size, rows):
+        distances[start:start + rows] = _distances_block(hashes_1[start:start + rows], hashes_2)
+    return distances
+
+
+def hamming_nearest_neighbours(queries, hashes, k: int, block_bytes=DEFAULT_BLOCK_BYTES) -> tuple:
+    """
+    Finds k nearest hashes for every query without building the whole distance matrix.
+    Neighbours with the same distance are ordered by their position.
+    :param queries: N query hashes (see pack_image_hashes)
+    :param hashes: M searched hashes
+    :param k: number of neighbours, limited to M
+    :param block_bytes: memory limit of the temporary arrays
+    :return: tuple of N x k arrays with neighbour positions and distances
+    """
+    queries = pack_image_hashes(queries)
+    hashes = pack_image_hashes(hashes)
+    if k < 1:
+        raise ValueError("Number of neighbours must be positive.")
+    k = min(k, hashes.size)
+    indices = np.empty((queries.size, k), dtype=np.intp)
+    distances = np.empty((queries.size, k), dtype=np.uint8)
+    # XOR result, distance, sort key and partition indices per element of the block
+    rows = _block_rows(hashes.size, block_bytes, 25)
+    for start in range(0, queries.size, rows):
+        block = _distances_block(queries[start:start + rows], hashes)
+        # Distance and position combined into one key keep the ordering stable
+        keys = block.astype(np.int64) * hashes.size + np.arange(hashes.size)
+        nearest = np.argpartition(keys, k - 1, axis=1)[:, :k] if k < hashes.size \
+            else np.broadcast_to(np.arange(hashes.size), keys.shape)
+        nearest = np.take_along_axis(nearest, np.argsort(np.take_along_axis(keys, nearest, axis=1), axis=1), axis=1)
+        indices[start:start + rows] = nearest
+        distances[start:start + rows] = np.take_along_axis(block, nearest, axis=1)
+    return indices, distances
@@ -0,0 +1,270 @@
+import math
+
+import imagehash
+import numpy as np
+from PIL import Image
+from image_comparison import instrumentation
+from image_comparison.decode_planner import resolve_reduced_decoding
+from image_comparison.feature_store import load_image_feature
+from image_comparison.image_hash_comparrison import (
+    load_image, HASH_METHODS, REDUCED_DECODE_SIDE_FACTOR,
+    METRIC_AVERAGE_HASH, METRIC_PERCEPTUAL_HASH, METRIC_DIFFERENCE_HASH, METRIC_WAVELET_HASH,
+)
+from image_comparison.instrumentation import STAGE_COLOUR_CONVERSION, STAGE_RESIZE
+
+
+###########################
+# THIS MODULE CONTAINS MULTI-HASH FINGERPRINTS OF IMAGES.
+# AVERAGE, PERCEPTUAL, DIFFERENCE AND WAVELET HASHES (OF CONFIGURABLE SIZES) ARE CALCULATED FROM ONE DECODED
+# IMAGE, CONVERTED TO GREYSCALE ONCE. THE GREYSCALE IMAGE IS HALVED INTO A PYRAMID (Image.reduce), AND EVERY
+# HASH RESIZES THE SMALLEST LEVEL WHICH IS STILL PYRAMID_SIDE_FACTOR TIMES LARGER THAN THE IMAGE THE HASH
+# NEEDS, INSTEAD OF RESIZING THE FULL IMAGE AGAIN FOR EVERY HASH.
+# ALL HASHES OF AN IMAGE ARE KEPT IN ONE RECORD OF A STRUCTURED ARRAY, ONE FIELD OF PACKED BITS PER HASH.
+# Pyramid levels are box filtered, so bits close to the threshold can flip. Larger hashes compare more pixels
+# of similar brightness, so the number of flipped bits grows with the hash bits: on JPEG photos (1-12 MP)
+# the Hamming distance to the hashes of imagehash library was at most 3 of 64 bits (average hash; perceptual
+# and difference hash 2, wavelet hash 0) and 9 of 256 bits (difference hash; average hash 3, perceptual hash 2),
+# within PYRAMID_MAX_HASH_DISTANCE_FRACTION of the hash bits (see get_pyramid_max_hash_distance).
+# Without the pyramid (pyramid_side_factor=None) the hashes are the same as of ImageHashComparison.
+FINGERPRINT_METRICS = tuple(HASH_METHODS)
+DEFAULT_HASH_SIZE = 8
+# Perceptual hash takes DCT of the image resized to hash size times this factor (imagehash default)
+PERCEPTUAL_HIGHFREQ_FACTOR = 4
+PYRAMID_SIDE_FACTOR = 16
+PYRAMID_MAX_HASH_DISTANCE_FRACTION = 3 / 64
+
+
+def get_pyramid_max_hash_distance(hash_size: int) -> int:
+    """
+    :param hash_size: hash size, the hash has hash_size x hash_size bits
+    :return: maximal Hamming distance of pyramid hashes to the hashes of imagehash library
+    """
+    return math.ceil(PYRAMID_MAX_HASH_DISTANCE_FRACTION * hash_size * hash_size)
+
+
+def get_hash_resize_size(metric, hash_size: int, image_size: tuple, wavelet_image_scale=None) -> tuple:
+    """
+    :param metric: one of FINGERPRINT_METRICS
+    :param hash_size: hash size, the hash has hash_size x hash_size bits
+    :param image_size: (width, height) of the full image
+    :param wavelet_image_scale: size of the image of wavelet hash, by default the largest power of 2
+        not longer than the shorter side of the image (imagehash default)
+    :return: (width, height) of the greyscale image the hash is calculated from
+    """
+    if metric == METRIC_AVERAGE_HASH:
+        return hash_size, hash_size
+    if metric == METRIC_PERCEPTUAL_HASH:
+        return hash_size * PERCEPTUAL_HIGHFREQ_FACTOR, hash_size * PERCEPTUAL_HIGHFREQ_FACTOR
+    if metric == METRIC_DIFFERENCE_HASH:
+        return hash_size + 1, hash_size
+    if metric == METRIC_WAVELET_HASH:
+        scale = wavelet_image_scale or max(2 ** int(math.log2(min(image_size))), hash_size)
+        return scale, scale
+    raise ValueError(f"Unknown hash metric: {metric}")
+
+
+def build_greyscale_pyramid(image: Image.Image, min_side: int) -> list:
+    """
+    :param image: decoded PIL image
+    :param min_side: halving stops before the shorter side of a level gets shorter than min_side
+    :return: list of greyscale PIL images, the first of the full size, every next one halved
+    """
+    with instrumentation.stage(STAGE_COLOUR_CONVERSION, mode="greyscale"):
+        levels = [image.convert("L")]
+    while min(levels[-1].size) // 2 >= min_side:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def resize_from_pyramid(pyramid: list, size: tuple, side_factor=PYRAMID_SIDE_FACTOR) -> Image.Image:
+    """
+    Resizes the smallest pyramid level which is at least side_factor times larger than size.
+    :param pyramid: levels built by build_greyscale_pyramid
+    :param size: (width, height) of the resized image
+    :param side_factor: minimal ratio of the sides of the level and the resized image, None resizes the full image
+    :return: resized greyscale PIL image
+    """
+    level = pyramid[0]
+    if side_factor is not None:
+        for candidate in pyramid[1:]:
+            if candidate.width < side_factor * size[0] or candidate.height < side_factor * size[1]:
+                break
+            level = candidate
+    with instrumentation.stage(STAGE_RESIZE, mode="greyscale"):
+        return level.resize(size, Image.Resampling.LANCZOS)
+
+
+def wavelet_hash_bits(image: Image.Image, hash_size: int) -> np.ndarray:
+    """
+    Calculates the same bits as imagehash.whash (Haar wavelets, lowest frequency removed) of a square
+    image of power of 2 size. Haar LL coefficients of hash_size level are the sums of image blocks,
+    and removing the lowest frequency subtracts the same value from all of them, so the bits are the block
+    sums above their median. The sums are exact integers, so they are compared without the wavelet transforms.
+    When the two middle sums are equal, imagehash decides them by floating point rounding, so imagehash is used.
+    :param image: greyscale image resized to the wavelet image scale
+    :param hash_size: hash size, a power of 2
+    :return: hash_size x hash_size bool array
+    """
+    block = image.width // hash_size
+    sums = np.asarray(image, dtype=np.int64).reshape(hash_size, block, hash_size, block).sum(axis=(1, 3))
+    middle = np.partition(sums.ravel(), (sums.size // 2 - 1, sums.size // 2))
+    if middle[sums.size // 2 - 1] == middle[sums.size // 2]:
+        return imagehash.whash(image, hash_size, image_scale=image.width).hash
+    return sums > np.median(sums)
+
+
+def calculate_hash_bits(metric, image: Image.Image, hash_size: int) -> np.ndarray:
+    """
+    :param metric: one of FINGERPRINT_METRICS
+    :param image: greyscale image already resized to get_hash_resize_size
+    :param hash_size: hash size
+    :return: hash_size x hash_size bool array
+    """
+    if metric == METRIC_WAVELET_HASH:
+        return wavelet_hash_bits(image, hash_size)
+    if metric == METRIC_PERCEPTUAL_HASH:
+        return imagehash.phash(image, hash_size, PERCEPTUAL_HIGHFREQ_FACTOR).hash
+    # imagehash resizes to the same size, which only copies the image
+    return HASH_METHODS[metric](image, hash_size).hash
+
+
+def create_fingerprint_dtype(hash_sizes: dict) -> np.dtype:
+    """
+    :param hash_sizes: dictionary of hash sizes by metric
+    :return: structured dtype with one field of packed hash bits (np.packbits order) per metric
+    """
+    return np.dtype([(metric, np.uint8, (-(-hash_size * hash_size // 8),)) for metric, hash_size in hash_sizes.items()])
+
+
+class FingerprintEngine:
+    """
+    Calculates and compares multi-hash fingerprints of images (see module description).
+    Fingerprints of image files are kept in the feature store when it is enabled.
+    """
+    def __init__(self, metrics=FINGERPRINT_METRICS, hash_sizes=DEFAULT_HASH_SIZE,
+                 pyramid_side_factor=PYRAMID_SIDE_FACTOR, wavelet_image_scale=None, reduced_decode=None):
+        """
+        :param metrics: hash metrics of the fingerprint, see FINGERPRINT_METRICS
+        :param hash_sizes: hash size of all metrics, or dictionary of hash sizes by metric (DEFAULT_HASH_SIZE
+            for missing metrics); wavelet hash size must be a power of 2
+        :param pyramid_side_factor: see resize_from_pyramid, None calculates the same hashes as imagehash library
+        :param wavelet_image_scale: see get_hash_resize_size, a power of 2 not smaller than the wavelet hash size
+        :param reduced_decode: True or False, or None for the global setting (see decode_planner)
+        """
+        unknown = [metric for metric in metrics if metric not in FINGERPRINT_METRICS]
+        if unknown or not metrics:
+            raise ValueError(f"Unknown hash metrics: {unknown or metrics}")
+        if not isinstance(hash_sizes, dict):
+            hash_sizes = dict.fromkeys(metrics, hash_sizes)
+        self.hash_sizes = {metric: int(hash_sizes.get(metric, DEFAULT_HASH_SIZE)) for metric in metrics}
+        if min(self.hash_sizes.values()) < 2:
+            raise ValueError("Hash size must be greater than or equal to 2.")
+        wavelet_size = self.hash_sizes.get(METRIC_WAVELET_HASH)
+        if wavelet_size is not None and wavelet_size & (wavelet_size - 1):
+            raise ValueError("Wavelet hash size must be a power of 2.")
+        if wavelet_image_scale is not None and (wavelet_image_scale & (wavelet_image_scale - 1)
+                                                or wavelet_image_scale < (wavelet_size or 0)):
+            raise ValueError("Wavelet image scale must be a power of 2 not smaller than the hash size.")
+        self.pyramid_side_factor = pyramid_side_factor
+        self.wavelet_image_scale = wavelet_image_scale
+        self.reduced_decode = reduced_decode
+        self.dtype = create_fingerprint_dtype(self.hash_sizes)
+        # Hamming distance of the fingerprint fields normalised by the number of hash bits
+        self.bits = {metric: hash_size * hash_size for metric, hash_size in self.hash_sizes.items()}
+
+    def get_min_decoded_side(self):
+        """
+        :return: minimal side of the decoded image (see image_hash_comparrison.get_hash_min_decoded_side),
+            or None when the image is decoded in full
+        """
+        if not resolve_reduced_decoding(self.reduced_decode):
+            return None
+        # Wavelet hash image depends on the decoded size, so only its hash size is kept
+        return REDUCED_DECODE_SIDE_FACTOR * max(
+            max(get_hash_resize_size(metric, hash_size, (hash_size, hash_size), self.wavelet_image_scale))
+            for metric, hash_size in self.hash_sizes.items())
+
+    def get_params(self) -> dict:
+        """
+        :return: parameters the fingerprints depend on, part of the feature store key
+        """
+        return {"hash_sizes": self.hash_sizes, "pyramid_side_factor": self.pyramid_side_factor,
+                "wavelet_image_scale": self.wavelet_image_scale, "min_side": self.get_min_decoded_side()}
+
+    def calculate_fingerprint(self, image: Image.Image) -> np.ndarray:
+        """
+        :param image: decoded PIL image
+        :return: one element array of self.dtype
+        """
+        sizes = {metric: get_hash_resize_size(metric, hash_size, image.size, self.wavelet_image_scale)
+                 for metric, hash_size in self.hash_sizes.items()}
+        min_side = min(min(size) for size in sizes.values()) * (self.pyramid_side_factor or 1)
+        pyramid = build_greyscale_pyramid(image, min_side if self.pyramid_side_factor else math.inf)
+        fingerprint = np.zeros(1, dtype=self.dtype)
+        for metric, hash_size in self.hash_sizes.items():
+            resized = resize_from_pyramid(pyramid, sizes[metric], self.pyramid_side_factor)
+            fingerprint[metric] = np.packbits(np.asarray(calculate_hash_bits(metric, resized, hash_size)).ravel())
+        return fingerprint
+
+    def fingerprint(self, image_path) -> np.ndarray:
+        """
+        :param image_path: File path to the image, or in-memory image (see image_source module)
+        :return: one element array of self.dtype, decoded once for all hashes
+        """
+        min_side = self.get_min_decoded_side()
+        return load_image_feature(image_path, "hash_fingerprint", self.get_params(),
+                                  lambda: [self.calculate_fingerprint(load_image(image_path, min_side))])[0]
+
+    def fingerprint_many(self, image_paths) -> np.ndarray:
+        """
+        :return: array of self.dtype with fingerprints of the images in their order
+        """
+        fingerprints = [self.fingerprint(image_path) for image_path in image_paths]
+        return np.concatenate(fingerprints) if fingerprints else np.zeros(0, dtype=self.dtype)
+
+    def unpack_hash(self, fingerprint: np.ndarray, metric) -> imagehash.ImageHash:
+        """
+        :param fingerprint: fingerprint record or one element array
+        :param metric: hash metric of the fingerprint
+        :return: hash as imagehash.ImageHash
+        """
+        hash_size = self.hash_sizes[metric]
+        bits = np.unpackbits(np.asarray(fingerprint[metric]).ravel())[:hash_size * hash_size]
+        return imagehash.ImageHash(bits.astype(bool).reshape(hash_size, hash_size))
+
+    def hash_distances(self, fingerprints_1: np.ndarray, fingerprints_2: np.ndarray) -> dict:
+        """
+        :param fingerprints_1: array of fingerprints
+        :param fingerprints_2: array of fingerprints broadcastable with fingerprints_1,
+            e.g. fingerprints_1[:, None] and fingerprints_2[None, :] give all pairs
+        :return: dictionary of Hamming distances arrays by metric
+        """
+        return {metric: np.bitwise_count(fingerprints_1[metric] ^ fingerprints_2[metric]).sum(axis=-1, dtype=np.int64)
+                for metric in self.hash_sizes}
+
+    def combined_distance(self, fingerprints_1: np.ndarray, fingerprints_2: np.ndarray, weights=None) -> np.ndarray:
+        """
+        :param fingerprints_1: array of fingerprints
+        :param fingerprints_2: array of fingerprints broadcastable with fingerprints_1
+        :param weights: optional dictionary of weights by metric, all hashes have the same weight by default
+        :return: weighted mean of Hamming distances divided by the number of hash bits, 0 for identical
+            fingerprints and 1 when all bits differ
+        """
+        weights = weights or dict.fromkeys(self.hash_sizes, 1.0)
+        distances = self.hash_distances(fingerprints_1, fingerprints_2)
+        total = sum(weights[metric] * distances[metric] / self.bits[metric] for metric in weights)
+        return total / sum(weights.values())
+
+    def compare(self, image_path_1, image_path_2, weights=None) -> dict:
+        """
+        Compares two images by all hashes of their fingerprints.
+        :param image_path_1: File path to the first image, or in-memory image
+        :param image_path_2: File path to the second image, or in-memory image
+        :param weights: see combined_distance
+        :return: dictionary of Hamming distances by metric and "combined" distance
+        """
+        fingerprint_1, fingerprint_2 = self.fingerprint(image_path_1), self.fingerprint(image_path_2)
+        distances = {metric: int(distance[0]) for metric, distance in
+                     self.hash_distances(fingerprint_1, fingerprint_2).items()}
+        distances["combined"] = float(self.combined_distance(fingerprint_1, fingerprint_2, weights)[0])
+        return distances
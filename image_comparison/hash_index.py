@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+from image_comparison.image_hash_comparrison import load_image, pack_image_hash, get_hash_min_decoded_side, HASH_METHODS
+
+
+###########################
+# THIS MODULE CONTAINS PERSISTENT INDEX OF PACKED 64 BITS IMAGE HASHES
+# FOR NEAR-DUPLICATE SEARCH.
+# THE INDEX IS A DIRECTORY WITH TWO FILES:
+#   hashes.npy - structured array with one uint64 column per hash method, memory-mapped on load
+#   paths.txt  - image paths, one per line, in the same order as hashes
+HASHES_FILE = "hashes.npy"
+PATHS_FILE = "paths.txt"
+
+HASH_DTYPE = np.dtype([(metric, "<u8") for metric in HASH_METHODS])
+
+# Multi-index hashing splits every hash into segments. If two hashes are within Hamming distance k,
+# at least one of their segments is within k // SEGMENTS_COUNT (pigeonhole principle).
+SEGMENTS_COUNT = 4
+SEGMENT_BITS = 16
+# For larger segment radius enumerating neighbour segments is slower than the linear scan
+MAX_SEGMENT_RADIUS = 3
+
+_SEGMENT_POPCOUNT = np.bitwise_count(np.arange(1 << SEGMENT_BITS, dtype=np.uint16))
+
+
+def hash_image(image_path) -> np.ndarray:
+    """
+    Calculates all supported hashes of the image, decoding it once
+    (at reduced resolution when enabled, see decode_planner.set_reduced_decoding).
+    :param image_path: path to the image file
+    :return: one element array of HASH_DTYPE
+    """
+    img = load_image(image_path, get_hash_min_decoded_side(HASH_METHODS))
+    record = np.zeros(1, dtype=HASH_DTYPE)
+    for metric, hash_method in HASH_METHODS.items():
+        record[metric] = pack_image_hash(hash_method(img))
+    return record
+
+
+class _MultiIndex:
+    """
+    Multi-index hashing table of one hash column: for every segment the segment values are kept sorted,
+    so hashes with given segment value are found by binary search.
+    """
+    def __init__(self, hashes: np.ndarray):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self.orders = []
+        self.sorted_segments = []
+        for segment in range(SEGMENTS_COUNT):
+            values = self._segment(self.hashes, segment)
+            order = np.argsort(values, kind="stable")
+            self.orders.append(order)
+            self.sorted_segments.append(values[order])
+
+    @staticmethod
+    def _segment(hashes, segment):
+        return ((hashes >> np.uint64(segment * SEGMENT_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+
+    def search(self, query: np.uint64, max_distance: int) -> tuple:
+        """
+        :return: tuple of arrays with positions and distances of hashes within max_distance from the query
+        """
+        radius = max_distance // SEGMENTS_COUNT
+        if radius > MAX_SEGMENT_RADIUS:
+            candidates = np.arange(self.hashes.size)
+        else:
+            masks = np.nonzero(_SEGMENT_POPCOUNT <= radius)[0].astype(np.uint16)
+            found = []
+            for segment in range(SEGMENTS_COUNT):
+                values = np.sort(self._segment(np.array([query], dtype=np.uint64), segment)[0] ^ masks)
+                left = np.searchsorted(self.sorted_segments[segment], values, side="left")
+                right = np.searchsorted(self.sorted_segments[segment], values, side="right")
+                found.extend(self.orders[segment][start:end] for start, end in zip(left, right) if start < end)
+            candidates = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.intp)
+        distances = np.bitwise_count(self.hashes[candidates] ^ query)
+        within = distances <= max_distance
+        return candidates[within], distances[within]
+
+
+class HashIndex:
+    """
+    Persistent index of average, perceptual, difference and wavelet hashes of images.
+    Hashes are stored as packed 64 bits integers in a .npy file, memory-mapped when the index is opened,
+    and searched with multi-index hashing instead of comparing the query with every stored hash.
+    """
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._tables = {}
+        hashes_path = os.path.join(index_dir, HASHES_FILE)
+        if os.path.exists(hashes_path):
+            self.hashes = np.load(hashes_path, mmap_mode="r")
+            with open(os.path.join(index_dir, PATHS_FILE)) as paths:
+                self.paths = paths.read().splitlines()
+        else:
+            self.hashes = np.zeros(0, dtype=HASH_DTYPE)
+            self.paths = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, image_paths):
+        """
+        Hashes the images and adds them to the index. Call save to persist the index.
+        :param image_paths: iterable of image paths
+        """
+        image_paths = list(image_paths)
+        if not image_paths:
+            return
+        new_hashes = np.concatenate([hash_image(image_path) for image_path in image_paths])
+        self.hashes = np.concatenate([np.asarray(self.hashes), new_hashes])
+        self.paths.extend(image_paths)
+        self._tables = {}
+
+    def save(self):
+        """
+        Writes the index into its directory. Files are replaced atomically.
+        """
+        os.makedirs(self.index_dir, exist_ok=True)
+        hashes_path = os.path.join(self.index_dir, HASHES_FILE)
+        paths_path = os.path.join(self.index_dir, PATHS_FILE)
+        with open(hashes_path + ".tmp", "wb") as hashes_file:
+            np.save(hashes_file, np.asarray(self.hashes))
+        with open(paths_path + ".tmp", "w") as paths_file:
+            paths_file.writelines(path + "\n" for path in self.paths)
+        os.replace(hashes_path + ".tmp", hashes_path)
+        os.replace(paths_path + ".tmp", paths_path)
+        self.hashes = np.load(hashes_path, mmap_mode="r")
+
+    def _table(self, metric) -> _MultiIndex:
+        if metric not in HASH_METHODS:
+            raise ValueError(f"Unknown hash metric: {metric}")
+        table = self._tables.get(metric)
+        if table is None:
+            table = _MultiIndex(self.hashes[metric])
+            self._tables[metric] = table
+        return table
+
+    def search_hash(self, packed_hash, max_distance: int, metric="perceptual_hash") -> list:
+        """
+        Finds all indexed images within Hamming distance from the packed hash.
+        :param packed_hash: hash packed by pack_image_hash
+        :param max_distance: maximal Hamming distance
+        :param metric: hash method name (see HASH_METHODS)
+        :return: list of (image path, distance) tuples sorted by distance
+        """
+        positions, distances = self._table(metric).search(np.uint64(packed_hash), max_distance)
+        order = np.lexsort((positions, distances))
+        return [(self.paths[positions[i]], int(distances[i])) for i in order]
+
+    def search(self, image_path, max_distance: int, metric="perceptual_hash") -> list:
+        """
+        Finds all indexed images within Hamming distance from the image.
+        :param image_path: path to the query image
+        :param max_distance: maximal Hamming distance
+        :param metric: hash method name (see HASH_METHODS)
+        :return: list of (image path, distance) tuples sorted by distance
+        """
+        if metric not in HASH_METHODS:
+            raise ValueError(f"Unknown hash metric: {metric}")
+        img = load_image(image_path, get_hash_min_decoded_side(HASH_METHODS))
+        return self.search_hash(pack_image_hash(HASH_METHODS[metric](img)), max_distance, metric)
@@ -0,0 +1,325 @@
+import json
+import os
+
+import cv2
+import numpy as np
+from image_comparison import instrumentation
+from image_comparison.feature_store import load_image_feature
+from image_comparison.instrumentation import STAGE_COLOUR_CONVERSION
+from image_comparison.opencv_image_comparator import load_image_colored, load_image_greyscale
+
+
+###########################
+# THIS MODULE CONTAINS BATCHED HISTOGRAM ENGINE.
+# HISTOGRAMS OF AN IMAGE ARE CALCULATED INTO ONE MATRIX (ONE ROW PER CHANNEL, OR ONE ROW OF A JOINT 3D
+# BGR/HSV HISTOGRAM), NORMALIZED TO SUM 1 PER ROW. A GALLERY STACKS THE MATRICES OF MANY IMAGES AND COMPARES
+# A QUERY WITH ALL OF THEM IN ONE VECTORIZED OPERATION, USING THE FORMULAS OF cv2.compareHist.
+# Scores of per-channel histograms are averaged across the channels, like histogram_correlation_colored.
+HISTOGRAM_GREYSCALE = "greyscale"
+HISTOGRAM_CHANNELS = "channels"
+HISTOGRAM_JOINT_BGR = "joint_bgr"
+HISTOGRAM_JOINT_HSV = "joint_hsv"
+HISTOGRAM_TYPES = (HISTOGRAM_GREYSCALE, HISTOGRAM_CHANNELS, HISTOGRAM_JOINT_BGR, HISTOGRAM_JOINT_HSV)
+
+# Bins per channel; joint histograms have bins ** 3 cells
+DEFAULT_CHANNEL_BINS = 256
+DEFAULT_JOINT_BINS = 8
+# OpenCV stores hue of 8 bits images as 0..179
+_HUE_RANGE = 180
+
+COMPARE_CORRELATION = "correlation"
+COMPARE_CHI_SQUARE = "chi_square"
+COMPARE_INTERSECTION = "intersection"
+COMPARE_BHATTACHARYYA = "bhattacharyya"
+# Whether higher score means more similar images
+COMPARE_METHODS = {COMPARE_CORRELATION: True, COMPARE_CHI_SQUARE: False, COMPARE_INTERSECTION: True,
+                   COMPARE_BHATTACHARYYA: False}
+
+# Compact storage keeps every row divided by its maximum with one float32 scale per row.
+# uint16 rows are quantized to 0..65535, which keeps about 5 significant digits of the largest bins.
+STORAGE_DTYPES = (np.float32, np.float16, np.uint16)
+_UINT16_MAX = 65535
+# Memory used by the intermediate float64 arrays of one block of compared histograms
+DEFAULT_BLOCK_BYTES = 64 * 1024 * 1024
+
+VALUES_FILE = "histograms.npy"
+SCALES_FILE = "scales.npy"
+PATHS_FILE = "paths.txt"
+SETTINGS_FILE = "settings.json"
+
+
+def get_default_bins(histogram_type) -> int:
+    if histogram_type not in HISTOGRAM_TYPES:
+        raise ValueError(f"Unknown histogram type: {histogram_type}")
+    return DEFAULT_JOINT_BINS if histogram_type in (HISTOGRAM_JOINT_BGR, HISTOGRAM_JOINT_HSV) else DEFAULT_CHANNEL_BINS
+
+
+def _check_method(method):
+    if method not in COMPARE_METHODS:
+        raise ValueError(f"Unknown histogram comparison method: {method}")
+
+
+def normalize_histograms(histograms: np.ndarray) -> np.ndarray:
+    """
+    :param histograms: array of histograms, bins in the last axis
+    :return: float32 histograms divided by their sums (empty histograms stay zero)
+    """
+    histograms = np.asarray(histograms, dtype=np.float32)
+    sums = histograms.sum(axis=-1, keepdims=True)
+    return histograms / np.where(sums > 0, sums, 1)
+
+
+def calculate_histograms(image: np.ndarray, histogram_type=HISTOGRAM_CHANNELS, bins=None) -> np.ndarray:
+    """
+    Calculates histograms of the image into one matrix.
+    :param image: BGR image (grayscale image for HISTOGRAM_GREYSCALE) as np.ndarray
+    :param histogram_type: one of HISTOGRAM_TYPES
+    :param bins: bins per channel, DEFAULT_CHANNEL_BINS or DEFAULT_JOINT_BINS when omitted
+    :return: float32 matrix with normalized histograms in rows, channels x bins for per-channel histograms,
+        1 x bins ** 3 for joint histograms
+    """
+    bins = get_default_bins(histogram_type) if bins is None else int(bins)
+    if histogram_type in (HISTOGRAM_GREYSCALE, HISTOGRAM_CHANNELS):
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        histograms = np.empty((channels, bins), dtype=np.float32)
+        for channel in range(channels):
+            histograms[channel] = cv2.calcHist([image], [channel], None, [bins], [0, 256]).ravel()
+        return normalize_histograms(histograms)
+    if image.ndim != 3 or image.shape[2] != 3:
+        raise ValueError(f"Joint histograms need BGR image, got array of shape {image.shape}")
+    ranges = [0, 256, 0, 256, 0, 256]
+    if histogram_type == HISTOGRAM_JOINT_HSV:
+        with instrumentation.stage(STAGE_COLOUR_CONVERSION, conversion="to_hsv"):
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        ranges[1] = _HUE_RANGE
+    # One pass over the pixels for all three channels
+    histogram = cv2.calcHist([image], [0, 1, 2], None, [bins] * 3, ranges)
+    return normalize_histograms(histogram.reshape(1, -1))
+
+
+def load_histograms(image_path, histogram_type=HISTOGRAM_CHANNELS, bins=None) -> np.ndarray:
+    """
+    Calculates histograms of the image (see calculate_histograms), keeping them in the feature store.
+    :param image_path: image path or in-memory image source
+    :return: float32 matrix with normalized histograms in rows
+    """
+    bins = get_default_bins(histogram_type) if bins is None else int(bins)
+
+    def calculate():
+        loader = load_image_greyscale if histogram_type == HISTOGRAM_GREYSCALE else load_image_colored
+        return [calculate_histograms(loader(image_path), histogram_type, bins)]
+    return load_image_feature(image_path, "histogram_matrix", {"type": histogram_type, "bins": bins}, calculate)[0]
+
+
+def encode_histograms(histograms: np.ndarray, dtype=np.float32) -> tuple:
+    """
+    Converts histograms to the storage dtype.
+    :param histograms: array of histograms, bins in the last axis
+    :param dtype: one of STORAGE_DTYPES
+    :return: tuple of stored values and float32 scales (one per histogram), histograms = values * scales
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in [np.dtype(storage_dtype) for storage_dtype in STORAGE_DTYPES]:
+        raise ValueError(f"Unsupported histogram storage dtype: {dtype}")
+    histograms = np.asarray(histograms, dtype=np.float32)
+    if dtype == np.float32:
+        return histograms, np.ones(histograms.shape[:-1], dtype=np.float32)
+    maxima = histograms.max(axis=-1)
+    maxima = np.where(maxima > 0, maxima, 1).astype(np.float32)
+    relative = histograms / maxima[..., None]
+    if dtype == np.uint16:
+        return np.rint(relative * _UINT16_MAX).astype(np.uint16), maxima / _UINT16_MAX
+    return relative.astype(np.float16), maxima
+
+
+def decode_histograms(values: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    :return: float64 histograms encoded by encode_histograms
+    """
+    return np.asarray(values, dtype=np.float64) * np.asarray(scales, dtype=np.float64)[..., None]
+
+
+def _compare_block(query: np.ndarray, histograms: np.ndarray, method) -> np.ndarray:
+    # query is channels x bins, histograms are N x channels x bins, both float64; scores are N x channels.
+    # Thresholds and degenerate cases are the same as in cv2.compareHist, query is its first histogram.
+    if method == COMPARE_CORRELATION:
+        centred_query = query - query.mean(axis=-1, keepdims=True)
+        centred = histograms - histograms.mean(axis=-1, keepdims=True)
+        numerator = np.einsum("ncb,cb->nc", centred, centred_query)
+        denominator = np.einsum("ncb,ncb->nc", centred, centred) * (centred_query ** 2).sum(axis=-1)
+        valid = np.abs(denominator) > np.finfo(np.float64).eps
+        return np.where(valid, numerator / np.sqrt(np.where(valid, denominator, 1)), 1.0)
+    if method == COMPARE_CHI_SQUARE:
+        valid = np.abs(query) > np.finfo(np.float64).eps
+        inverse_query = np.where(valid, 1 / np.where(valid, query, 1), 0)
+        return np.einsum("ncb,cb->nc", (histograms - query) ** 2, inverse_query)
+    if method == COMPARE_INTERSECTION:
+        return np.minimum(histograms, query).sum(axis=-1)
+    products = np.einsum("ncb,cb->nc", np.sqrt(histograms), np.sqrt(query))
+    sums = histograms.sum(axis=-1) * query.sum(axis=-1)
+    valid = np.abs(sums) > np.finfo(np.float32).eps
+    scale = np.where(valid, 1 / np.sqrt(np.where(valid, sums, 1)), 1.0)
+    return np.sqrt(np.maximum(1 - products * scale, 0))
+
+
+def compare_histogram_matrix(query: np.ndarray, values: np.ndarray, scales=None, method=COMPARE_CORRELATION,
+                             block_bytes=DEFAULT_BLOCK_BYTES) -> np.ndarray:
+    """
+    Compares the query histograms with N stored histograms at once.
+    Rows are processed in blocks, so temporary memory is bounded by block_bytes.
+    :param query: channels x bins histograms of the query image
+    :param values: N x channels x bins stored histograms (see encode_histograms)
+    :param scales: N x channels scales of compactly stored histograms, omitted for float histograms
+    :param method: one of COMPARE_METHODS
+    :param block_bytes: memory limit of the temporary arrays
+    :return: np.ndarray of N float64 scores, averaged across the channels
+    """
+    _check_method(method)
+    query = np.asarray(query, dtype=np.float64)
+    if values.shape[1:] != query.shape:
+        raise ValueError(f"Query histograms of shape {query.shape} do not match stored {values.shape[1:]}")
+    scores = np.empty(values.shape[0], dtype=np.float64)
+    # Decoded histograms and two temporary arrays of the same size per block
+    rows = max(1, block_bytes // (max(query.size, 1) * 8 * 3))
+    for start in range(0, values.shape[0], rows):
+        block = values[start:start + rows]
+        block = np.asarray(block, dtype=np.float64) if scales is None else decode_histograms(
+            block, scales[start:start + rows])
+        scores[start:start + rows] = _compare_block(query, block, method).mean(axis=-1)
+    return scores
+
+
+def compare_histograms(histograms_1: np.ndarray, histograms_2: np.ndarray, method=COMPARE_CORRELATION) -> float:
+    """
+    :return: score of two histogram matrices, averaged across the channels
+    """
+    return float(compare_histogram_matrix(histograms_1, np.asarray(histograms_2)[None], method=method)[0])
+
+
+def compare_image_histograms(image_path_1, image_path_2, method=COMPARE_CORRELATION,
+                             histogram_type=HISTOGRAM_CHANNELS, bins=None) -> float:
+    """
+    Compares histograms of two images. Normalized histograms do not depend on the image size,
+    so the images are not resized.
+    :param image_path_1: path to the first image (or in-memory image source)
+    :param image_path_2: path to the second image
+    :param method: one of COMPARE_METHODS
+    :param histogram_type: one of HISTOGRAM_TYPES
+    :param bins: bins per channel
+    :return: similarity score, see COMPARE_METHODS for its direction
+    """
+    return compare_histograms(load_histograms(image_path_1, histogram_type, bins),
+                              load_histograms(image_path_2, histogram_type, bins), method)
+
+
+class HistogramGallery:
+    """
+    Stacked histograms of many images compared with a query in one vectorized operation.
+    Histograms are kept as N x channels x bins matrix of the storage dtype (see STORAGE_DTYPES);
+    a saved gallery is memory-mapped when opened.
+    """
+    def __init__(self, histogram_type=HISTOGRAM_CHANNELS, bins=None, dtype=np.float32):
+        self.histogram_type = histogram_type
+        self.bins = get_default_bins(histogram_type) if bins is None else int(bins)
+        self.dtype = np.dtype(dtype)
+        rows, columns = self._shape()
+        self.values, self.scales = encode_histograms(np.zeros((0, rows, columns), dtype=np.float32), self.dtype)
+        self.paths = []
+
+    def _shape(self) -> tuple:
+        if self.histogram_type == HISTOGRAM_GREYSCALE:
+            return 1, self.bins
+        if self.histogram_type == HISTOGRAM_CHANNELS:
+            return 3, self.bins
+        return 1, self.bins ** 3
+
+    def __len__(self):
+        return len(self.paths)
+
+    def calculate(self, image_path) -> np.ndarray:
+        """
+        :return: histograms of the image with the settings of the gallery
+        """
+        return load_histograms(image_path, self.histogram_type, self.bins)
+
+    def add_histograms(self, histograms: np.ndarray, paths):
+        """
+        :param histograms: N x channels x bins normalized histograms
+        :param paths: N image paths (or other labels) of the histograms
+        """
+        histograms = np.asarray(histograms, dtype=np.float32)
+        paths = [os.fspath(path) for path in paths]
+        if histograms.shape[1:] != self._shape() or histograms.shape[0] != len(paths):
+            raise ValueError(f"Expected {len(paths)} histograms of shape {self._shape()}, got {histograms.shape}")
+        values, scales = encode_histograms(histograms, self.dtype)
+        self.values = np.concatenate([np.asarray(self.values), values])
+        self.scales = np.concatenate([np.asarray(self.scales), scales])
+        self.paths.extend(paths)
+
+    def add(self, image_paths):
+        """
+        Calculates histograms of the images and adds them to the gallery.
+        :param image_paths: iterable of image paths
+        """
+        image_paths = list(image_paths)
+        if image_paths:
+            self.add_histograms(np.stack([self.calculate(image_path) for image_path in image_paths]), image_paths)
+
+    def compare_histograms(self, histograms: np.ndarray, method=COMPARE_CORRELATION,
+                           block_bytes=DEFAULT_BLOCK_BYTES) -> np.ndarray:
+        """
+        :param histograms: channels x bins normalized histograms of the query
+        :return: np.ndarray of scores of all images of the gallery, in the order they were added
+        """
+        return compare_histogram_matrix(histograms, self.values, self.scales, method, block_bytes)
+
+    def compare(self, image_path, method=COMPARE_CORRELATION, block_bytes=DEFAULT_BLOCK_BYTES) -> np.ndarray:
+        """
+        :param image_path: path to the query image
+        :return: np.ndarray of scores of all images of the gallery, in the order they were added
+        """
+        return self.compare_histograms(self.calculate(image_path), method, block_bytes)
+
+    def best_matches(self, image_path, k: int, method=COMPARE_CORRELATION) -> list:
+        """
+        Finds k images of the gallery most similar to the query image.
+        :param image_path: path to the query image
+        :param k: number of matches, limited to the size of the gallery
+        :param method: one of COMPARE_METHODS
+        :return: list of (image path, score) tuples, most similar first; equal scores are ordered by position
+        """
+        scores = self.compare(image_path, method)
+        ranking = -scores if COMPARE_METHODS[method] else scores
+        order = np.argsort(ranking, kind="stable")[:k]
+        return [(self.paths[position], float(scores[position])) for position in order]
+
+    def save(self, gallery_dir):
+        """
+        Writes the gallery into a directory. Files are replaced atomically.
+        """
+        os.makedirs(gallery_dir, exist_ok=True)
+        settings = {"histogram_type": self.histogram_type, "bins": self.bins, "dtype": self.dtype.name}
+        contents = {VALUES_FILE: np.asarray(self.values), SCALES_FILE: np.asarray(self.scales)}
+        for name, array in contents.items():
+            with open(os.path.join(gallery_dir, name + ".tmp"), "wb") as array_file:
+                np.save(array_file, array)
+        with open(os.path.join(gallery_dir, PATHS_FILE + ".tmp"), "w") as paths_file:
+            paths_file.writelines(path + "\n" for path in self.paths)
+        with open(os.path.join(gallery_dir, SETTINGS_FILE + ".tmp"), "w") as settings_file:
+            json.dump(settings, settings_file)
+        for name in (VALUES_FILE, SCALES_FILE, PATHS_FILE, SETTINGS_FILE):
+            os.replace(os.path.join(gallery_dir, name + ".tmp"), os.path.join(gallery_dir, name))
+
+    @classmethod
+    def open(cls, gallery_dir) -> "HistogramGallery":
+        """
+        Opens a saved gallery; stored histograms are memory-mapped.
+        """
+        with open(os.path.join(gallery_dir, SETTINGS_FILE)) as settings_file:
+            settings = json.load(settings_file)
+        gallery = cls(settings["histogram_type"], settings["bins"], settings["dtype"])
+        gallery.values = np.load(os.path.join(gallery_dir, VALUES_FILE), mmap_mode="r")
+        gallery.scales = np.load(os.path.join(gallery_dir, SCALES_FILE))
+        with open(os.path.join(gallery_dir, PATHS_FILE)) as paths_file:
+            gallery.paths = paths_file.read().splitlines()
+        return gallery
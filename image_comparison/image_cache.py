@@ -0,0 +1,199 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from image_comparison import instrumentation
+from image_comparison.instrumentation import (
+    STAGE_DECODE, COUNTER_CACHE_HITS, COUNTER_CACHE_MISSES, COUNTER_DECODED_BYTES,
+)
+
+
+###########################
+# THIS MODULE CONTAINS PROCESS-WIDE CACHE OF DECODED IMAGES
+# SHARED BY ALL IMAGE COMPARATORS
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+MODE_COLOURED = "coloured"
+MODE_GREYSCALE = "greyscale"
+MODE_PIL = "pil"
+MODE_PYRAMID = "pyramid"
+
+
+def get_image_nbytes(img) -> int:
+    """
+    Utility method to estimate the memory held by a decoded image.
+    :param img: np.ndarray, PIL image or list of images (e.g. image pyramid)
+    :return: size of the decoded pixels in bytes
+    """
+    if isinstance(img, (list, tuple)):
+        return sum(get_image_nbytes(level) for level in img)
+    if isinstance(img, np.ndarray):
+        return img.nbytes
+    width, height = img.size
+    return width * height * len(img.getbands())
+
+
+def build_cache_key(image_path, mode):
+    """
+    Builds cache key for an image file. The key contains file modification time and size,
+    so an entry is never returned for a file which was re-written.
+    :param image_path: path to the image file
+    :param mode: colour mode of the decoded image
+    :return: tuple usable as cache key or None when the file can not be accessed or the image is not a file
+    """
+    if not isinstance(image_path, (str, os.PathLike)):
+        return None
+    try:
+        stat = os.stat(image_path)
+    except (OSError, TypeError, ValueError):
+        return None
+    return os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, mode
+
+
+class ImageCache:
+    """
+    Thread safe LRU cache of decoded images bounded by the total size of the stored pixels.
+    Setting max_bytes to 0 disables caching.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def current_bytes(self) -> int:
+        return self._current_bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # Probe which neither counts a hit or miss nor changes the LRU order
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """
+        Returns cached image and marks it as the most recently used one.
+        :param key: cache key
+        :return: cached image or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, img):
+        """
+        Stores image in the cache, evicting the least recently used images when the size limit is exceeded.
+        Images larger than the whole cache are not stored.
+        :param key: cache key
+        :param img: decoded image
+        """
+        nbytes = get_image_nbytes(img)
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._current_bytes -= previous[1]
+            self._entries[key] = (img, nbytes)
+            self._current_bytes += nbytes
+            self._evict()
+
+    def resize(self, max_bytes: int):
+        """
+        Changes the size limit of the cache, evicting images when needed.
+        :param max_bytes: new limit in bytes
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """
+        Removes all images and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        """
+        :return: dictionary with hit, miss and eviction counters and current cache size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "current_bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _evict(self):
+        while self._current_bytes > self.max_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self._current_bytes -= nbytes
+            self.evictions += 1
+
+
+_IMAGE_CACHE = ImageCache()
+
+
+def get_image_cache() -> ImageCache:
+    """
+    :return: process wide cache of decoded images
+    """
+    return _IMAGE_CACHE
+
+
+def _mode_label(mode) -> str:
+    # Derived modes (e.g. pyramids) are tuples starting with the mode name
+    return mode[0] if isinstance(mode, tuple) else mode
+
+
+def _decode(image_path, mode, loader):
+    if not instrumentation.is_enabled():
+        return loader(image_path)
+    with instrumentation.stage(STAGE_DECODE, mode=_mode_label(mode)):
+        img = loader(image_path)
+    instrumentation.count(COUNTER_DECODED_BYTES, get_image_nbytes(img), mode=_mode_label(mode))
+    return img
+
+
+def load_cached_image(image_path, mode, loader):
+    """
+    Returns decoded image from the process wide cache, calling the loader on cache miss.
+    Cached numpy images are marked read-only, as they are shared between all callers.
+    :param image_path: path to the image file
+    :param mode: colour mode of the decoded image
+    :param loader: callable accepting image path and returning decoded image
+    :return: decoded image
+    """
+    key = build_cache_key(image_path, mode)
+    if key is None:
+        return _decode(image_path, mode, loader)
+    img = _IMAGE_CACHE.get(key)
+    if instrumentation.is_enabled():
+        instrumentation.count(COUNTER_CACHE_MISSES if img is None else COUNTER_CACHE_HITS, mode=_mode_label(mode))
+    if img is None:
+        img = _decode(image_path, mode, loader)
+        for array in (img if isinstance(img, list) else [img]):
+            if isinstance(array, np.ndarray):
+                array.setflags(write=False)
+        _IMAGE_CACHE.put(key, img)
+    return img
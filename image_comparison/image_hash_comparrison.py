@@ -2,31 +2,129 @@ from PIL import Image
 import imagehash
 import numpy as np
 from image_comparison.abstract_image_comparator import AbstractImageComparison
+from image_comparison.image_cache import load_cached_image, MODE_PIL
+from image_comparison.decode_planner import load_reduced_image, resolve_reduced_decoding
+from image_comparison.feature_store import load_image_feature
+from image_comparison.image_source import is_image_path, load_pil_from_source
+from image_comparison.instrumentation import timed, record_value, STAGE_METRIC
 
 
 ###########################
 # THIS MODULE CONTAINS IMAGE COMPARISON UTILITY
 # BASED ON "IMAGEHASH" LIBRARY
-def load_image(image_path):
-    return Image.open(image_path)
+def _decode_image(image_path):
+    img = Image.open(image_path)
+    img.load()
+    return img
 
 
-def load_two_images(image_path_1, image_path_2) -> tuple:
-    img1 = load_image(image_path_1)
-    img2 = load_image(image_path_2)
+# HASH METHODS BY METRIC NAME
+METRIC_AVERAGE_HASH = "average_hash"
+METRIC_PERCEPTUAL_HASH = "perceptual_hash"
+METRIC_DIFFERENCE_HASH = "difference_hash"
+METRIC_WAVELET_HASH = "wavelet_hash"
+
+HASH_METHODS = {
+    METRIC_AVERAGE_HASH: imagehash.average_hash,
+    METRIC_PERCEPTUAL_HASH: imagehash.phash,
+    METRIC_DIFFERENCE_HASH: imagehash.dhash,
+    METRIC_WAVELET_HASH: imagehash.whash,
+}
+
+# With reduced-resolution decoding (see decode_planner) JPEG images are decoded so that both sides stay at least
+# REDUCED_DECODE_SIDE_FACTOR times longer than the image the hash method resizes to (8x8, 32x32 for
+# perceptual hash, 9x8 for difference hash). Hashes are thresholded, so bits close to the threshold can flip:
+# on JPEG photos (1-12 MP) the Hamming distance to the hash of the fully decoded image was at most
+# REDUCED_DECODE_MAX_HASH_DISTANCE bits (perceptual hash; average and difference hash at most 1,
+# wavelet hash 0) and 0 for the large majority of images.
+REDUCED_DECODE_SIDE_FACTOR = 16
+REDUCED_DECODE_MAX_HASH_DISTANCE = 2
+HASH_MIN_DECODED_SIDES = {
+    METRIC_AVERAGE_HASH: 8 * REDUCED_DECODE_SIDE_FACTOR,
+    METRIC_PERCEPTUAL_HASH: 32 * REDUCED_DECODE_SIDE_FACTOR,
+    METRIC_DIFFERENCE_HASH: 9 * REDUCED_DECODE_SIDE_FACTOR,
+    METRIC_WAVELET_HASH: 8 * REDUCED_DECODE_SIDE_FACTOR,
+}
+
+
+def get_hash_min_decoded_side(metrics, reduced_decode=None):
+    """
+    :param metrics: hash metric name or iterable of names calculated from the same decoded image
+    :param reduced_decode: True or False chosen per call, or None for the global setting (see decode_planner)
+    :return: minimal side of the decoded image, or None when the image is decoded in full
+    """
+    if not resolve_reduced_decoding(reduced_decode):
+        return None
+    if isinstance(metrics, str):
+        return HASH_MIN_DECODED_SIDES[metrics]
+    return max(HASH_MIN_DECODED_SIDES[metric] for metric in metrics)
+
+
+def load_image(image_path, min_side=None):
+    """
+    :param image_path: File path to the image to load, or in-memory image (see image_source module)
+    :param min_side: when given, JPEG files are decoded at reduced resolution keeping both sides at least
+        min_side long (see decode_planner)
+    :return: PIL image
+    """
+    if not is_image_path(image_path):
+        return load_pil_from_source(image_path)
+    if min_side is not None:
+        return load_reduced_image(image_path, min_side)
+    return load_cached_image(image_path, MODE_PIL, _decode_image)
+
+
+def load_two_images(image_path_1, image_path_2, min_side=None) -> tuple:
+    img1 = load_image(image_path_1, min_side)
+    img2 = load_image(image_path_2, min_side)
     return img1, img2
 
 
 def get_difference(hash1: imagehash.ImageHash, hash2: imagehash.ImageHash):
     diff = hash1 - hash2
-    print(f"Hash difference is: {diff}")
+    record_value("hash_difference", diff)
     return diff
 
 
-def get_hashes_difference(image_path_1, image_path_2, comparison_method):
-    img1, img2 = load_two_images(image_path_1, image_path_2)
-    hash1 = comparison_method(img1)
-    hash2 = comparison_method(img2)
+def pack_image_hash(image_hash: imagehash.ImageHash) -> np.uint64:
+    """
+    Packs 64 bits image hash (hash_size=8) into unsigned 64 bits integer.
+    Bits are packed in the same order as in the hexadecimal representation of the hash.
+    :param image_hash: image hash calculated by imagehash library
+    :return: hash as np.uint64
+    """
+    bits = np.asarray(image_hash.hash, dtype=bool).flatten()
+    if bits.size != 64:
+        raise ValueError("Only 64 bits hashes (hash_size=8) can be packed.")
+    return np.packbits(bits).view(">u8")[0].astype(np.uint64)
+
+
+def unpack_image_hash(packed_hash) -> imagehash.ImageHash:
+    """
+    Converts packed 64 bits hash back into image hash.
+    :param packed_hash: hash packed by pack_image_hash
+    :return: imagehash.ImageHash
+    """
+    packed = np.array([packed_hash], dtype=">u8").view(np.uint8)
+    return imagehash.ImageHash(np.unpackbits(packed).astype(bool).reshape(8, 8))
+
+
+def load_image_hash(image_path, comparison_method, min_side=None) -> imagehash.ImageHash:
+    """
+    Calculates hash of the image, keeping it in the feature store (see feature_store module).
+    :param image_path: File path to the image, or in-memory image
+    :param comparison_method: hash function of imagehash library
+    :param min_side: minimal side of the decoded image (see load_image)
+    :return: image hash
+    """
+    bits = load_image_feature(image_path, comparison_method.__name__, {"min_side": min_side},
+                              lambda: [comparison_method(load_image(image_path, min_side)).hash])[0]
+    return imagehash.ImageHash(bits)
+
+
+def get_hashes_difference(image_path_1, image_path_2, comparison_method, min_side=None):
+    hash1 = load_image_hash(image_path_1, comparison_method, min_side)
+    hash2 = load_image_hash(image_path_2, comparison_method, min_side)
     return get_difference(hash1, hash2)
 
 
@@ -37,17 +135,25 @@ class ImageHashComparison(AbstractImageComparison):
         super().__init__(img_path_1, img_path_2)
 
     # COMPARE IMAGES USING AVERAGE HASH
-    def compare_images_average_hash(self):
-        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.average_hash)
+    @timed(STAGE_METRIC, metric=METRIC_AVERAGE_HASH)
+    def compare_images_average_hash(self, reduced_decode=None):
+        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.average_hash,
+                                     get_hash_min_decoded_side(METRIC_AVERAGE_HASH, reduced_decode))
 
     # COMPARE IMAGES USING PERCEPTUAL HASH
-    def compare_images_perceptual_hash(self):
-        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.phash)
+    @timed(STAGE_METRIC, metric=METRIC_PERCEPTUAL_HASH)
+    def compare_images_perceptual_hash(self, reduced_decode=None):
+        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.phash,
+                                     get_hash_min_decoded_side(METRIC_PERCEPTUAL_HASH, reduced_decode))
 
     # COMPARE IMAGES USING IMAGES DIFFERENCE HASH
-    def compare_images_difference_hash(self):
-        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.dhash)
+    @timed(STAGE_METRIC, metric=METRIC_DIFFERENCE_HASH)
+    def compare_images_difference_hash(self, reduced_decode=None):
+        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.dhash,
+                                     get_hash_min_decoded_side(METRIC_DIFFERENCE_HASH, reduced_decode))
 
     # COMPARE IMAGES BY WAVELET HASH
-    def compare_images_wavelet_hash(self):
-        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.whash)
\ No newline at end of file
+    @timed(STAGE_METRIC, metric=METRIC_WAVELET_HASH)
+    def compare_images_wavelet_hash(self, reduced_decode=None):
+        return get_hashes_difference(self.image_path_1, self.image_path_2, imagehash.whash,
+                                     get_hash_min_decoded_side(METRIC_WAVELET_HASH, reduced_decode))
\ No newline at end of file
@@ -0,0 +1,143 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+from image_comparison import instrumentation
+from image_comparison.abstract_image_comparator import check_image_loaded
+from image_comparison.instrumentation import (
+    STAGE_DECODE, STAGE_COLOUR_CONVERSION, COUNTER_ENCODED_BYTES, COUNTER_DECODED_BYTES,
+)
+
+
+###########################
+# THIS MODULE CONTAINS LOADING OF IMAGES FROM IN-MEMORY SOURCES.
+# COMPARATORS ACCEPT FILE PATHS, ENCODED IMAGE BUFFERS (bytes, bytearray, memoryview, e.g. PNG screenshots
+# FROM SELENIUM), DECODED np.ndarray IMAGES (BGR CHANNEL ORDER, AS RETURNED BY OPENCV) AND PIL IMAGES.
+# ONLY FILE PATHS ARE CACHED, IN-MEMORY SOURCES HAVE NO STABLE CACHE KEY.
+IMAGE_BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+def is_image_path(source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+
+def is_image_buffer(source) -> bool:
+    return isinstance(source, IMAGE_BUFFER_TYPES)
+
+
+def describe_image_source(source) -> str:
+    """
+    :return: description of the image source used in error messages
+    """
+    if is_image_path(source):
+        return os.fspath(source)
+    if is_image_buffer(source):
+        return f"<{type(source).__name__} of {memoryview(source).nbytes} bytes>"
+    if isinstance(source, np.ndarray):
+        return f"<array of shape {source.shape}>"
+    return f"<{type(source).__name__}>"
+
+
+def decode_image_buffer(buffer, flags=cv2.IMREAD_COLOR) -> np.ndarray:
+    """
+    Decodes encoded image buffer with cv2.imdecode. The buffer is wrapped by np.frombuffer, not copied.
+    :param buffer: bytes, bytearray or memoryview with the content of an image file
+    :param flags: cv2.IMREAD_COLOR or cv2.IMREAD_GRAYSCALE
+    :return: decoded image
+    """
+    encoded = np.frombuffer(buffer, dtype=np.uint8)
+    with instrumentation.stage(STAGE_DECODE, mode="buffer"):
+        img = cv2.imdecode(encoded, flags)
+    check_image_loaded(img, describe_image_source(buffer))
+    if instrumentation.is_enabled():
+        instrumentation.count(COUNTER_ENCODED_BYTES, encoded.nbytes, mode="buffer")
+        instrumentation.count(COUNTER_DECODED_BYTES, img.nbytes, mode="buffer")
+    return img
+
+
+def open_pil_image_buffer(buffer) -> Image.Image:
+    """
+    :return: PIL image decoded from the encoded image buffer
+    """
+    with instrumentation.stage(STAGE_DECODE, mode="pil_buffer"):
+        img = Image.open(io.BytesIO(buffer))
+        img.load()
+    instrumentation.count(COUNTER_ENCODED_BYTES, memoryview(buffer).nbytes, mode="pil_buffer")
+    return img
+
+
+def array_to_coloured(img: np.ndarray) -> np.ndarray:
+    """
+    :return: BGR image; BGR arrays are returned as they are (zero-copy), grayscale and BGRA arrays are converted
+    """
+    if img.ndim == 3 and img.shape[2] == 3:
+        return img
+    with instrumentation.stage(STAGE_COLOUR_CONVERSION, conversion="to_bgr"):
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR if img.ndim == 2 else cv2.COLOR_BGRA2BGR)
+
+
+def array_to_greyscale(img: np.ndarray) -> np.ndarray:
+    """
+    :return: grayscale image; grayscale arrays are returned as they are (zero-copy), colour arrays are converted
+        (for JPEG files this is not pixel-identical to grayscale decoding by the codec)
+    """
+    if img.ndim == 2:
+        return img
+    with instrumentation.stage(STAGE_COLOUR_CONVERSION, conversion="to_greyscale"):
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+
+
+def array_to_pil(img: np.ndarray) -> Image.Image:
+    """
+    :return: PIL image of BGR, BGRA or grayscale array
+    """
+    if img.ndim == 2:
+        return Image.fromarray(img)
+    return Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA if img.shape[2] == 4 else cv2.COLOR_BGR2RGB))
+
+
+def load_coloured_from_source(source) -> np.ndarray:
+    """
+    :param source: encoded image buffer, np.ndarray or PIL image
+    :return: BGR image
+    """
+    if is_image_buffer(source):
+        return decode_image_buffer(source, cv2.IMREAD_COLOR)
+    if isinstance(source, np.ndarray):
+        return array_to_coloured(source)
+    if isinstance(source, Image.Image):
+        return cv2.cvtColor(np.asarray(source.convert("RGB")), cv2.COLOR_RGB2BGR)
+    raise TypeError(f"Unsupported image source: {describe_image_source(source)}")
+
+
+def load_greyscale_from_source(source) -> np.ndarray:
+    """
+    :param source: encoded image buffer, np.ndarray or PIL image
+    :return: grayscale image
+    """
+    if is_image_buffer(source):
+        return decode_image_buffer(source, cv2.IMREAD_GRAYSCALE)
+    if isinstance(source, np.ndarray):
+        return array_to_greyscale(source)
+    if isinstance(source, Image.Image):
+        if source.mode == "L":
+            return np.asarray(source)
+        # The same conversion as for arrays, so PIL and OpenCV images of the same pixels are equal
+        return cv2.cvtColor(np.asarray(source.convert("RGB")), cv2.COLOR_RGB2GRAY)
+    raise TypeError(f"Unsupported image source: {describe_image_source(source)}")
+
+
+def load_pil_from_source(source) -> Image.Image:
+    """
+    :param source: encoded image buffer, np.ndarray or PIL image
+    :return: PIL image, PIL images are returned as they are
+    """
+    if is_image_buffer(source):
+        return open_pil_image_buffer(source)
+    if isinstance(source, np.ndarray):
+        return array_to_pil(source)
+    if isinstance(source, Image.Image):
+        return source
+    raise TypeError(f"Unsupported image source: {describe_image_source(source)}")
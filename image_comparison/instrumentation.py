@@ -0,0 +1,280 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext, contextmanager
+
+
+###########################
+# THIS MODULE CONTAINS OPTIONAL INSTRUMENTATION OF THE COMPARATORS.
+# STAGES (DECODE, RESIZE, COLOUR CONVERSION, FLOAT CONVERSION, SSIM, METRIC) ARE TIMED, DECODED AND ALLOCATED
+# BYTES AND CACHE HITS ARE COUNTED, AND METRIC VALUES ARE REPORTED TO THE INSTALLED SINKS.
+# WITHOUT SINKS EVERY INSTRUMENTATION POINT COSTS ONE CHECK OF AN EMPTY TUPLE.
+# Stage timers are inclusive, e.g. a metric stage contains the decode stages of its images.
+EVENT_TIMER = "timer"
+EVENT_COUNTER = "counter"
+EVENT_VALUE = "value"
+
+STAGE_DECODE = "decode"
+STAGE_RESIZE = "resize"
+STAGE_COLOUR_CONVERSION = "colour_conversion"
+STAGE_FLOAT_CONVERSION = "float_conversion"
+STAGE_SSIM = "ssim"
+STAGE_METRIC = "metric"
+
+COUNTER_CACHE_HITS = "cache_hits"
+COUNTER_CACHE_MISSES = "cache_misses"
+COUNTER_ENCODED_BYTES = "encoded_bytes"
+COUNTER_DECODED_BYTES = "decoded_bytes"
+COUNTER_ALLOCATED_BYTES = "allocated_bytes"
+
+PROMETHEUS_PREFIX = "image_comparison_"
+
+# Installed sinks; replaced as a whole, so emitting needs no lock
+_sinks = ()
+_sinks_lock = threading.Lock()
+_NULL_STAGE = nullcontext()
+
+
+def create_event(kind: str, name: str, value, labels: dict) -> dict:
+    """
+    :param kind: EVENT_TIMER (value in seconds), EVENT_COUNTER or EVENT_VALUE
+    :param name: stage, counter or value name
+    :param value: measured number
+    :param labels: dictionary of label names and values, e.g. image mode or metric name
+    :return: dictionary describing one instrumentation event
+    """
+    return {"kind": kind, "name": name, "value": value, "labels": labels, "time": time.time()}
+
+
+def add_sink(sink):
+    """
+    Installs a sink, enabling the instrumentation. A sink is any object with handle(event) method.
+    """
+    global _sinks
+    with _sinks_lock:
+        _sinks = _sinks + (sink,)
+
+
+def remove_sink(sink):
+    global _sinks
+    with _sinks_lock:
+        _sinks = tuple(installed for installed in _sinks if installed is not sink)
+
+
+@contextmanager
+def sink_installed(sink):
+    """
+    Context manager installing the sink for the duration of the block.
+    :return: the sink
+    """
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+
+
+def is_enabled() -> bool:
+    return bool(_sinks)
+
+
+def emit(kind: str, name: str, value, labels: dict):
+    sinks = _sinks
+    if not sinks:
+        return
+    event = create_event(kind, name, value, labels)
+    for sink in sinks:
+        sink.handle(event)
+
+
+def count(name: str, value=1, **labels):
+    """
+    Adds the value to a counter, e.g. number of decoded bytes.
+    """
+    if _sinks:
+        emit(EVENT_COUNTER, name, value, labels)
+
+
+def record_value(name: str, value, **labels):
+    """
+    Reports a computed value, e.g. a metric score.
+    """
+    if _sinks:
+        emit(EVENT_VALUE, name, float(value), labels)
+
+
+class _StageTimer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        emit(EVENT_TIMER, self.name, time.perf_counter() - self.start, self.labels)
+
+
+def stage(name: str, **labels):
+    """
+    Context manager timing a stage.
+    :param name: stage name, e.g. STAGE_DECODE
+    :param labels: labels of the timer
+    """
+    if not _sinks:
+        return _NULL_STAGE
+    return _StageTimer(name, labels)
+
+
+def timed(name: str, **labels):
+    """
+    Decorator timing every call of the function as a stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return function(*args, **kwargs)
+            with _StageTimer(name, labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class InMemorySink:
+    """
+    Aggregates events in memory: count, sum, minimum, maximum and last value per event kind, name and labels.
+    """
+    def __init__(self):
+        self._aggregates = {}
+        self._lock = threading.Lock()
+
+    def handle(self, event: dict):
+        key = (event["kind"], event["name"], tuple(sorted(event["labels"].items())))
+        value = event["value"]
+        with self._lock:
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                self._aggregates[key] = {"count": 1, "sum": value, "min": value, "max": value, "last": value}
+                return
+            aggregate["count"] += 1
+            aggregate["sum"] += value
+            aggregate["min"] = min(aggregate["min"], value)
+            aggregate["max"] = max(aggregate["max"], value)
+            aggregate["last"] = value
+
+    def get(self, kind: str, name: str, **labels) -> dict:
+        """
+        :return: aggregate of the events with exactly these labels or None
+        """
+        with self._lock:
+            aggregate = self._aggregates.get((kind, name, tuple(sorted(labels.items()))))
+            return None if aggregate is None else dict(aggregate)
+
+    def total(self, kind: str, name: str) -> dict:
+        """
+        :return: aggregate of the events of all labels or None
+        """
+        total = None
+        for record in self.snapshot():
+            if (record["kind"], record["name"]) != (kind, name):
+                continue
+            if total is None:
+                total = {key: record[key] for key in ("count", "sum", "min", "max", "last")}
+                continue
+            total["count"] += record["count"]
+            total["sum"] += record["sum"]
+            total["min"] = min(total["min"], record["min"])
+            total["max"] = max(total["max"], record["max"])
+        return total
+
+    def snapshot(self) -> list:
+        """
+        :return: list of aggregates with kind, name and labels
+        """
+        with self._lock:
+            return [{"kind": kind, "name": name, "labels": dict(labels), **aggregate}
+                    for (kind, name, labels), aggregate in self._aggregates.items()]
+
+    def reset(self):
+        with self._lock:
+            self._aggregates.clear()
+
+
+class JsonLinesSink:
+    """
+    Writes every event as one JSON line.
+    :param output: path of the file to append to, or writable text file object
+    """
+    def __init__(self, output):
+        self._owns_file = isinstance(output, str)
+        self._file = open(output, "a") if self._owns_file else output
+        self._lock = threading.Lock()
+
+    def handle(self, event: dict):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._owns_file:
+                self._file.close()
+            else:
+                self._file.flush()
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in sorted(labels.items())) + "}"
+
+
+class PrometheusSink(InMemorySink):
+    """
+    Aggregates events in memory and exports them in Prometheus text exposition format:
+    timers as summaries image_comparison_<stage>_seconds (count and sum), counters as
+    image_comparison_<name>_total and values as gauges image_comparison_<name> holding the last value.
+    """
+    def export(self) -> str:
+        """
+        :return: metrics in Prometheus text format
+        """
+        families = {}
+        for record in sorted(self.snapshot(), key=lambda record: (record["name"], sorted(record["labels"].items()))):
+            labels = _prometheus_labels(record["labels"])
+            if record["kind"] == EVENT_TIMER:
+                metric = f"{PROMETHEUS_PREFIX}{record['name']}_seconds"
+                lines = families.setdefault((metric, "summary"), [])
+                lines.append(f"{metric}_count{labels} {record['count']}")
+                lines.append(f"{metric}_sum{labels} {float(record['sum'])!r}")
+            elif record["kind"] == EVENT_COUNTER:
+                metric = f"{PROMETHEUS_PREFIX}{record['name']}_total"
+                families.setdefault((metric, "counter"), []).append(f"{metric}{labels} {float(record['sum'])!r}")
+            else:
+                metric = f"{PROMETHEUS_PREFIX}{record['name']}"
+                families.setdefault((metric, "gauge"), []).append(f"{metric}{labels} {float(record['last'])!r}")
+        text = []
+        for (metric, metric_type), lines in families.items():
+            text.append(f"# TYPE {metric} {metric_type}")
+            text.extend(lines)
+        return "\n".join(text) + "\n" if text else ""
+
+    def write(self, output_path):
+        """
+        Writes the exported metrics to a file, e.g. for the textfile collector of node exporter.
+        The file is replaced atomically, so the collector never reads a partially written file.
+        """
+        temporary_path = f"{output_path}.tmp"
+        with open(temporary_path, "w") as output:
+            output.write(self.export())
+        os.replace(temporary_path, output_path)
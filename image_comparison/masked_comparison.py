@@ -0,0 +1,418 @@
+import threading
+
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+from image_comparison.abstract_image_comparator import AbstractImageComparison
+from image_comparison.changed_regions import max_pool
+from image_comparison.image_hash_comparrison import load_image, get_difference
+from image_comparison.opencv_image_comparator import (
+    load_image_colored, load_image_greyscale, resize_to_smaller_image, compare_histograms_correlation,
+)
+from image_comparison.scikit_image_comparator import get_channel_axis, get_data_range, convert_image_to_float
+from image_comparison.ssim_statistics import (
+    create_ssim_statistics, ssim_map_from_statistics, resolve_ssim_backend, DEFAULT_WIN_SIZE, UINT8_DATA_RANGE,
+)
+
+
+###########################
+# THIS MODULE CONTAINS COMPARISON OF IMAGES WITH IGNORED AREAS (CLOCKS, ADS, CURSORS...).
+# MASK IS SPLIT INTO TILES; FULLY MASKED TILES ARE NEVER READ, NEIGHBOURING UNMASKED TILES OF A TILE ROW
+# ARE MERGED INTO ONE SLICE, SO THE WORK SHRINKS WITH THE UNMASKED AREA.
+DEFAULT_MASK_TILE_SIZE = 64
+
+MASK_UNMASKED = 255
+MASK_MASKED = 0
+
+
+class ImageMask:
+    """
+    Pixels compared by MaskedImageComparator. The mask is defined by region-of-interest rectangles
+    (only pixels inside them are compared, the whole frame when omitted), ignored rectangles and/or
+    an explicit mask array (non-zero pixels are compared, resized with nearest neighbour to the compared images).
+    Rectangles are (x, y, width, height) in pixels of the compared images, the same format as changed regions.
+    Rasterized masks and their tiles are cached per image size, so one ImageMask can be reused across a batch.
+    """
+    def __init__(self, roi=None, ignore=None, mask: np.ndarray = None, tile_size: int = DEFAULT_MASK_TILE_SIZE):
+        self.roi = None if roi is None else [tuple(rectangle) for rectangle in roi]
+        self.ignore = [tuple(rectangle) for rectangle in ignore or []]
+        self.mask = mask
+        self.tile_size = tile_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Rasterized masks are cheap to rebuild, so they are not sent to worker processes
+        return {"roi": self.roi, "ignore": self.ignore, "mask": self.mask, "tile_size": self.tile_size}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _get_cached(self, key, factory):
+        with self._lock:
+            value = self._cache.get(key)
+        if value is None:
+            value = factory()
+            with self._lock:
+                self._cache[key] = value
+        return value
+
+    def get_mask(self, height: int, width: int) -> np.ndarray:
+        """
+        :return: read-only uint8 array, MASK_UNMASKED for compared pixels and MASK_MASKED for ignored ones
+            (the format of the mask argument of cv2.calcHist)
+        """
+        return self._get_cached(("mask", height, width), lambda: self._rasterize(height, width))
+
+    def _rasterize(self, height: int, width: int) -> np.ndarray:
+        if self.roi is None:
+            mask = np.full((height, width), MASK_UNMASKED, dtype=np.uint8)
+        else:
+            mask = np.full((height, width), MASK_MASKED, dtype=np.uint8)
+            for x, y, w, h in self.roi:
+                mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = MASK_UNMASKED
+        for x, y, w, h in self.ignore:
+            mask[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = MASK_MASKED
+        if self.mask is not None:
+            explicit = np.asarray(self.mask)
+            if explicit.shape[:2] != (height, width):
+                explicit = cv2.resize(explicit.astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+            mask[explicit == 0] = MASK_MASKED
+        mask.setflags(write=False)
+        return mask
+
+    def get_unmasked_count(self, height: int, width: int) -> int:
+        """
+        :return: number of compared pixels
+        """
+        return self._get_cached(("count", height, width),
+                                lambda: int(np.count_nonzero(self.get_mask(height, width))))
+
+    def get_slices(self, height: int, width: int) -> list:
+        """
+        Splits the mask into tiles and merges neighbouring tiles of a tile row which contain compared pixels.
+        :return: list of (top, bottom, left, right, fully_unmasked) slices covering all compared pixels
+        """
+        return self._get_cached(("slices", height, width), lambda: self._build_slices(height, width))
+
+    def _build_slices(self, height: int, width: int) -> list:
+        mask = self.get_mask(height, width)
+        tile_size = self.tile_size
+        active = max_pool(mask, tile_size) > 0
+        # Fully unmasked tiles (partial border tiles count only their pixels inside the image)
+        full = max_pool(MASK_UNMASKED - mask, tile_size) == 0
+        slices = []
+        for row in range(active.shape[0]):
+            top, bottom = row * tile_size, min((row + 1) * tile_size, height)
+            columns = np.flatnonzero(active[row])
+            if columns.size == 0:
+                continue
+            # Runs of neighbouring active tiles
+            breaks = np.flatnonzero(np.diff(columns) > 1)
+            for start, stop in zip(np.r_[0, breaks + 1], np.r_[breaks, columns.size - 1]):
+                first, last = columns[start], columns[stop]
+                slices.append((top, bottom, int(first) * tile_size, min((int(last) + 1) * tile_size, width),
+                               bool(full[row, first:last + 1].all())))
+        return slices
+
+    def get_bounding_box(self, height: int, width: int):
+        """
+        :return: (x, y, width, height) of the compared pixels, None when all pixels are masked
+        """
+        def bounding_box():
+            mask = self.get_mask(height, width)
+            rows = np.flatnonzero(mask.any(axis=1))
+            columns = np.flatnonzero(mask.any(axis=0))
+            if rows.size == 0:
+                return None
+            return int(columns[0]), int(rows[0]), int(columns[-1] - columns[0]) + 1, int(rows[-1] - rows[0]) + 1
+        return self._get_cached(("bounding_box", height, width), bounding_box)
+
+
+def check_unmasked(count: int):
+    if count == 0:
+        raise ValueError("All pixels of the images are masked.")
+
+
+def masked_squared_error_sum(image1: np.ndarray, image2: np.ndarray, image_mask: ImageMask) -> int:
+    """
+    :return: exact sum of squared differences of the compared pixels
+    """
+    mask = image_mask.get_mask(*image1.shape[:2])
+    total = 0
+    for top, bottom, left, right, full in image_mask.get_slices(*image1.shape[:2]):
+        abs_diff = cv2.absdiff(image1[top:bottom, left:right], image2[top:bottom, left:right]).astype(np.uint32)
+        if not full:
+            abs_diff[mask[top:bottom, left:right] == MASK_MASKED] = 0
+        total += int(np.sum(abs_diff * abs_diff, dtype=np.uint64))
+    return total
+
+
+def masked_abs_diff(image1: np.ndarray, image2: np.ndarray, image_mask: ImageMask) -> tuple:
+    """
+    :return: total and mean absolute differences of the compared pixels
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Error: Images must be of the same size and type.")
+    height, width = image1.shape[:2]
+    mask = image_mask.get_mask(height, width)
+    count = image_mask.get_unmasked_count(height, width)
+    check_unmasked(count)
+    total_diff = np.uint64(0)
+    for top, bottom, left, right, full in image_mask.get_slices(height, width):
+        abs_diff = cv2.absdiff(image1[top:bottom, left:right], image2[top:bottom, left:right])
+        if not full:
+            abs_diff[mask[top:bottom, left:right] == MASK_MASKED] = 0
+        total_diff += np.sum(abs_diff, dtype=np.uint64)
+    channels = 1 if image1.ndim == 2 else image1.shape[2]
+    return total_diff, np.float64(total_diff) / (count * channels)
+
+
+def masked_normalized_histograms(image: np.ndarray, image_mask: ImageMask) -> list:
+    """
+    Calculates normalized 256 bins histogram of every channel of the compared pixels,
+    accumulating cv2.calcHist (with the mask argument) over the unmasked slices.
+    :return: list of flattened histograms, one per channel
+    """
+    mask = image_mask.get_mask(*image.shape[:2])
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    histograms = []
+    for channel in range(channels):
+        hist = np.zeros((256, 1), dtype=np.float32)
+        for top, bottom, left, right, full in image_mask.get_slices(*image.shape[:2]):
+            cv2.calcHist([np.ascontiguousarray(image[top:bottom, left:right])], [channel],
+                         None if full else np.ascontiguousarray(mask[top:bottom, left:right]),
+                         [256], [0, 256], hist=hist, accumulate=True)
+        histograms.append(cv2.normalize(hist, hist).flatten())
+    return histograms
+
+
+def _extend_slice(start: int, stop: int, size: int, pad: int, win_size: int) -> tuple:
+    extended_stop = min(size, stop + pad)
+    # Short slices at the end of the image are extended further back, so the window always fits into them
+    return max(0, min(start - pad, extended_stop - win_size)), extended_stop
+
+
+def masked_structural_similarity(image1: np.ndarray, image2: np.ndarray, image_mask: ImageMask, data_range,
+                                 win_size=DEFAULT_WIN_SIZE, to_float=None, backend=None) -> tuple:
+    """
+    Calculates SSIM of the compared pixels. Local statistics are calculated only for the unmasked slices,
+    each extended by half of the window, so they match the statistics of the whole image.
+    Masked pixels of the second image are replaced by the pixels of the first image before filtering,
+    so changes of masked pixels do not leak into the windows of neighbouring compared pixels.
+    Mean SSIM is averaged over compared pixels which are not within half of the window from the image border
+    (scikit-image crops the same border), so with nothing masked it equals skimage structural_similarity
+    up to floating point rounding.
+    :param image1: first image, channels (if any) on the last axis
+    :param image2: second image
+    :param image_mask: compared pixels
+    :param data_range: data range of the images
+    :param win_size: size of the uniform window
+    :param to_float: optional conversion applied to every slice before calculating statistics
+    :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
+    :return: tuple of per-channel mean SSIM list and mean of the SSIM map over all compared pixels
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    backend = resolve_ssim_backend(backend)
+    height, width = image1.shape[:2]
+    multichannel = image1.ndim == 3
+    channels = image1.shape[2] if multichannel else 1
+    pad = (win_size - 1) // 2
+    mask = image_mask.get_mask(height, width)
+    check_unmasked(image_mask.get_unmasked_count(height, width))
+    cropped_sum, cropped_count = np.zeros(channels), 0
+    full_sum, full_count = np.zeros(channels), 0
+    for top, bottom, left, right, _ in image_mask.get_slices(height, width):
+        extended_top, extended_bottom = _extend_slice(top, bottom, height, pad, win_size)
+        extended_left, extended_right = _extend_slice(left, right, width, pad, win_size)
+        window1 = image1[extended_top:extended_bottom, extended_left:extended_right]
+        window2 = image2[extended_top:extended_bottom, extended_left:extended_right]
+        masked = mask[extended_top:extended_bottom, extended_left:extended_right] == MASK_MASKED
+        if masked.any():
+            window2 = window2.copy()
+            window2[masked] = window1[masked]
+        if to_float is not None:
+            window1, window2 = to_float(window1), to_float(window2)
+        s = ssim_map_from_statistics(create_ssim_statistics(window1, win_size, multichannel, backend),
+                                     create_ssim_statistics(window2, win_size, multichannel, backend), data_range)
+        s = s[top - extended_top:bottom - extended_top, left - extended_left:right - extended_left]
+        s = s.reshape(s.shape[0], s.shape[1], channels)
+        compared = mask[top:bottom, left:right] != MASK_MASKED
+        full_sum += s[compared].sum(axis=0, dtype=np.float64)
+        full_count += int(np.count_nonzero(compared))
+        # Pixels near the image border are not part of the mean SSIM
+        compared[:max(0, pad - top)] = False
+        compared[max(0, height - pad - top):] = False
+        compared[:, :max(0, pad - left)] = False
+        compared[:, max(0, width - pad - left):] = False
+        cropped_sum += s[compared].sum(axis=0, dtype=np.float64)
+        cropped_count += int(np.count_nonzero(compared))
+    check_unmasked(cropped_count)
+    return list(cropped_sum / cropped_count), float(full_sum.sum() / (full_count * channels))
+
+
+def masked_pil_image(image_path, image_mask: ImageMask) -> Image.Image:
+    """
+    :return: grayscale PIL image cropped to the bounding box of the compared pixels, with masked pixels set to 0,
+        so they are the same in all hashed images
+    """
+    img = np.array(load_image(image_path).convert("L"))
+    height, width = img.shape
+    bounding_box = image_mask.get_bounding_box(height, width)
+    if bounding_box is None:
+        check_unmasked(0)
+    img[image_mask.get_mask(height, width) == MASK_MASKED] = 0
+    x, y, w, h = bounding_box
+    return Image.fromarray(img[y:y + h, x:x + w])
+
+
+class MaskedImageComparator(AbstractImageComparison):
+    """
+    Comparator ignoring masked pixels. Methods have the same names and return the same kinds of values
+    as the methods of OpenCVImageComparator, SciKitImageComparator and ImageHashComparison,
+    calculated over the compared pixels only. The mask is applied to the compared images,
+    i.e. after resizing to the smaller image for the metrics which resize.
+    """
+    def __init__(self, image_path_1, image_path_2, image_mask: ImageMask):
+        super().__init__(image_path_1, image_path_2)
+        self.image_mask = image_mask
+
+    def _resized_greyscale_images(self) -> tuple:
+        return resize_to_smaller_image(load_image_greyscale(self.image_path_1), load_image_greyscale(self.image_path_2))
+
+    def _resized_coloured_images(self) -> tuple:
+        return resize_to_smaller_image(load_image_colored(self.image_path_1), load_image_colored(self.image_path_2))
+
+    def compare_images_mse(self) -> float:
+        """
+        :return: Mean Squared Error of the compared pixels of grayscale images resized to the smaller one.
+        """
+        image1, image2 = self._resized_greyscale_images()
+        count = self.image_mask.get_unmasked_count(*image1.shape[:2])
+        check_unmasked(count)
+        return masked_squared_error_sum(image1, image2, self.image_mask) / count
+
+    def compare_images_histograms_correlation_grayscale(self) -> float:
+        """
+        :return: correlation of histograms of the compared pixels of grayscale images
+        """
+        hists1, hists2 = [masked_normalized_histograms(image, self.image_mask)
+                          for image in self._resized_greyscale_images()]
+        return compare_histograms_correlation(hists1, hists2)
+
+    def compare_images_histograms_correlation_colored(self) -> float:
+        """
+        :return: correlation of histograms of the compared pixels averaged across BGR channels
+        """
+        hists1, hists2 = [masked_normalized_histograms(image, self.image_mask)
+                          for image in self._resized_coloured_images()]
+        return compare_histograms_correlation(hists1, hists2)
+
+    def absolute_difference_greyscale(self) -> tuple:
+        """
+        :return: total and mean absolute differences of the compared pixels of grayscale images.
+        """
+        return masked_abs_diff(load_image_greyscale(self.image_path_1), load_image_greyscale(self.image_path_2),
+                               self.image_mask)
+
+    def absolute_difference_coloured(self) -> tuple:
+        """
+        :return: total and mean absolute differences of the compared pixels of coloured images.
+        """
+        return masked_abs_diff(load_image_colored(self.image_path_1), load_image_colored(self.image_path_2),
+                               self.image_mask)
+
+    def compare_images_ssim_gray(self, backend=None):
+        """
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
+        :return: SSIM score of the compared pixels of grayscale images
+        """
+        scores, _ = masked_structural_similarity(load_image_greyscale(self.image_path_1),
+                                                 load_image_greyscale(self.image_path_2), self.image_mask,
+                                                 UINT8_DATA_RANGE, backend=backend)
+        return scores[0]
+
+    def compare_images_ssim_colored(self, backend=None):
+        """
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
+        :return: SSIM score of the compared pixels averaged across colour channels
+        """
+        score_b, score_g, score_r = masked_structural_similarity(
+            load_image_colored(self.image_path_1), load_image_colored(self.image_path_2), self.image_mask,
+            UINT8_DATA_RANGE, backend=backend)[0]
+        return (score_r + score_g + score_b) / 3
+
+    def _grayscale_ssim(self, img1: np.ndarray, img2: np.ndarray, backend) -> tuple:
+        scores, mean_diff = masked_structural_similarity(img1, img2, self.image_mask, UINT8_DATA_RANGE,
+                                                         backend=backend)
+        return scores[0], mean_diff
+
+    def _coloured_ssim(self, img1: np.ndarray, img2: np.ndarray, backend) -> tuple:
+        if get_channel_axis(img1) != get_channel_axis(img2):
+            raise ValueError("The two images have different channel axes, cannot compare")
+        data_range = get_data_range(img1)
+        if data_range != get_data_range(img2):
+            raise ValueError("Data ranges of the images are different")
+        scores, mean_diff = masked_structural_similarity(img1, img2, self.image_mask, data_range, win_size=3,
+                                                         to_float=convert_image_to_float, backend=backend)
+        return float(np.mean(scores)), mean_diff
+
+    def compare_grayscale_images_ssim(self, backend=None) -> tuple:
+        """
+        :return: tuple containing similarity and mean difference of the compared pixels of grayscale images.
+        """
+        return self._grayscale_ssim(load_image_greyscale(self.image_path_1), load_image_greyscale(self.image_path_2),
+                                    backend)
+
+    def compare_grayscale_resized_images_ssim(self, backend=None) -> tuple:
+        """
+        :return: tuple containing similarity and mean difference of the compared pixels of grayscale images
+            resized to the smaller one.
+        """
+        return self._grayscale_ssim(*self._resized_greyscale_images(), backend)
+
+    def compare_coloured_images_ssim(self, backend=None) -> tuple:
+        """
+        :return: tuple containing similarity and mean difference of the compared pixels of coloured images.
+        """
+        return self._coloured_ssim(load_image_colored(self.image_path_1), load_image_colored(self.image_path_2),
+                                   backend)
+
+    def compare_coloured_resized_images_ssim(self, backend=None) -> tuple:
+        """
+        :return: tuple containing similarity and mean difference of the compared pixels of coloured images
+            resized to the smaller one.
+        """
+        return self._coloured_ssim(*self._resized_coloured_images(), backend)
+
+    def _hashes_difference(self, hash_method):
+        return get_difference(hash_method(masked_pil_image(self.image_path_1, self.image_mask)),
+                              hash_method(masked_pil_image(self.image_path_2, self.image_mask)))
+
+    def compare_images_average_hash(self):
+        """
+        :return: average hash difference of the bounding boxes of compared pixels, masked pixels set to 0
+        """
+        return self._hashes_difference(imagehash.average_hash)
+
+    def compare_images_perceptual_hash(self):
+        """
+        :return: perceptual hash difference of the bounding boxes of compared pixels, masked pixels set to 0
+        """
+        return self._hashes_difference(imagehash.phash)
+
+    def compare_images_difference_hash(self):
+        """
+        :return: difference hash difference of the bounding boxes of compared pixels, masked pixels set to 0
+        """
+        return self._hashes_difference(imagehash.dhash)
+
+    def compare_images_wavelet_hash(self):
+        """
+        :return: wavelet hash difference of the bounding boxes of compared pixels, masked pixels set to 0
+        """
+        return self._hashes_difference(imagehash.whash)
@@ -0,0 +1,60 @@
+from image_comparison.opencv_image_comparator import *
+from image_comparison.scikit_image_comparator import (
+    SciKitImageComparator, METRIC_SCIKIT_SSIM_GRAYSCALE, METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED,
+    METRIC_SCIKIT_SSIM_COLOURED, METRIC_SCIKIT_SSIM_COLOURED_RESIZED,
+)
+from image_comparison.image_hash_comparrison import (
+    ImageHashComparison, METRIC_AVERAGE_HASH, METRIC_PERCEPTUAL_HASH, METRIC_DIFFERENCE_HASH, METRIC_WAVELET_HASH,
+)
+from image_comparison.masked_comparison import MaskedImageComparator
+
+
+###########################
+# THIS MODULE MAPS METRIC NAMES TO THE COMPARATOR METHODS CALCULATING THEM
+COMPARATOR_METRICS = {
+    METRIC_MSE: (OpenCVImageComparator, "compare_images_mse"),
+    METRIC_HISTOGRAM_GRAYSCALE: (OpenCVImageComparator, "compare_images_histograms_correlation_grayscale"),
+    METRIC_HISTOGRAM_COLORED: (OpenCVImageComparator, "compare_images_histograms_correlation_colored"),
+    METRIC_ABS_DIFF_GREYSCALE: (OpenCVImageComparator, "absolute_difference_greyscale"),
+    METRIC_ABS_DIFF_COLOURED: (OpenCVImageComparator, "absolute_difference_coloured"),
+    METRIC_SSIM_GRAY: (OpenCVImageComparator, "compare_images_ssim_gray"),
+    METRIC_SSIM_COLORED: (OpenCVImageComparator, "compare_images_ssim_colored"),
+    METRIC_SCIKIT_SSIM_GRAYSCALE: (SciKitImageComparator, "compare_grayscale_images_ssim"),
+    METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED: (SciKitImageComparator, "compare_grayscale_resized_images_ssim"),
+    METRIC_SCIKIT_SSIM_COLOURED: (SciKitImageComparator, "compare_coloured_images_ssim"),
+    METRIC_SCIKIT_SSIM_COLOURED_RESIZED: (SciKitImageComparator, "compare_coloured_resized_images_ssim"),
+    METRIC_AVERAGE_HASH: (ImageHashComparison, "compare_images_average_hash"),
+    METRIC_PERCEPTUAL_HASH: (ImageHashComparison, "compare_images_perceptual_hash"),
+    METRIC_DIFFERENCE_HASH: (ImageHashComparison, "compare_images_difference_hash"),
+    METRIC_WAVELET_HASH: (ImageHashComparison, "compare_images_wavelet_hash"),
+}
+
+
+def check_metrics(metrics):
+    """
+    Validates metric names.
+    :param metrics: iterable of metric names
+    :raises ValueError: when any of the metrics is unknown
+    """
+    unknown = [metric for metric in metrics if metric not in COMPARATOR_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+
+
+def compare_pair(image_path_1, image_path_2, metric, image_mask=None):
+    """
+    Compares two images using the comparator method registered for the metric.
+    :param image_path_1: File path to the first image
+    :param image_path_2: File path to the second image
+    :param metric: metric name (see COMPARATOR_METRICS)
+    :param image_mask: optional masked_comparison.ImageMask, when given the method of MaskedImageComparator
+        with the same name is used
+    :return: value returned by the comparator method
+    """
+    check_metrics([metric])
+    comparator_class, method_name = COMPARATOR_METRICS[metric]
+    if image_mask is None:
+        comparator = comparator_class(image_path_1, image_path_2)
+    else:
+        comparator = MaskedImageComparator(image_path_1, image_path_2, image_mask)
+    return getattr(comparator, method_name)()
@@ -1,16 +1,50 @@
 import cv2
 import numpy as np
+from image_comparison import instrumentation
 from image_comparison.abstract_image_comparator import *
-from skimage.metrics import structural_similarity as ssim
+from image_comparison.instrumentation import timed, record_value, STAGE_RESIZE, STAGE_METRIC
+from image_comparison.image_cache import load_cached_image, MODE_COLOURED, MODE_GREYSCALE
+from image_comparison.feature_store import get_feature_store, load_image_feature, stored_result
+from image_comparison.pixel_store import get_pixel_store
+from image_comparison.diff_kernels import diff_statistics, abs_diff_statistics
+from image_comparison.image_source import is_image_path, load_coloured_from_source, load_greyscale_from_source
+from image_comparison.changed_regions import (
+    find_changed_regions, abs_diff_map, DEFAULT_DIFF_THRESHOLD, DEFAULT_SSIM_THRESHOLD, DEFAULT_REGION_CELL_SIZE,
+)
+from image_comparison.ssim_statistics import (
+    structural_similarity, structural_similarity_channels, resolve_ssim_backend, UINT8_DATA_RANGE,
+)
 
 
 # THIS MODULE CONTAINS UTILITIES TO COMPARE IMAGES
 # USING OPENCV AND SKIIMAGE LIBRARIES
-def load_image_colored(image_path) -> np.ndarray:
+def _read_image_colored(image_path) -> np.ndarray:
     img = cv2.imread(image_path, cv2.IMREAD_COLOR)
     return check_image_loaded(img, image_path)
 
 
+def _decode_image_colored(image_path) -> np.ndarray:
+    store = get_pixel_store()
+    if store is None:
+        return _read_image_colored(image_path)
+    return store.load(image_path, MODE_COLOURED, _read_image_colored)
+
+
+def load_image_colored(image_path) -> np.ndarray:
+    """
+    Load image using coloured (BGR) mode.
+    Images decoded from files are kept in the process wide image cache and are read-only.
+    When the pixel store is enabled, images are memory-mapped from it instead of being decoded.
+
+    :param image_path: File path to the image to load, or in-memory image (see image_source module);
+        BGR arrays are returned as they are.
+    :return: image loaded as the np.ndarray
+    """
+    if not is_image_path(image_path):
+        return load_coloured_from_source(image_path)
+    return load_cached_image(image_path, MODE_COLOURED, _decode_image_colored)
+
+
 def resize_image_keep_aspect_ratio(image: np.ndarray, new_width=None, new_height=None) -> np.ndarray:
     """
     Resizes an image (ndarray) while keeping the aspect ratio.
@@ -33,30 +67,61 @@ def resize_image_keep_aspect_ratio(image: np.ndarray, new_width=None, new_height
     # Calculate aspect ratio
     aspect_ratio = original_width / original_height
 
-    # If only new width is provided
+    # If only new width is provided. Rounding (instead of truncating) keeps the other dimension
+    # consistent with the aspect ratio, e.g. 1761x1479 scaled to width 587 gives height 493 and not 492
     if new_width and not new_height:
-        new_height = int(new_width / aspect_ratio)
+        new_height = max(1, round(new_width / aspect_ratio))
 
     # If only new height is provided
     elif new_height and not new_width:
-        new_width = int(new_height * aspect_ratio)
+        new_width = max(1, round(new_height * aspect_ratio))
 
     # Resize the image with the new dimensions
-    resized_image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    with instrumentation.stage(STAGE_RESIZE):
+        resized_image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
     return resized_image
 
 
 def load_image_greyscale(image_path) -> np.ndarray:
     """
-    Load image using grayscale mode
+    Load image using grayscale mode.
+    Grayscale image is decoded directly by the codec (for JPEG this is the luma plane), which is not
+    pixel-identical to converting the coloured image, so it is cached as a separate entry.
 
-    :param image_path: File path to the image to load.
+    :param image_path: File path to the image to load, or in-memory image (see image_source module);
+        grayscale arrays are returned as they are, colour arrays are converted.
     :return: image loaded as the np.ndarray
     """
+    if not is_image_path(image_path):
+        return load_greyscale_from_source(image_path)
+    return load_cached_image(image_path, MODE_GREYSCALE, _decode_image_greyscale)
+
+
+def _read_image_greyscale(image_path) -> np.ndarray:
     img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
     return check_image_loaded(img, image_path)
 
 
+def _decode_image_greyscale(image_path) -> np.ndarray:
+    store = get_pixel_store()
+    if store is None:
+        return _read_image_greyscale(image_path)
+    return store.load(image_path, MODE_GREYSCALE, _read_image_greyscale)
+
+
+def store_decoded_images(image_paths, modes=(MODE_COLOURED, MODE_GREYSCALE)):
+    """
+    Decodes images into the process wide pixel store in advance (see pixel_store module),
+    e.g. a baseline set compared by many later runs.
+    :param image_paths: iterable of image paths
+    :param modes: MODE_COLOURED and/or MODE_GREYSCALE
+    """
+    store = get_pixel_store()
+    if store is None:
+        raise ValueError("Pixel store is not enabled, see pixel_store.set_pixel_store")
+    store.add(image_paths, modes, {MODE_COLOURED: _read_image_colored, MODE_GREYSCALE: _read_image_greyscale})
+
+
 def resize_grayscale_to_smaller_images_by_path(image_path_1, image_path_2) -> tuple[np.ndarray, np.ndarray]:
     """
     This method re-sizes grayscale images to the smallest image dimensions
@@ -106,108 +171,229 @@ def abs_diff_images(image1, image2) -> tuple:
     '''
     if image1.shape != image2.shape:
         raise ValueError("Error: Images must be of the same size and type.")
-    abs_diff = cv2.absdiff(image1, image2)
-    # Calculate the sum of all absolute differences
-    total_diff = np.sum(abs_diff)
+    statistics = diff_statistics(image1, image2)
+    return statistics["sum"], statistics["mean"]
+
+
+def sum_and_mean_difference(abs_diff: np.ndarray) -> tuple:
+    """
+    Calculates total and mean differences from the absolute difference image.
+    :param abs_diff: result of cv2.absdiff
+    :return: total and mean differences of the images.
+    """
+    statistics = abs_diff_statistics(abs_diff)
+    return statistics["sum"], statistics["mean"]
+
+
+def mse_from_abs_diff(abs_diff: np.ndarray) -> float:
+    """
+    Calculates Mean Squared Error from the absolute difference image.
+    Squared absolute difference is exactly the squared difference of the images.
+    :param abs_diff: result of cv2.absdiff
+    :return: MSE value
+    """
+    return abs_diff_statistics(abs_diff)["mse"]
+
+
+def calculate_normalized_histograms(image: np.ndarray) -> list:
+    """
+    Calculates normalized 256 bins histogram for every channel of the image.
+    :param image: grayscale or coloured image as np.ndarray
+    :return: list of flattened histograms, one per channel
+    """
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    histograms = []
+    for channel in range(channels):
+        hist = cv2.calcHist([image], [channel], None, [256], [0, 256])
+        histograms.append(cv2.normalize(hist, hist).flatten())
+    return histograms
+
+
+def get_resized_size(size_1: tuple, size_2: tuple) -> tuple:
+    """
+    :param size_1: (width, height) of the first image
+    :param size_2: (width, height) of the second image
+    :return: (width, height) both images have after resize_to_smaller_image
+    """
+    (width1, height1), (width2, height2) = size_1, size_2
+    if width1 > width2 or height1 > height2:
+        return width2, height2
+    return width1, height1
 
-    # Optionally, calculate the mean difference (average)
-    mean_diff = np.mean(abs_diff)
 
-    # cv2.imshow("Difference", abs_diff)
-    # cv2.waitKey(0)
-    # cv2.destroyAllWindows()
+def load_image_size(image_path, mode) -> tuple:
+    """
+    :return: (width, height) of the decoded image; kept in the feature store, so it is decoded only once
+    """
+    loader = load_image_greyscale if mode == MODE_GREYSCALE else load_image_colored
+    height, width = load_image_feature(image_path, "image_size", {"mode": mode},
+                                       lambda: [np.array(loader(image_path).shape[:2])])[0]
+    return int(width), int(height)
 
-    return total_diff, mean_diff
+
+def load_resized_histograms(image_path, mode, size: tuple) -> list:
+    """
+    Calculates normalized histograms of the image resized to the size (as by resize_to_smaller_image),
+    keeping them in the feature store.
+    :param image_path: File path to the image
+    :param mode: MODE_GREYSCALE or MODE_COLOURED
+    :param size: (width, height) the image is resized to
+    :return: list of flattened histograms, one per channel
+    """
+    def calculate():
+        image = load_image_greyscale(image_path) if mode == MODE_GREYSCALE else load_image_colored(image_path)
+        height, width = image.shape[:2]
+        if (width, height) != size:
+            image = resize_image_keep_aspect_ratio(image, *size)
+        return calculate_normalized_histograms(image)
+    return load_image_feature(image_path, "histograms", {"mode": mode, "size": list(size)}, calculate)
+
+
+def compare_histograms_correlation(hists_1: list, hists_2: list) -> float:
+    """
+    Compares per-channel histograms using Correlation method (cv2.HISTCMP_CORREL).
+    :param hists_1: normalized histograms of the first image
+    :param hists_2: normalized histograms of the second image
+    :return: correlation averaged across all channels
+    """
+    correlations = [cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL) for hist1, hist2 in zip(hists_1, hists_2)]
+    return sum(correlations) / len(correlations)
+
+
+# METRIC NAMES ACCEPTED BY OpenCVImageComparator.compare_all
+METRIC_MSE = "mse"
+METRIC_HISTOGRAM_GRAYSCALE = "histogram_correlation_grayscale"
+METRIC_HISTOGRAM_COLORED = "histogram_correlation_colored"
+METRIC_ABS_DIFF_GREYSCALE = "absolute_difference_greyscale"
+METRIC_ABS_DIFF_COLOURED = "absolute_difference_coloured"
+METRIC_SSIM_GRAY = "ssim_gray"
+METRIC_SSIM_COLORED = "ssim_colored"
+
+ALL_METRICS = (METRIC_MSE, METRIC_HISTOGRAM_GRAYSCALE, METRIC_HISTOGRAM_COLORED, METRIC_ABS_DIFF_GREYSCALE,
+               METRIC_ABS_DIFF_COLOURED, METRIC_SSIM_GRAY, METRIC_SSIM_COLORED)
 
 
 class OpenCVImageComparator(AbstractImageComparison):
     """
     Thsi class contains methods to calculate image differences, using variety of methods
     provided by OpenCV library.
+    Intermediate results (loaded and resized images, difference images and histograms) are kept
+    by the instance, so calling several methods on the same pair does the common work only once.
     """
     def __init__(self, image_path_1, image_path_2):
         super().__init__(image_path_1,image_path_2)
-
+        self._intermediates = {}
+
+    def _get_intermediate(self, name, factory):
+        value = self._intermediates.get(name)
+        if value is None:
+            value = factory()
+            self._intermediates[name] = value
+        return value
+
+    def _greyscale_images(self) -> tuple:
+        return self._get_intermediate("greyscale", lambda: (load_image_greyscale(self.image_path_1),
+                                                            load_image_greyscale(self.image_path_2)))
+
+    def _coloured_images(self) -> tuple:
+        return self._get_intermediate("coloured", lambda: (load_image_colored(self.image_path_1),
+                                                           load_image_colored(self.image_path_2)))
+
+    def _resized_greyscale_images(self) -> tuple:
+        return self._get_intermediate("greyscale_resized", lambda: resize_to_smaller_image(*self._greyscale_images()))
+
+    def _resized_coloured_images(self) -> tuple:
+        return self._get_intermediate("coloured_resized", lambda: resize_to_smaller_image(*self._coloured_images()))
+
+    def _resized_greyscale_diff_statistics(self) -> dict:
+        return self._get_intermediate("greyscale_diff_statistics",
+                                      lambda: diff_statistics(*self._resized_greyscale_images()))
+
+    def _coloured_diff_statistics(self) -> dict:
+        return self._get_intermediate("coloured_diff_statistics", lambda: diff_statistics(*self._coloured_images()))
+
+    def _histograms(self, mode) -> list:
+        if get_feature_store() is None or not (is_image_path(self.image_path_1) and is_image_path(self.image_path_2)):
+            images = self._resized_greyscale_images() if mode == MODE_GREYSCALE else self._resized_coloured_images()
+            return [calculate_normalized_histograms(image) for image in images]
+        # Histograms of every image are stored separately, so only a changed image is decoded
+        size = get_resized_size(load_image_size(self.image_path_1, mode), load_image_size(self.image_path_2, mode))
+        return [load_resized_histograms(self.image_path_1, mode, size),
+                load_resized_histograms(self.image_path_2, mode, size)]
+
+    def compare_all(self, metrics=None, errors=None) -> dict:
+        """
+        Calculates several metrics for the pair of images, sharing loaded images and intermediate results.
+        :param metrics: iterable of metric names (see ALL_METRICS); all metrics are calculated when omitted.
+        :param errors: optional dictionary collecting exceptions of the metrics which fail, mapped by metric name;
+            a failing metric does not stop the others then. Without it, the first exception is raised.
+        :return: dictionary mapping metric name to the value returned by the corresponding compare method,
+            failed metrics are left out.
+        """
+        methods = {
+            METRIC_MSE: self.compare_images_mse,
+            METRIC_HISTOGRAM_GRAYSCALE: self.compare_images_histograms_correlation_grayscale,
+            METRIC_HISTOGRAM_COLORED: self.compare_images_histograms_correlation_colored,
+            METRIC_ABS_DIFF_GREYSCALE: self.absolute_difference_greyscale,
+            METRIC_ABS_DIFF_COLOURED: self.absolute_difference_coloured,
+            METRIC_SSIM_GRAY: self.compare_images_ssim_gray,
+            METRIC_SSIM_COLORED: self.compare_images_ssim_colored,
+        }
+        metrics = ALL_METRICS if metrics is None else tuple(metrics)
+        unknown = [metric for metric in metrics if metric not in methods]
+        if unknown:
+            raise ValueError(f"Unknown metrics: {unknown}")
+        results = {}
+        for metric in metrics:
+            try:
+                results[metric] = methods[metric]()
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors[metric] = e
+        return results
+
+    @timed(STAGE_METRIC, metric=METRIC_MSE)
+    @stored_result(METRIC_MSE)
     def compare_images_mse(self) -> float:
         """
         Calculate the Mean Squared Error (MSE) between two images.
         :return: MSE value representing the similarity between the images. Lower values mean more similar.
         """
-        # Read the images
-        image1 = load_image_greyscale(self.image_path_1)
-        image2 = load_image_greyscale(self.image_path_2)
-
-        image1, image2 = resize_to_smaller_image(image1, image2)
-        # Compute the MSE
-        mse_value = float(np.mean((image1.astype("float") - image2.astype("float")) ** 2))
-        return mse_value
+        return self._resized_greyscale_diff_statistics()["mse"]
 
+    @timed(STAGE_METRIC, metric=METRIC_HISTOGRAM_GRAYSCALE)
     def compare_images_histograms_correlation_grayscale(self) -> float:
         """
         Correlation (cv2.HISTCMP_CORREL):
         Interpretation: Higher values indicate more similarity.
         :return:  Range: -1 to 1 (1 indicates perfect correlation, 0 indicates no correlation, -1 indicates perfect negative correlation).
         """
-        # Load images as grayscale
-        image_1 = load_image_greyscale(self.image_path_1)
-        image_2 = load_image_greyscale(self.image_path_2)
-
-        # Resize the images to the smaller one
-        image_1, image_2 = resize_to_smaller_image(image_1, image_2)
-        # Calculate histograms
-        hist1 = cv2.calcHist([image_1], [0], None, [256], [0, 256])
-        hist2 = cv2.calcHist([image_2], [0], None, [256], [0, 256])
-
-        # Normalize histograms
-        hist1 = cv2.normalize(hist1, hist1).flatten()
-        hist2 = cv2.normalize(hist2, hist2).flatten()
+        hist1, hist2 = [hists[0] for hists in self._get_intermediate(
+            "greyscale_histograms", lambda: self._histograms(MODE_GREYSCALE))]
 
         # Compare histograms using Correlation method
-        correlation = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
-        print(f"Correlation Score (Grayscale): {correlation}")
+        correlation = compare_histograms_correlation([hist1], [hist2])
+        record_value("histogram_correlation", correlation, metric=METRIC_HISTOGRAM_GRAYSCALE)
         return correlation
 
+    @timed(STAGE_METRIC, metric=METRIC_HISTOGRAM_COLORED)
     def compare_images_histograms_correlation_colored(self) -> float:
         """
         Correlation (cv2.HISTCMP_CORREL):
         Interpretation: Higher values indicate more similarity.
         :return:  Range: -1 to 1 (1 indicates perfect correlation, 0 indicates no correlation, -1 indicates perfect negative correlation).
         """
-        # Load images as colored (BGR)
-        image_1 = load_image_colored(self.image_path_1)
-        image_2 = load_image_colored(self.image_path_2)
-
-        # Resize the images to the smaller one
-        image_1, image_2 = resize_to_smaller_image(image_1, image_2)
-
-        # Calculate histograms for each BGR channel
-        hist1_b = cv2.calcHist([image_1], [0], None, [256], [0, 256])
-        hist1_g = cv2.calcHist([image_1], [1], None, [256], [0, 256])
-        hist1_r = cv2.calcHist([image_1], [2], None, [256], [0, 256])
-
-        hist2_b = cv2.calcHist([image_2], [0], None, [256], [0, 256])
-        hist2_g = cv2.calcHist([image_2], [1], None, [256], [0, 256])
-        hist2_r = cv2.calcHist([image_2], [2], None, [256], [0, 256])
-
-        # Normalize histograms
-        hist1_b = cv2.normalize(hist1_b, hist1_b).flatten()
-        hist1_g = cv2.normalize(hist1_g, hist1_g).flatten()
-        hist1_r = cv2.normalize(hist1_r, hist1_r).flatten()
-
-        hist2_b = cv2.normalize(hist2_b, hist2_b).flatten()
-        hist2_g = cv2.normalize(hist2_g, hist2_g).flatten()
-        hist2_r = cv2.normalize(hist2_r, hist2_r).flatten()
-
-        # Compare histograms for each channel using Correlation method
-        correlation_b = cv2.compareHist(hist1_b, hist2_b, cv2.HISTCMP_CORREL)
-        correlation_g = cv2.compareHist(hist1_g, hist2_g, cv2.HISTCMP_CORREL)
-        correlation_r = cv2.compareHist(hist1_r, hist2_r, cv2.HISTCMP_CORREL)
-
-        # Average correlation score across all channels
-        average_correlation = (correlation_b + correlation_g + correlation_r) / 3
-        print(f"Correlation Score (Colored): {average_correlation}")
+        # Normalized histograms for each BGR channel of both images
+        hists1, hists2 = self._get_intermediate("coloured_histograms", lambda: self._histograms(MODE_COLOURED))
+
+        # Average correlation score across all BGR channels
+        average_correlation = compare_histograms_correlation(hists1, hists2)
+        record_value("histogram_correlation", average_correlation, metric=METRIC_HISTOGRAM_COLORED)
         return average_correlation
 
+    @timed(STAGE_METRIC, metric=METRIC_ABS_DIFF_GREYSCALE)
+    @stored_result(METRIC_ABS_DIFF_GREYSCALE)
     def absolute_difference_greyscale(self) -> tuple:
         """
         Compares two images by using abs_diff method from opencv library.
@@ -223,10 +409,15 @@ class OpenCVImageComparator(AbstractImageComparison):
             A higher mean difference indicates a larger average pixel difference between the two images.
             For 8-bit images, the mean difference is typically in the range of 0 to 255, where 0 means identical and 255 would indicate maximum possible difference for every pixel (which is rare).
         """
-        img1 = load_image_greyscale(self.image_path_1)
-        img2 = load_image_greyscale(self.image_path_2)
-        return abs_diff_images(img1, img2)
-
+        img1, img2 = self._greyscale_images()
+        if img1.shape != img2.shape:
+            raise ValueError("Error: Images must be of the same size and type.")
+        # Same sized images are not resized, so the difference statistics are shared with MSE
+        statistics = self._resized_greyscale_diff_statistics()
+        return statistics["sum"], statistics["mean"]
+
+    @timed(STAGE_METRIC, metric=METRIC_ABS_DIFF_COLOURED)
+    @stored_result(METRIC_ABS_DIFF_COLOURED)
     def absolute_difference_coloured(self) -> tuple:
         """
         Compares two images by using abs_diff method from opencv library.
@@ -242,25 +433,25 @@ class OpenCVImageComparator(AbstractImageComparison):
             A higher mean difference indicates a larger average pixel difference between the two images.
             For 8-bit images, the mean difference is typically in the range of 0 to 255, where 0 means identical and 255 would indicate maximum possible difference for every pixel (which is rare).
         """
-        img1 = load_image_colored(self.image_path_1)
-        img2 = load_image_colored(self.image_path_2)
-        return abs_diff_images(img1, img2)
-
-    def compare_images_ssim_gray(self):
+        img1, img2 = self._coloured_images()
+        if img1.shape != img2.shape:
+            raise ValueError("Error: Images must be of the same size and type.")
+        statistics = self._coloured_diff_statistics()
+        return statistics["sum"], statistics["mean"]
+
+    @timed(STAGE_METRIC, metric=METRIC_SSIM_GRAY)
+    @stored_result(METRIC_SSIM_GRAY)
+    def compare_images_ssim_gray(self, backend=None):
         """
         This method calculates a score representing images differences.
         This method is loading images using grayscale mode
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
         :return: image differences as a score value
         """
-        # Load the images from the given file paths
-        image1 = load_image_greyscale(self.image_path_1)
-        image2 = load_image_greyscale(self.image_path_2)
-
-        # Calculate SSIM between the two images
-        score, diff = ssim(image1, image2, full=True)
-        diff = (diff * 255).astype("uint8")
+        # Calculate SSIM between the two images; the SSIM map is kept for find_changed_regions_ssim
+        score, diff = self._greyscale_ssim(backend)
 
-        print(f"SSIM Score (Grayscale): {score}")
+        record_value("ssim_score", score, metric=METRIC_SSIM_GRAY)
 
         # Display the difference image
         # cv2.imshow("Difference Image (Grayscale)", diff)
@@ -269,29 +460,62 @@ class OpenCVImageComparator(AbstractImageComparison):
 
         return score
 
-    def compare_images_ssim_colored(self):
+    def _greyscale_ssim(self, backend=None) -> tuple:
+        backend = resolve_ssim_backend(backend)
+        return self._get_intermediate(("ssim_gray", backend), lambda: structural_similarity(
+            *self._greyscale_images(), full=True, backend=backend))
+
+    def find_changed_regions_abs_diff(self, threshold=DEFAULT_DIFF_THRESHOLD, coloured=False,
+                                      cell_size=DEFAULT_REGION_CELL_SIZE, min_area=1) -> list:
+        """
+        Finds regions where absolute difference of the images (resized to the smaller one) exceeds the threshold.
+        :param threshold: absolute difference (0-255) above which a pixel is changed
+        :param coloured: when True coloured images are compared, using the largest difference of the channels
+        :param cell_size: size of the cells of the downsampled difference map
+        :param min_area: regions with fewer changed pixels are dropped
+        :return: list of regions (see changed_regions.create_region); score is the mean absolute difference
+        """
+        images = self._resized_coloured_images() if coloured else self._resized_greyscale_images()
+        return find_changed_regions(abs_diff_map(*images), threshold, cell_size=cell_size, min_area=min_area)
+
+    def find_changed_regions_ssim(self, threshold=DEFAULT_SSIM_THRESHOLD, backend=None,
+                                  cell_size=DEFAULT_REGION_CELL_SIZE, min_area=1) -> list:
+        """
+        Finds regions where local SSIM of the grayscale images is below the threshold.
+        The SSIM map is shared with compare_images_ssim_gray, so it is calculated only once.
+        :param threshold: local SSIM below which a pixel is changed
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
+        :param cell_size: size of the cells of the downsampled SSIM map
+        :param min_area: regions with fewer changed pixels are dropped
+        :return: list of regions (see changed_regions.create_region); score is the mean local SSIM
+            and max_difference is 1 - minimal local SSIM
+        """
+        _, ssim_map = self._greyscale_ssim(backend)
+        return find_changed_regions(1 - ssim_map, 1 - threshold, score_map=ssim_map, cell_size=cell_size,
+                                    min_area=min_area)
+
+    @timed(STAGE_METRIC, metric=METRIC_SSIM_COLORED)
+    @stored_result(METRIC_SSIM_COLORED)
+    def compare_images_ssim_colored(self, backend=None):
         """
         This method calculates a score representing images differences.
         This method is loading images using coloured mode
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
         :return: image differences as a score value
         """
 
 
         # Load the images from the given file paths
-        image1 = load_image_colored(self.image_path_1)
-        image2 = load_image_colored(self.image_path_2)
-
-        # Convert images to RGB
-        image1_rgb = cv2.cvtColor(image1, cv2.COLOR_BGR2RGB)
-        image2_rgb = cv2.cvtColor(image2, cv2.COLOR_BGR2RGB)
+        image1, image2 = self._coloured_images()
 
         # Calculate SSIM between the two images channel-wise and take the average
-        score_r, _ = ssim(image1_rgb[:, :, 0], image2_rgb[:, :, 0], full=True)
-        score_g, _ = ssim(image1_rgb[:, :, 1], image2_rgb[:, :, 1], full=True)
-        score_b, _ = ssim(image1_rgb[:, :, 2], image2_rgb[:, :, 2], full=True)
+        # With the default scikit-image filter scores are bit-identical to separate per-channel SSIM, the images
+        # are compared band by band without the SSIM map; OpenCV backends (opt-in) filter with cv2.boxFilter
+        score_b, score_g, score_r = structural_similarity_channels(
+            image1, image2, UINT8_DATA_RANGE, backend=resolve_ssim_backend(backend))
         score = (score_r + score_g + score_b) / 3
 
-        print(f"SSIM Score (Colored): {score}")
+        record_value("ssim_score", score, metric=METRIC_SSIM_COLORED)
 
         return score
 
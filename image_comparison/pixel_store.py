@@ -0,0 +1,138 @@
+import os
+import threading
+
+import numpy as np
+from image_comparison import instrumentation
+from image_comparison.feature_store import get_file_digest
+
+
+###########################
+# THIS MODULE CONTAINS PERSISTENT STORE OF DECODED PIXELS.
+# EVERY DECODED IMAGE IS ONE .npy FILE (THE HEADER KEEPS SHAPE AND DTYPE, THE FILE NAME THE DIGEST OF
+# THE IMAGE FILE CONTENT AND THE COLOUR MODE), OPENED WITH np.memmap. PIXELS ARE READ WITHOUT DECODING
+# AND WITHOUT COPYING, AND ALL WORKER PROCESSES SHARE THE SAME PAGES OF THE OS PAGE CACHE.
+# THE STORE IS DISABLED UNLESS set_pixel_store IS CALLED OR PIXEL_STORE_ENVIRONMENT_VARIABLE IS SET.
+# Stored images are decoded by the same codec calls, so comparators return exactly the same results.
+PIXEL_STORE_ENVIRONMENT_VARIABLE = "IMAGE_COMPARISON_PIXEL_STORE"
+PIXEL_FILE_EXTENSION = ".npy"
+
+COUNTER_PIXEL_STORE_HITS = "pixel_store_hits"
+COUNTER_PIXEL_STORE_MISSES = "pixel_store_misses"
+
+
+class PixelStore:
+    """
+    Directory of memory-mapped decoded images, keyed by the content digest of the image file and colour mode.
+    Files are sharded into subdirectories by the first two digits of the digest and written atomically,
+    so several processes can fill and read the store at the same time.
+    """
+    def __init__(self, store_dir, write: bool = True):
+        """
+        :param store_dir: directory of the store, created when missing
+        :param write: whether images missing in the store are added when decoded
+        """
+        self.store_dir = os.fspath(store_dir)
+        self.write = write
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def get_pixel_path(self, digest: str, mode) -> str:
+        return os.path.join(self.store_dir, digest[:2], f"{digest}.{mode}{PIXEL_FILE_EXTENSION}")
+
+    def get(self, digest: str, mode):
+        """
+        :return: read-only np.memmap of the stored image or None
+        """
+        try:
+            return np.load(self.get_pixel_path(digest, mode), mmap_mode="r")
+        except (OSError, ValueError):
+            # Missing file, or a file truncated by a crashed writer is replaced on the next put
+            return None
+
+    def put(self, digest: str, mode, img: np.ndarray) -> np.ndarray:
+        """
+        Stores decoded image.
+        :return: read-only np.memmap of the stored image
+        """
+        pixel_path = self.get_pixel_path(digest, mode)
+        os.makedirs(os.path.dirname(pixel_path), exist_ok=True)
+        temporary_path = f"{pixel_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as pixel_file:
+            np.save(pixel_file, np.ascontiguousarray(img))
+        os.replace(temporary_path, pixel_path)
+        return np.load(pixel_path, mmap_mode="r")
+
+    def load(self, image_path, mode, decoder) -> np.ndarray:
+        """
+        Returns stored image, decoding it (and storing it when writing is enabled) when missing.
+        :param image_path: path to the image file
+        :param mode: colour mode of the decoded image, e.g. image_cache.MODE_COLOURED
+        :param decoder: callable accepting image path and returning decoded np.ndarray
+        :return: read-only np.memmap, or the decoded image when the file can not be read or is not stored
+        """
+        digest = get_file_digest(image_path)
+        if digest is None:
+            return decoder(image_path)
+        img = self.get(digest, mode)
+        instrumentation.count(COUNTER_PIXEL_STORE_MISSES if img is None else COUNTER_PIXEL_STORE_HITS, mode=mode)
+        if img is not None:
+            return img
+        img = decoder(image_path)
+        return self.put(digest, mode, img) if self.write else img
+
+    def add(self, image_paths, modes, decoders: dict):
+        """
+        Decodes and stores the images in advance, e.g. a baseline set before the comparisons.
+        :param image_paths: iterable of image paths
+        :param modes: colour modes to store
+        :param decoders: dictionary of decoders of the modes
+        """
+        for image_path in image_paths:
+            digest = get_file_digest(image_path)
+            for mode in modes:
+                if digest is not None and not os.path.exists(self.get_pixel_path(digest, mode)):
+                    self.put(digest, mode, decoders[mode](image_path))
+
+    def iter_pixel_paths(self):
+        for dir_path, _, file_names in os.walk(self.store_dir):
+            for file_name in file_names:
+                if file_name.endswith(PIXEL_FILE_EXTENSION):
+                    yield os.path.join(dir_path, file_name)
+
+    def stats(self) -> dict:
+        """
+        :return: dictionary with number of stored images and their size in bytes
+        """
+        sizes = [os.path.getsize(pixel_path) for pixel_path in self.iter_pixel_paths()]
+        return {"images": len(sizes), "current_bytes": sum(sizes)}
+
+    def clear(self):
+        for pixel_path in list(self.iter_pixel_paths()):
+            os.remove(pixel_path)
+
+
+_pixel_store = None
+_environment_checked = False
+
+
+def set_pixel_store(store):
+    """
+    Installs the process wide pixel store used by load_image_colored and load_image_greyscale.
+    :param store: PixelStore, path of the store directory, or None to disable the store
+    """
+    global _pixel_store, _environment_checked
+    _pixel_store = PixelStore(store) if isinstance(store, (str, os.PathLike)) else store
+    _environment_checked = True
+
+
+def get_pixel_store():
+    """
+    :return: process wide pixel store, opened from PIXEL_STORE_ENVIRONMENT_VARIABLE on the first call
+        when it is set, or None when the store is disabled
+    """
+    global _environment_checked
+    if not _environment_checked:
+        _environment_checked = True
+        path = os.environ.get(PIXEL_STORE_ENVIRONMENT_VARIABLE)
+        if path:
+            set_pixel_store(path)
+    return _pixel_store
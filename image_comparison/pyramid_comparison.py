@@ -0,0 +1,291 @@
+import hashlib
+
+import cv2
+import numpy as np
+from image_comparison.abstract_image_comparator import AbstractImageComparison
+from image_comparison.diff_kernels import diff_statistics, diff_totals, integer_diff_statistics
+from image_comparison.image_cache import load_cached_image, MODE_COLOURED, MODE_GREYSCALE, MODE_PYRAMID
+from image_comparison.image_source import is_image_path
+from image_comparison.opencv_image_comparator import (
+    load_image_colored, load_image_greyscale, _decode_image_colored, _decode_image_greyscale,
+)
+
+
+###########################
+# THIS MODULE CONTAINS COARSE-TO-FINE COMPARISON OF IMAGES USING PYRAMIDS OF TILE DIGESTS.
+# THE LARGER IMAGE IS RESIZED TO THE EXACT SHAPE OF THE SMALLER ONE, SO BOTH PYRAMIDS HAVE MATCHING SHAPES
+# AT EVERY LEVEL. PYRAMIDS ARE CACHED PER IMAGE FILE AND BASE SHAPE, SO THEY ARE BUILT ONCE. THE DECODED IMAGE
+# IS NOT CACHED SEPARATELY, THE PYRAMID HOLDS THE ONLY CACHED COPY OF ITS PIXELS.
+# Every level has a digest of every tile of level 0 (finest level) or of 2x2 digests of the finer level.
+# Regions with equal digests are identical, so they are pruned at the coarsest level where the digests are equal,
+# and only tiles with different digests are compared pixel by pixel. Unlike blurred (e.g. Gaussian) levels,
+# digests never hide a change, so metrics are exact without a full pass over level 0.
+DEFAULT_PYRAMID_TILE_SIZE = 32
+TILE_DIGEST_SIZE = 16
+
+# When more changed tiles are left, the whole level 0 is compared in one vectorized pass
+FULL_LEVEL_CANDIDATES_FRACTION = 0.25
+
+
+def fit_to_shape(image: np.ndarray, height: int, width: int) -> np.ndarray:
+    """
+    Resizes the image to exactly the given height and width (no-op when it already has them).
+    :return: resized image
+    """
+    if image.shape[:2] == (height, width):
+        return image
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def get_base_shape(shape_1: tuple, shape_2: tuple) -> tuple:
+    """
+    :param shape_1: (height, width) of the first image
+    :param shape_2: (height, width) of the second image
+    :return: (height, width) both images are compared at, the dimensions of the smaller image
+        (the same dimensions resize_to_smaller_image resizes to)
+    """
+    height1, width1 = shape_1[:2]
+    height2, width2 = shape_2[:2]
+    if width1 > width2 or height1 > height2:
+        return height2, width2
+    return height1, width1
+
+
+def _tiles_grid(level: np.ndarray, tile_size: int) -> tuple:
+    height, width = level.shape[:2]
+    return -(-height // tile_size), -(-width // tile_size)
+
+
+def _tile(level: np.ndarray, row: int, column: int, tile_size: int) -> np.ndarray:
+    return level[row * tile_size:(row + 1) * tile_size, column * tile_size:(column + 1) * tile_size]
+
+
+def _digest(buffer) -> np.ndarray:
+    return np.frombuffer(hashlib.blake2b(buffer, digest_size=TILE_DIGEST_SIZE).digest(), dtype=np.uint8)
+
+
+def tile_digests(image: np.ndarray, tile_size: int) -> np.ndarray:
+    """
+    :return: array of shape (tile rows, tile columns, TILE_DIGEST_SIZE) with digest of the pixels of every tile
+    """
+    rows, columns = _tiles_grid(image, tile_size)
+    digests = np.empty((rows, columns, TILE_DIGEST_SIZE), dtype=np.uint8)
+    for row in range(rows):
+        for column in range(columns):
+            digests[row, column] = _digest(np.ascontiguousarray(_tile(image, row, column, tile_size)))
+    return digests
+
+
+def group_digests(digests: np.ndarray) -> np.ndarray:
+    """
+    :param digests: digests of a pyramid level
+    :return: digests of the next coarser level, digest of every 2x2 group of the digests
+    """
+    rows, columns = -(-digests.shape[0] // 2), -(-digests.shape[1] // 2)
+    padded = np.zeros((rows * 2, columns * 2, TILE_DIGEST_SIZE), dtype=np.uint8)
+    padded[:digests.shape[0], :digests.shape[1]] = digests
+    groups = padded.reshape(rows, 2, columns, 2, TILE_DIGEST_SIZE).transpose(0, 2, 1, 3, 4).reshape(rows, columns, -1)
+    grouped = np.empty((rows, columns, TILE_DIGEST_SIZE), dtype=np.uint8)
+    for row in range(rows):
+        for column in range(columns):
+            grouped[row, column] = _digest(groups[row, column])
+    return grouped
+
+
+def build_digest_pyramid(image: np.ndarray, tile_size: int = DEFAULT_PYRAMID_TILE_SIZE) -> list:
+    """
+    Builds pyramid of tile digests of the image. Level sizes depend only on the size of the image,
+    so pyramids of images with the same shape have the same shapes at every level.
+    :param image: image compared at level 0
+    :param tile_size: size of the tiles of level 0
+    :return: list of the image followed by digests of its tiles and of the coarser levels,
+        from the finest to the coarsest level of a single digest
+    """
+    levels = [image, tile_digests(image, tile_size)]
+    while levels[-1].shape[:2] != (1, 1):
+        levels.append(group_digests(levels[-1]))
+    return levels
+
+
+def _decode_image(image_path, mode) -> np.ndarray:
+    if not is_image_path(image_path):
+        return load_image_greyscale(image_path) if mode == MODE_GREYSCALE else load_image_colored(image_path)
+    return _decode_image_greyscale(image_path) if mode == MODE_GREYSCALE else _decode_image_colored(image_path)
+
+
+def load_image_shape(image_path, mode, decode_image=_decode_image) -> tuple:
+    """
+    :param image_path: path to the image file
+    :param mode: MODE_GREYSCALE or MODE_COLOURED
+    :param decode_image: callable accepting image path and mode, returning decoded image which is not cached
+    :return: cached (height, width) of the decoded image
+    """
+    height, width = load_cached_image(image_path, (MODE_PYRAMID, mode, "shape"),
+                                      lambda path: np.array(decode_image(path, mode).shape[:2]))
+    return int(height), int(width)
+
+
+def load_pyramid(image_path, mode, height: int, width: int, tile_size: int = DEFAULT_PYRAMID_TILE_SIZE,
+                 decode_image=_decode_image) -> list:
+    """
+    Returns cached digest pyramid of the image file, with the image resized to the given shape.
+    The decoded image is not cached, only the pyramid.
+    :param image_path: path to the image file
+    :param mode: MODE_GREYSCALE or MODE_COLOURED
+    :param height: height of level 0
+    :param width: width of level 0
+    :param tile_size: size of the tiles of level 0
+    :param decode_image: callable accepting image path and mode, returning decoded image which is not cached
+    :return: list of levels (see build_digest_pyramid)
+    """
+    return load_cached_image(image_path, (MODE_PYRAMID, mode, height, width, tile_size), lambda path: (
+        build_digest_pyramid(fit_to_shape(decode_image(path, mode), height, width), tile_size)))
+
+
+def tile_sums(image: np.ndarray, tile_size: int) -> np.ndarray:
+    """
+    :return: 2D array with sum of the pixels (of all channels) of every tile
+    """
+    height, width = image.shape[:2]
+    sums = np.add.reduceat(image, np.arange(0, height, tile_size), axis=0, dtype=np.float64)
+    sums = np.add.reduceat(sums, np.arange(0, width, tile_size), axis=1)
+    return sums.reshape(sums.shape[0], sums.shape[1], -1).sum(axis=2)
+
+
+def tile_mean_differences(level_1: np.ndarray, level_2: np.ndarray, tile_size: int,
+                          candidates: np.ndarray) -> np.ndarray:
+    """
+    Calculates mean absolute difference of the candidate tiles. When most tiles are candidates
+    the whole level is compared at once, otherwise tiles are compared one by one.
+    :param level_1: pyramid level of the first image
+    :param level_2: pyramid level of the second image
+    :param tile_size: size of the tiles
+    :param candidates: 2D boolean array of the tiles to compare
+    :return: 2D array of mean absolute differences, zero for tiles which are not candidates
+    """
+    means = np.zeros(candidates.shape)
+    if np.count_nonzero(candidates) > candidates.size * FULL_LEVEL_CANDIDATES_FRACTION:
+        pixels = tile_sums(np.ones(level_1.shape, dtype=np.uint8), tile_size)
+        means[candidates] = (tile_sums(cv2.absdiff(level_1, level_2), tile_size) / pixels)[candidates]
+    else:
+        for row, column in zip(*np.nonzero(candidates)):
+            means[row, column] = cv2.absdiff(_tile(level_1, row, column, tile_size),
+                                             _tile(level_2, row, column, tile_size)).mean()
+    return means
+
+
+def coarse_to_fine_changed_tiles(pyramid_1: list, pyramid_2: list) -> np.ndarray:
+    """
+    Finds tiles of level 0 which changed, starting at the coarsest level. Digests of a level are compared
+    only below the digests which differ at the coarser level, regions with equal digests are identical.
+    :param pyramid_1: pyramid of the first image
+    :param pyramid_2: pyramid of the second image, with the same shapes
+    :return: 2D boolean array of level 0 tiles with different digests
+    """
+    if [level.shape for level in pyramid_1] != [level.shape for level in pyramid_2]:
+        raise ValueError("Input images must have the same dimensions.")
+    changed = np.ones((1, 1), dtype=bool)
+    for index in range(len(pyramid_1) - 1, 0, -1):
+        digests_1, digests_2 = pyramid_1[index], pyramid_2[index]
+        rows, columns = digests_1.shape[:2]
+        # Every digest has (up to) four child digests at the finer level
+        candidates = np.repeat(np.repeat(changed, 2, axis=0), 2, axis=1)[:rows, :columns]
+        if not candidates.any():
+            return candidates
+        changed = candidates & (digests_1 != digests_2).any(axis=2)
+    return changed
+
+
+def changed_tiles_statistics(level_1: np.ndarray, level_2: np.ndarray, tile_size: int, changed: np.ndarray) -> dict:
+    """
+    Calculates statistics of absolute differences of level 0 from the changed tiles only, the other tiles are
+    identical. When most tiles changed (or the images are not 8 bits) the whole level is compared at once.
+    Sums are exact, so the statistics are the same as of diff_statistics of the whole level.
+    :param level_1: level 0 of the first pyramid
+    :param level_2: level 0 of the second pyramid
+    :param tile_size: size of the tiles
+    :param changed: 2D boolean array of changed tiles (see coarse_to_fine_changed_tiles)
+    :return: dictionary of statistics (see create_diff_statistics)
+    """
+    if level_1.dtype != np.uint8 or np.count_nonzero(changed) > changed.size * FULL_LEVEL_CANDIDATES_FRACTION:
+        return diff_statistics(level_1, level_2)
+    total = squared_total = max_diff = 0
+    for row, column in zip(*np.nonzero(changed)):
+        tile_total, tile_squared_total, tile_max_diff = diff_totals(_tile(level_1, row, column, tile_size),
+                                                                    _tile(level_2, row, column, tile_size))
+        total += tile_total
+        squared_total += tile_squared_total
+        max_diff = max(max_diff, tile_max_diff)
+    return integer_diff_statistics(total, squared_total, max_diff, level_1.size)
+
+
+class PyramidImageComparator(AbstractImageComparison):
+    """
+    Comparator of images with possibly different sizes. The larger image is resized to the exact shape
+    of the smaller one and both are turned into cached digest pyramids, so resizing is done once.
+    Changed tiles are searched coarse-to-fine (see coarse_to_fine_changed_tiles) and only they are compared
+    pixel by pixel. Level 0 has the same pixels as the images resized by resize_to_smaller_image.
+    """
+    def __init__(self, image_path_1, image_path_2, tile_size=DEFAULT_PYRAMID_TILE_SIZE, tolerance=0.0):
+        super().__init__(image_path_1, image_path_2)
+        self.tile_size = tile_size
+        self.tolerance = tolerance
+
+    def get_pyramids(self, mode=MODE_GREYSCALE) -> tuple:
+        """
+        :param mode: MODE_GREYSCALE or MODE_COLOURED
+        :return: tuple of pyramids of both images, with the same shapes at every level
+        """
+        decoded = {}
+
+        def decode_image(image_path, image_mode):
+            # An image decoded for its shape is reused by its pyramid, it is decoded at most once
+            if id(image_path) not in decoded:
+                decoded[id(image_path)] = _decode_image(image_path, image_mode)
+            return decoded[id(image_path)]
+
+        paths = (self.image_path_1, self.image_path_2)
+        height, width = get_base_shape(*(load_image_shape(path, mode, decode_image) for path in paths))
+        return tuple(load_pyramid(path, mode, height, width, self.tile_size, decode_image) for path in paths)
+
+    def find_different_tiles(self, mode=MODE_GREYSCALE) -> list:
+        """
+        :param mode: MODE_GREYSCALE or MODE_COLOURED
+        :return: list of (x, y, width, height) rectangles of level 0 tiles which differ
+        """
+        pyramid_1, pyramid_2 = self.get_pyramids(mode)
+        height, width = pyramid_1[0].shape[:2]
+        changed = coarse_to_fine_changed_tiles(pyramid_1, pyramid_2)
+        tiles = tile_mean_differences(pyramid_1[0], pyramid_2[0], self.tile_size, changed) > self.tolerance
+        return [(int(column) * self.tile_size, int(row) * self.tile_size,
+                 min(self.tile_size, width - int(column) * self.tile_size),
+                 min(self.tile_size, height - int(row) * self.tile_size)) for row, column in zip(*np.nonzero(tiles))]
+
+    def _diff_statistics(self, mode) -> dict:
+        pyramid_1, pyramid_2 = self.get_pyramids(mode)
+        changed = coarse_to_fine_changed_tiles(pyramid_1, pyramid_2)
+        return changed_tiles_statistics(pyramid_1[0], pyramid_2[0], self.tile_size, changed)
+
+    def compare_images_mse(self) -> float:
+        """
+        Calculate the Mean Squared Error (MSE) between two grayscale images resized to the smaller one.
+        Only changed tiles are compared, the result is the same as of the whole level 0.
+        :return: MSE value representing the similarity between the images. Lower values mean more similar.
+        """
+        return self._diff_statistics(MODE_GREYSCALE)["mse"]
+
+    def absolute_difference_greyscale(self) -> tuple:
+        """
+        :return: total and mean absolute differences of the grayscale images resized to the smaller one.
+        """
+        return self._absolute_difference(MODE_GREYSCALE)
+
+    def absolute_difference_coloured(self) -> tuple:
+        """
+        :return: total and mean absolute differences of the coloured images resized to the smaller one.
+        """
+        return self._absolute_difference(MODE_COLOURED)
+
+    def _absolute_difference(self, mode) -> tuple:
+        statistics = self._diff_statistics(mode)
+        return statistics["sum"], statistics["mean"]
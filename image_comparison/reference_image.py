@@ -0,0 +1,254 @@
+from collections import OrderedDict
+
+import numpy as np
+from image_comparison.opencv_image_comparator import (
+    load_image_colored, load_image_greyscale, resize_image_keep_aspect_ratio, resize_to_smaller_image,
+    calculate_normalized_histograms, compare_histograms_correlation,
+    ALL_METRICS, METRIC_MSE, METRIC_HISTOGRAM_GRAYSCALE, METRIC_HISTOGRAM_COLORED, METRIC_ABS_DIFF_GREYSCALE,
+    METRIC_ABS_DIFF_COLOURED, METRIC_SSIM_GRAY, METRIC_SSIM_COLORED,
+)
+from image_comparison.diff_kernels import diff_statistics
+from image_comparison.scikit_image_comparator import (
+    get_channel_axis, get_data_range, convert_image_to_float,
+    METRIC_SCIKIT_SSIM_GRAYSCALE, METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED, METRIC_SCIKIT_SSIM_COLOURED,
+    METRIC_SCIKIT_SSIM_COLOURED_RESIZED,
+)
+from image_comparison.image_hash_comparrison import load_image, get_difference, get_hash_min_decoded_side, HASH_METHODS
+from image_comparison.ssim_statistics import (
+    SSIMStatistics, channels_statistics, create_ssim_statistics, structural_similarity_from_statistics,
+    multichannel_structural_similarity_from_statistics, channels_structural_similarity_from_statistics,
+    resolve_ssim_backend, UINT8_DATA_RANGE, SSIM_BACKEND_SCIKIT,
+)
+
+
+###########################
+# THIS MODULE CONTAINS ONE-TO-MANY COMPARISON OF A REFERENCE (GOLDEN) IMAGE
+# AGAINST MANY CANDIDATE IMAGES
+SCIKIT_METRICS = (METRIC_SCIKIT_SSIM_GRAYSCALE, METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED, METRIC_SCIKIT_SSIM_COLOURED,
+                  METRIC_SCIKIT_SSIM_COLOURED_RESIZED)
+REFERENCE_METRICS = ALL_METRICS + SCIKIT_METRICS + tuple(HASH_METHODS)
+
+# Window size used by SciKitImageComparator for coloured images
+SCIKIT_COLOURED_WIN_SIZE = 3
+# Features of the reference kept at once, e.g. resized references and their statistics for several candidate sizes
+DEFAULT_MAX_REFERENCE_FEATURES = 16
+
+
+def check_reference_metrics(metrics):
+    unknown = [metric for metric in metrics if metric not in REFERENCE_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}")
+
+
+def check_same_shape(image_1: np.ndarray, image_2: np.ndarray):
+    if image_1.shape != image_2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+
+
+class ReferenceImage:
+    """
+    Reference image compared against many candidate images.
+    Features of the reference image (decoded and resized images, histograms, hashes and SSIM local statistics)
+    are calculated once and reused for every candidate. At most max_features of them are kept, the least recently
+    used one is dropped first, so candidates of many sizes do not grow the memory.
+    Results are identical to the pair-wise comparators called with the reference as the first image.
+    """
+    def __init__(self, image_path, max_features=DEFAULT_MAX_REFERENCE_FEATURES):
+        self.image_path = image_path
+        self.max_features = max_features
+        self._features = OrderedDict()
+
+    def _get_feature(self, key, factory):
+        value = self._features.get(key)
+        if value is None:
+            value = factory()
+            self._features[key] = value
+            while len(self._features) > self.max_features:
+                self._features.popitem(last=False)
+        else:
+            self._features.move_to_end(key)
+        return value
+
+    def _greyscale(self) -> np.ndarray:
+        return self._get_feature("greyscale", lambda: load_image_greyscale(self.image_path))
+
+    def _coloured(self) -> np.ndarray:
+        return self._get_feature("coloured", lambda: load_image_colored(self.image_path))
+
+    def _resize_to_smaller_image(self, name: str, reference: np.ndarray, candidate: np.ndarray) -> tuple:
+        """
+        Same as resize_to_smaller_image, but keeps the resized reference for candidates of the same size.
+        """
+        height1, width1 = reference.shape[:2]
+        height2, width2 = candidate.shape[:2]
+        if (width1, height1) != (width2, height2) and (width1 > width2 or height1 > height2):
+            resized = self._get_feature((name, (height2, width2)),
+                                        lambda: resize_image_keep_aspect_ratio(reference, width2, height2))
+            return resized, candidate
+        return resize_to_smaller_image(reference, candidate)
+
+    def _histograms(self, name: str, reference: np.ndarray) -> list:
+        return self._get_feature((name + "_histograms", reference.shape),
+                                 lambda: calculate_normalized_histograms(reference))
+
+    def _ssim_statistics(self, name: str, reference: np.ndarray, backend: str) -> SSIMStatistics:
+        return self._get_feature((name + "_ssim", reference.shape, backend),
+                                 lambda: create_ssim_statistics(reference, backend=backend))
+
+    def _coloured_ssim_statistics(self, reference: np.ndarray, backend: str) -> SSIMStatistics:
+        return self._get_feature(("coloured_ssim", reference.shape, backend),
+                                 lambda: create_ssim_statistics(reference, multichannel=True, backend=backend))
+
+    def _scikit_coloured_features(self, reference: np.ndarray, backend: str) -> tuple:
+        """
+        :return: channel axis, data range and SSIM statistics of the float image
+            (per-channel list for scikit backend, multichannel statistics for other backends)
+        """
+        return self._get_feature(("scikit_coloured", reference.shape, backend), lambda: (
+            get_channel_axis(reference), get_data_range(reference),
+            self._float_image_statistics(convert_image_to_float(reference), backend)))
+
+    @staticmethod
+    def _float_image_statistics(img: np.ndarray, backend: str):
+        if backend == SSIM_BACKEND_SCIKIT:
+            return channels_statistics(img, SCIKIT_COLOURED_WIN_SIZE)
+        return create_ssim_statistics(img, SCIKIT_COLOURED_WIN_SIZE, multichannel=True, backend=backend)
+
+    def _hash(self, metric: str, min_side=None):
+        return self._get_feature(("hash", metric, min_side),
+                                 lambda: HASH_METHODS[metric](load_image(self.image_path, min_side)))
+
+    # OPENCV METRICS
+    def _mse(self, candidate_path) -> float:
+        reference, candidate = self._resize_to_smaller_image(
+            "greyscale_resized", self._greyscale(), load_image_greyscale(candidate_path))
+        return diff_statistics(reference, candidate)["mse"]
+
+    def _histogram_correlation(self, name: str, reference: np.ndarray, candidate: np.ndarray) -> float:
+        reference, candidate = self._resize_to_smaller_image(name + "_resized", reference, candidate)
+        return compare_histograms_correlation(self._histograms(name, reference),
+                                              calculate_normalized_histograms(candidate))
+
+    def _histogram_correlation_grayscale(self, candidate_path) -> float:
+        return self._histogram_correlation("greyscale", self._greyscale(), load_image_greyscale(candidate_path))
+
+    def _histogram_correlation_colored(self, candidate_path) -> float:
+        return self._histogram_correlation("coloured", self._coloured(), load_image_colored(candidate_path))
+
+    @staticmethod
+    def _abs_diff(reference: np.ndarray, candidate: np.ndarray) -> tuple:
+        if reference.shape != candidate.shape:
+            raise ValueError("Error: Images must be of the same size and type.")
+        statistics = diff_statistics(reference, candidate)
+        return statistics["sum"], statistics["mean"]
+
+    def _abs_diff_greyscale(self, candidate_path) -> tuple:
+        return self._abs_diff(self._greyscale(), load_image_greyscale(candidate_path))
+
+    def _abs_diff_coloured(self, candidate_path) -> tuple:
+        return self._abs_diff(self._coloured(), load_image_colored(candidate_path))
+
+    def _ssim_greyscale(self, reference: np.ndarray, candidate: np.ndarray, name: str) -> tuple:
+        check_same_shape(reference, candidate)
+        backend = resolve_ssim_backend(None)
+        return structural_similarity_from_statistics(self._ssim_statistics(name, reference, backend),
+                                                     create_ssim_statistics(candidate, backend=backend),
+                                                     UINT8_DATA_RANGE)
+
+    def _ssim_gray(self, candidate_path):
+        score, _ = self._ssim_greyscale(self._greyscale(), load_image_greyscale(candidate_path), "greyscale")
+        return score
+
+    def _ssim_colored(self, candidate_path):
+        reference = self._coloured()
+        candidate = load_image_colored(candidate_path)
+        check_same_shape(reference, candidate)
+        backend = resolve_ssim_backend(None)
+        (score_b, score_g, score_r), _ = channels_structural_similarity_from_statistics(
+            self._coloured_ssim_statistics(reference, backend),
+            create_ssim_statistics(candidate, multichannel=True, backend=backend), UINT8_DATA_RANGE)
+        return (score_r + score_g + score_b) / 3
+
+    # SCIKIT-IMAGE METRICS
+    def _scikit_ssim_grayscale(self, reference: np.ndarray, candidate: np.ndarray, name: str) -> tuple:
+        similarity, diff = self._ssim_greyscale(reference, candidate, name)
+        return similarity, np.mean(diff)
+
+    def _scikit_ssim_grayscale_native(self, candidate_path) -> tuple:
+        return self._scikit_ssim_grayscale(self._greyscale(), load_image_greyscale(candidate_path), "greyscale")
+
+    def _scikit_ssim_grayscale_resized(self, candidate_path) -> tuple:
+        reference, candidate = self._resize_to_smaller_image(
+            "greyscale_resized", self._greyscale(), load_image_greyscale(candidate_path))
+        return self._scikit_ssim_grayscale(reference, candidate, "greyscale")
+
+    def _scikit_ssim_coloured(self, reference: np.ndarray, candidate: np.ndarray) -> tuple:
+        backend = resolve_ssim_backend(None)
+        channel_axis_1, data_range_1, stats_1 = self._scikit_coloured_features(reference, backend)
+        if channel_axis_1 != get_channel_axis(candidate):
+            raise ValueError("The two images have different channel axes, cannot compare")
+        if data_range_1 != get_data_range(candidate):
+            raise ValueError("Data ranges of the images are different")
+        check_same_shape(reference, candidate)
+        stats_2 = self._float_image_statistics(convert_image_to_float(candidate), backend)
+        if backend == SSIM_BACKEND_SCIKIT:
+            similarity, diff = multichannel_structural_similarity_from_statistics(stats_1, stats_2, data_range_1)
+        else:
+            scores, diff = channels_structural_similarity_from_statistics(stats_1, stats_2, data_range_1)
+            similarity = np.array(scores, dtype=diff.dtype).mean()
+        return similarity, np.mean(diff)
+
+    def _scikit_ssim_coloured_native(self, candidate_path) -> tuple:
+        return self._scikit_ssim_coloured(self._coloured(), load_image_colored(candidate_path))
+
+    def _scikit_ssim_coloured_resized(self, candidate_path) -> tuple:
+        reference, candidate = self._resize_to_smaller_image(
+            "coloured_resized", self._coloured(), load_image_colored(candidate_path))
+        return self._scikit_ssim_coloured(reference, candidate)
+
+    # IMAGEHASH METRICS
+    def _hash_difference(self, metric: str, candidate_path):
+        min_side = get_hash_min_decoded_side(metric)
+        return get_difference(self._hash(metric, min_side), HASH_METHODS[metric](load_image(candidate_path, min_side)))
+
+    def compare(self, candidate_path, metrics=None) -> dict:
+        """
+        Compares the reference image with one candidate image.
+        :param candidate_path: File path to the candidate image
+        :param metrics: iterable of metric names (see REFERENCE_METRICS); all metrics are calculated when omitted.
+        :return: dictionary mapping metric name to the value returned by the corresponding pair-wise method.
+        """
+        methods = {
+            METRIC_MSE: self._mse,
+            METRIC_HISTOGRAM_GRAYSCALE: self._histogram_correlation_grayscale,
+            METRIC_HISTOGRAM_COLORED: self._histogram_correlation_colored,
+            METRIC_ABS_DIFF_GREYSCALE: self._abs_diff_greyscale,
+            METRIC_ABS_DIFF_COLOURED: self._abs_diff_coloured,
+            METRIC_SSIM_GRAY: self._ssim_gray,
+            METRIC_SSIM_COLORED: self._ssim_colored,
+            METRIC_SCIKIT_SSIM_GRAYSCALE: self._scikit_ssim_grayscale_native,
+            METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED: self._scikit_ssim_grayscale_resized,
+            METRIC_SCIKIT_SSIM_COLOURED: self._scikit_ssim_coloured_native,
+            METRIC_SCIKIT_SSIM_COLOURED_RESIZED: self._scikit_ssim_coloured_resized,
+        }
+        metrics = REFERENCE_METRICS if metrics is None else tuple(metrics)
+        check_reference_metrics(metrics)
+        results = {}
+        for metric in metrics:
+            if metric in HASH_METHODS:
+                results[metric] = self._hash_difference(metric, candidate_path)
+            else:
+                results[metric] = methods[metric](candidate_path)
+        return results
+
+    def compare_many(self, candidates, metrics=None):
+        """
+        Compares the reference image with every candidate image, one candidate at a time as the results are consumed.
+        :param candidates: iterable of candidate image paths
+        :param metrics: iterable of metric names (see REFERENCE_METRICS); all metrics are calculated when omitted.
+            Unknown metrics raise ValueError before any candidate is compared.
+        :return: generator of result dictionaries (see compare), in the order of candidates.
+        """
+        metrics = REFERENCE_METRICS if metrics is None else tuple(metrics)
+        check_reference_metrics(metrics)
+        return (self.compare(candidate_path, metrics) for candidate_path in candidates)
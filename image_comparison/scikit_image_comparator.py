@@ -1,9 +1,21 @@
 from image_comparison.opencv_image_comparator import *
 import cv2
 import numpy as np
+from image_comparison import instrumentation
 from image_comparison.abstract_image_comparator import *
-from skimage.metrics import structural_similarity as ssim
+from image_comparison.instrumentation import (
+    timed, record_value, STAGE_FLOAT_CONVERSION, STAGE_METRIC, COUNTER_ALLOCATED_BYTES,
+)
 from skimage.util import img_as_float
+from image_comparison.ssim_statistics import structural_similarity
+from image_comparison.feature_store import stored_result
+
+
+# METRIC NAMES OF SciKitImageComparator METHODS
+METRIC_SCIKIT_SSIM_GRAYSCALE = "scikit_ssim_grayscale"
+METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED = "scikit_ssim_grayscale_resized"
+METRIC_SCIKIT_SSIM_COLOURED = "scikit_ssim_coloured"
+METRIC_SCIKIT_SSIM_COLOURED_RESIZED = "scikit_ssim_coloured_resized"
 
 
 def get_channel_axis(img) -> int:
@@ -12,15 +24,15 @@ def get_channel_axis(img) -> int:
     :param img:
     :return: int value presenting channel number.
     """
-    # Print shape to inspect
-    print("Image shape:", img.shape)
     # Decide channel_axis based on the shape
     if img.shape[-1] == 3:
-        return 2  # Last axis holds the color channels
+        channel_axis = 2  # Last axis holds the color channels
     elif img.shape[0] == 3:
-        return 0  # First axis holds the color channels
+        channel_axis = 0  # First axis holds the color channels
     else:
-        return -1  # Grayscale image, no separate color channels
+        channel_axis = -1  # Grayscale image, no separate color channels
+    record_value("channel_axis", channel_axis)
+    return channel_axis
 
 
 def get_data_range(img) -> int:
@@ -30,8 +42,8 @@ def get_data_range(img) -> int:
     :return: int value presnting image's data range.
     """
     min_val, max_val = np.min(img), np.max(img)
-    print("Min value:", min_val)
-    print("Max value:", max_val)
+    record_value("image_min_value", min_val)
+    record_value("image_max_value", max_val)
 
     # Determine data_range based on min and max values
     if min_val >= 0 and max_val <= 1:
@@ -51,14 +63,18 @@ def convert_image_to_float(img: np.ndarray) -> np.ndarray:
     :param img:
     :return: returns image in a fload form of the np.ndarray
     """
-    return img.astype(np.float32) / 255.0  # Converts to float and scales to 0-1 range
+    with instrumentation.stage(STAGE_FLOAT_CONVERSION):
+        img_float = img.astype(np.float32) / 255.0  # Converts to float and scales to 0-1 range
+    instrumentation.count(COUNTER_ALLOCATED_BYTES, img_float.nbytes, stage=STAGE_FLOAT_CONVERSION)
+    return img_float
 
 
-def _compare_coloured_images_using_ssim(img1: np.ndarray, img2: np.ndarray):
+def _compare_coloured_images_using_ssim(img1: np.ndarray, img2: np.ndarray, backend=None):
     """
     Utility method to compare two images using ssim algorithm.
     :param img1:
     :param img2:
+    :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
     :return: tuple containing similarity and mean difference.
     """
     channel_axis_1 = get_channel_axis(img1)
@@ -82,8 +98,9 @@ def _compare_coloured_images_using_ssim(img1: np.ndarray, img2: np.ndarray):
     if data_range_1 != data_range_2:
         raise ValueError("Data ranges of the images are different")
 
-    similarity, diff = ssim(img1_float, img2_float, full=True,
-                            win_size=3, channel_axis=channel_axis_1, data_range=data_range_1)  # Use multichannel=True for color
+    similarity, diff = structural_similarity(img1_float, img2_float, full=True, win_size=3,
+                                             channel_axis=channel_axis_1, data_range=data_range_1,
+                                             backend=backend)  # Use multichannel=True for color
     mean_diff = np.mean(diff)  # Assuming 'diff' is the output from the SSIM function
     # mean_diff closer to 0 indicates greater difference
     return similarity, mean_diff
@@ -96,23 +113,29 @@ class SciKitImageComparator(AbstractImageComparison):
     def __init__(self, img_path_1: str, img_path_2: str):
         super().__init__(img_path_1, img_path_2)
 
-    def compare_grayscale_images_ssim(self) -> tuple:
+    @timed(STAGE_METRIC, metric=METRIC_SCIKIT_SSIM_GRAYSCALE)
+    @stored_result(METRIC_SCIKIT_SSIM_GRAYSCALE)
+    def compare_grayscale_images_ssim(self, backend=None) -> tuple:
         """
         This method compares grayscale images using _compare_coloured_images_using_ssim method.
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
         :return: tuple containing similarity and mean difference.
         """
         img1 = load_image_greyscale(self.image_path_1)
         img2 = load_image_greyscale(self.image_path_2)
-        similarity, diff = ssim(img1, img2, full=True)
+        similarity, diff = structural_similarity(img1, img2, full=True, backend=backend)
         mean_diff = np.mean(diff) # Assuming 'diff' is the output from the SSIM function
         # mean_diff closer to 0 indicates greater difference
         return similarity, mean_diff
 
-    def compare_grayscale_resized_images_ssim(self) -> tuple:
+    @timed(STAGE_METRIC, metric=METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED)
+    @stored_result(METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED)
+    def compare_grayscale_resized_images_ssim(self, backend=None) -> tuple:
         """
         This method compares grayscale images re-sized to the image with the smallest dimensions.
         This method calls _compare_coloured_images_using_ssim.
 
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
         :return: tuple containing similarity and mean difference.
         """
         img1 = load_image_greyscale(self.image_path_1)
@@ -120,26 +143,32 @@ class SciKitImageComparator(AbstractImageComparison):
 
         img1, img2 = resize_to_smaller_image(img1, img2)
 
-        similarity, diff = ssim(img1, img2, full=True)
+        similarity, diff = structural_similarity(img1, img2, full=True, backend=backend)
         mean_diff = np.mean(diff) # Assuming 'diff' is the output from the SSIM function
         # mean_diff closer to 0 indicates greater difference
         return similarity, mean_diff
 
-    def compare_coloured_images_ssim(self) -> tuple:
+    @timed(STAGE_METRIC, metric=METRIC_SCIKIT_SSIM_COLOURED)
+    @stored_result(METRIC_SCIKIT_SSIM_COLOURED)
+    def compare_coloured_images_ssim(self, backend=None) -> tuple:
         """
         This method calls  _compare_coloured_images_using_ssim method for coloured images.
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
         :return: tuple containing similarity and mean difference.
         """
         img1 = load_image_colored(self.image_path_1)
         img2 = load_image_colored(self.image_path_2)
-        return _compare_coloured_images_using_ssim(img1, img2)
+        return _compare_coloured_images_using_ssim(img1, img2, backend)
 
-    def compare_coloured_resized_images_ssim(self) -> tuple:
+    @timed(STAGE_METRIC, metric=METRIC_SCIKIT_SSIM_COLOURED_RESIZED)
+    @stored_result(METRIC_SCIKIT_SSIM_COLOURED_RESIZED)
+    def compare_coloured_resized_images_ssim(self, backend=None) -> tuple:
         """
         This method calls _compare_coloured_images_using_ssim method for coloured, re-sized images.
+        :param backend: SSIM backend (see image_comparison.ssim_statistics), scikit-image by default
         :return: tuple containing similarity and mean difference.
         """
         img1 = load_image_colored(self.image_path_1)
         img2 = load_image_colored(self.image_path_2)
         img1, img2 = resize_to_smaller_image(img1, img2)
-        return _compare_coloured_images_using_ssim(img1, img2)
+        return _compare_coloured_images_using_ssim(img1, img2, backend)
@@ -0,0 +1,477 @@
+import cv2
+import numpy as np
+from scipy.ndimage import uniform_filter, uniform_filter1d
+from skimage.metrics import structural_similarity as skimage_structural_similarity
+from skimage.util import crop
+from image_comparison.instrumentation import timed, STAGE_SSIM
+
+
+###########################
+# THIS MODULE CONTAINS SSIM IMPLEMENTATION SPLIT INTO PER-IMAGE LOCAL STATISTICS
+# AND THE PAIR-WISE PART. IT FOLLOWS skimage.metrics.structural_similarity
+# (UNIFORM WINDOW, SAMPLE COVARIANCE) OPERATION BY OPERATION, SO SCORES ARE BIT-IDENTICAL,
+# BUT STATISTICS OF AN IMAGE COMPARED MANY TIMES ARE CALCULATED ONLY ONCE.
+DEFAULT_WIN_SIZE = 7
+K1 = 0.01
+K2 = 0.03
+# Data range used by scikit-image for uint8 images
+UINT8_DATA_RANGE = 255
+
+# Uniform filter implementations. scipy.ndimage is used by scikit-image and gives bit-identical scores,
+# OpenCV box filter is several times faster and differs only by floating point rounding.
+FILTER_SCIPY = "scipy"
+FILTER_OPENCV = "opencv"
+
+# SSIM backends, selectable per call or globally with set_ssim_backend:
+#   scikit         - skimage.metrics.structural_similarity (scipy filters, float64 for 8 bits images)
+#   opencv         - OpenCV box filter in float64, score deviates from scikit-image by less than 1e-12
+#   opencv_float32 - OpenCV box filter with float32 buffers (box sums are accumulated in float64 by OpenCV),
+#                    score of 8 bits images deviates from scikit-image by at most OPENCV_FLOAT32_MAX_DEVIATION
+SSIM_BACKEND_SCIKIT = "scikit"
+SSIM_BACKEND_OPENCV = "opencv"
+SSIM_BACKEND_OPENCV_FLOAT32 = "opencv_float32"
+SSIM_BACKENDS = (SSIM_BACKEND_SCIKIT, SSIM_BACKEND_OPENCV, SSIM_BACKEND_OPENCV_FLOAT32)
+OPENCV_MAX_DEVIATION = 1e-12
+OPENCV_FLOAT32_MAX_DEVIATION = 1e-5
+# Image rows processed at once by banded_channels_structural_similarity, so its buffers stay in the CPU cache
+SSIM_BAND_ROWS = 16
+# Integer types of window sums of the values and their products in banded_channels_structural_similarity;
+# sums of at most a few thousand rows of 8 and 16 bits products are exact in them and in float64
+_BANDED_SUM_TYPES = {1: np.int32, 2: np.int64}
+
+# Filter and float type used by each backend
+_BACKEND_SETTINGS = {
+    SSIM_BACKEND_SCIKIT: (FILTER_SCIPY, None),
+    SSIM_BACKEND_OPENCV: (FILTER_OPENCV, None),
+    SSIM_BACKEND_OPENCV_FLOAT32: (FILTER_OPENCV, np.float32),
+}
+_ssim_backend = None
+
+
+def set_ssim_backend(backend):
+    """
+    Sets SSIM backend used by all comparators, unless a backend is passed to the method.
+    :param backend: one of SSIM_BACKENDS, or None to restore default backends of the methods
+    """
+    global _ssim_backend
+    if backend is not None:
+        check_ssim_backend(backend)
+    _ssim_backend = backend
+
+
+def get_ssim_backend():
+    """
+    :return: globally selected SSIM backend, None when methods use their default backends
+    """
+    return _ssim_backend
+
+
+def check_ssim_backend(backend):
+    if backend not in SSIM_BACKENDS:
+        raise ValueError(f"Unknown SSIM backend: {backend}")
+
+
+def resolve_ssim_backend(backend, default=SSIM_BACKEND_SCIKIT) -> str:
+    """
+    :param backend: backend passed to the method
+    :param default: default backend of the method
+    :return: backend passed to the method, otherwise the global one, otherwise the default one
+    """
+    backend = backend or _ssim_backend or default
+    check_ssim_backend(backend)
+    return backend
+
+
+def get_ssim_float_type(dtype) -> type:
+    """
+    Returns floating point type used by scikit-image to calculate SSIM for the given image type.
+    :param dtype: image dtype
+    :return: np.float32 or np.float64
+    """
+    if np.dtype(dtype) in (np.float16, np.float32):
+        return np.float32
+    return np.float64
+
+
+def uniform_filter_image(img: np.ndarray, win_size: int, multichannel: bool = False,
+                         filter_backend: str = FILTER_SCIPY) -> np.ndarray:
+    """
+    Calculates local mean of the image with uniform window and reflected borders.
+    :param img: float image, channels (if any) on the last axis
+    :param win_size: size of the window
+    :param multichannel: when True, the window spans a single channel
+    :param filter_backend: FILTER_SCIPY (same as scikit-image) or FILTER_OPENCV (cv2.boxFilter)
+    :return: filtered image
+    """
+    if filter_backend == FILTER_OPENCV:
+        return cv2.boxFilter(img, -1, (win_size, win_size), borderType=cv2.BORDER_REFLECT)
+    if filter_backend != FILTER_SCIPY:
+        raise ValueError(f"Unknown filter backend: {filter_backend}")
+    size = (win_size, win_size, 1) if multichannel else win_size
+    return uniform_filter(img, size=size)
+
+
+class SSIMStatistics:
+    """
+    Local mean and variance of an image, calculated with uniform window.
+    Multichannel images (channels on the last axis) are filtered in one pass with window spanning
+    a single channel, which gives the same values as filtering every channel separately.
+    """
+    def __init__(self, img: np.ndarray, win_size: int = DEFAULT_WIN_SIZE, multichannel: bool = False,
+                 filter_backend: str = FILTER_SCIPY, float_type=None):
+        spatial_ndim = img.ndim - 1 if multichannel else img.ndim
+        if np.any((np.asarray(img.shape[:spatial_ndim]) - win_size) < 0):
+            raise ValueError("win_size exceeds image extent.")
+        self.shape = img.shape
+        self.win_size = win_size
+        self.multichannel = multichannel
+        self.filter_backend = filter_backend
+        self.image = img.astype(float_type or get_ssim_float_type(img.dtype), copy=False)
+        np_ = win_size ** spatial_ndim
+        self.cov_norm = np_ / (np_ - 1)
+        self.mean = self.filter(self.image)
+        mean_of_squares = self.filter(self.image * self.image)
+        mean_of_squares -= self.mean * self.mean
+        mean_of_squares *= self.cov_norm
+        self.variance = mean_of_squares
+        self.mean_squared = self.mean ** 2
+
+    def filter(self, img: np.ndarray) -> np.ndarray:
+        return uniform_filter_image(img, self.win_size, self.multichannel, self.filter_backend)
+
+
+def ssim_map_from_statistics(stats_1: SSIMStatistics, stats_2: SSIMStatistics, data_range) -> np.ndarray:
+    """
+    Calculates SSIM map of two images from their precalculated statistics.
+    Operations are done in-place on as few temporaries as possible, in the same order as scikit-image does them.
+    :param stats_1: statistics of the first image
+    :param stats_2: statistics of the second image
+    :param data_range: data range of the images
+    :return: SSIM map
+    """
+    if stats_1.shape != stats_2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    ux, uy = stats_1.mean, stats_2.mean
+    ux_uy = ux * uy
+    # vxy = cov_norm * (uxy - ux * uy)
+    vxy = stats_1.filter(stats_1.image * stats_2.image)
+    vxy -= ux_uy
+    vxy *= stats_1.cov_norm
+
+    c1 = (K1 * data_range) ** 2
+    c2 = (K2 * data_range) ** 2
+    # a1 = 2 * ux * uy + c1
+    a1 = np.multiply(ux, 2)
+    a1 *= uy
+    a1 += c1
+    # a2 = 2 * vxy + c2
+    a2 = vxy
+    a2 *= 2
+    a2 += c2
+    # b1 = ux ** 2 + uy ** 2 + c1
+    b1 = np.add(stats_1.mean_squared, stats_2.mean_squared)
+    b1 += c1
+    # b2 = vx + vy + c2
+    b2 = ux_uy
+    np.add(stats_1.variance, stats_2.variance, out=b2)
+    b2 += c2
+    # s = (a1 * a2) / (b1 * b2)
+    a1 *= a2
+    b1 *= b2
+    a1 /= b1
+    return a1
+
+
+def structural_similarity_from_statistics(stats_1: SSIMStatistics, stats_2: SSIMStatistics, data_range) -> tuple:
+    """
+    Calculates SSIM of two single channel images from their precalculated statistics.
+    :param stats_1: statistics of the first image
+    :param stats_2: statistics of the second image
+    :param data_range: data range of the images
+    :return: tuple containing mean SSIM and the full SSIM map
+    """
+    s = ssim_map_from_statistics(stats_1, stats_2, data_range)
+    pad = (stats_1.win_size - 1) // 2
+    mssim = crop(s, pad).mean(dtype=np.float64)
+    return mssim, s
+
+
+def channels_structural_similarity_from_statistics(stats_1: SSIMStatistics, stats_2: SSIMStatistics,
+                                                   data_range) -> tuple:
+    """
+    Calculates SSIM of every channel of two multichannel images from their precalculated statistics.
+    :param stats_1: multichannel statistics of the first image
+    :param stats_2: multichannel statistics of the second image
+    :param data_range: data range of the images
+    :return: tuple containing list of mean SSIM of every channel and the full SSIM map
+    """
+    s = ssim_map_from_statistics(stats_1, stats_2, data_range)
+    pad = (stats_1.win_size - 1) // 2
+    cropped = s[pad:s.shape[0] - pad, pad:s.shape[1] - pad]
+    return [cropped[..., channel].mean(dtype=np.float64) for channel in range(s.shape[-1])], s
+
+
+def _reflected_indexes(length: int, before: int, after: int) -> np.ndarray:
+    """
+    :return: indexes of the items of an axis extended by reflection (mode "reflect" of scipy.ndimage)
+    """
+    indexes = np.arange(-before, length + after)
+    indexes = np.where(indexes < 0, -indexes - 1, indexes)
+    return np.where(indexes >= length, 2 * length - indexes - 1, indexes)
+
+
+class _MeanAccumulator:
+    """
+    Mean of values added in C order, equal to numpy mean of all of them at once: numpy sums non-contiguous
+    arrays through buffers of np.getbufsize() items, pairwise within the buffer and sequentially across them.
+    """
+    def __init__(self):
+        self.buffer = np.empty(np.getbufsize())
+        self.filled = 0
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, values: np.ndarray):
+        """
+        :param values: contiguous 1-D float64 array
+        """
+        self.count += values.size
+        bufsize = self.buffer.size
+        start = 0
+        if self.filled:
+            start = min(values.size, bufsize - self.filled)
+            self.buffer[self.filled:self.filled + start] = values[:start]
+            self.filled += start
+            if self.filled < bufsize:
+                return
+            self.total += np.add.reduce(self.buffer)
+            self.filled = 0
+        while values.size - start >= bufsize:
+            self.total += np.add.reduce(values[start:start + bufsize])
+            start += bufsize
+        self.filled = values.size - start
+        self.buffer[:self.filled] = values[start:]
+
+    def mean(self) -> float:
+        if self.filled:
+            self.total += np.add.reduce(self.buffer[:self.filled])
+            self.filled = 0
+        return self.total / self.count
+
+
+def supports_banded_structural_similarity(dtype) -> bool:
+    """
+    :param dtype: image dtype
+    :return: whether banded_channels_structural_similarity calculates SSIM of images of the type
+    """
+    dtype = np.dtype(dtype)
+    return np.issubdtype(dtype, np.integer) and dtype.itemsize in _BANDED_SUM_TYPES
+
+
+def banded_channels_structural_similarity(image1: np.ndarray, image2: np.ndarray, data_range,
+                                          win_size: int = DEFAULT_WIN_SIZE, band_rows: int = SSIM_BAND_ROWS) -> list:
+    """
+    Calculates mean SSIM of every channel of two 8 or 16 bits images (channels on the last axis), bit-identical
+    to calling skimage structural_similarity on every channel, without the SSIM map.
+    Images are processed in bands of rows in channel-planar float64 buffers of the band size:
+      - vertical window sums of the values and their products are exact integers, so they are updated row
+        by row in integer buffers and divided once, which gives the same values as the first pass of
+        scipy uniform_filter,
+      - the horizontal pass is done by scipy.ndimage.uniform_filter1d on all five statistics at once,
+      - squares and product of the means are shared by the variances and the SSIM terms
+        (2 * ux * uy equals 2 * (ux * uy) exactly),
+      - SSIM of the rows within the filter radius from the edges is not calculated at all.
+    :param image1: first image, integer type of 1 or 2 bytes (see supports_banded_structural_similarity)
+    :param image2: second image of the same shape and type
+    :param data_range: data range of the images
+    :param win_size: size of the uniform window
+    :param band_rows: number of rows processed at once
+    :return: list of mean SSIM of every channel
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    height, width, channels = image1.shape
+    if min(height, width) < win_size:
+        raise ValueError("win_size exceeds image extent.")
+    before = win_size // 2
+    pad = (win_size - 1) // 2
+    rows = _reflected_indexes(height, before, win_size - before - 1)
+    np_ = win_size ** 2
+    cov_norm = np_ / (np_ - 1)
+    c1 = (K1 * data_range) ** 2
+    c2 = (K2 * data_range) ** 2
+
+    # Values of x, y, x * x, y * y and x * y of the padded rows needed by the band, and their window sums
+    inputs = np.empty((band_rows + win_size, 5, channels, width), dtype=_BANDED_SUM_TYPES[image1.dtype.itemsize])
+    window = np.empty(inputs.shape[1:], dtype=inputs.dtype)
+    means = np.empty((5, band_rows, channels, width))
+    filtered = np.empty_like(means)
+    squares_x, squares_y, products = np.empty((3, band_rows, channels, width))
+    cropped = np.empty((channels, band_rows, width - 2 * pad))
+    accumulators = [_MeanAccumulator() for _ in range(channels)]
+    first = filled = 0
+    for start in range(pad, height - pad, band_rows):
+        stop = min(start + band_rows, height - pad)
+        n = stop - start
+        # Padded rows start - 1 .. stop + win_size - 2 are needed, the ones of the previous band are kept
+        keep_from = max(start - 1, 0)
+        kept = max(first + filled - keep_from, 0)
+        inputs[:kept] = inputs[keep_from - first:filled]
+        first = keep_from
+        new_rows = rows[first + kept:stop + win_size - 1]
+        band = inputs[kept:kept + len(new_rows)]
+        band[:, 0] = image1[new_rows].transpose(0, 2, 1)
+        band[:, 1] = image2[new_rows].transpose(0, 2, 1)
+        np.multiply(band[:, 0], band[:, 0], out=band[:, 2])
+        np.multiply(band[:, 1], band[:, 1], out=band[:, 3])
+        np.multiply(band[:, 0], band[:, 1], out=band[:, 4])
+        filled = kept + len(new_rows)
+
+        band_means = means[:, :n]
+        for row in range(start, stop):
+            # Window of output row r spans padded rows r .. r + win_size - 1
+            if row == pad:
+                np.sum(inputs[row - first:row - first + win_size], axis=0, out=window)
+            else:
+                window += inputs[row - first + win_size - 1]
+                window -= inputs[row - first - 1]
+            np.divide(window, win_size, out=band_means[:, row - start])
+        uniform_filter1d(band_means, win_size, axis=-1, output=filtered[:, :n])
+        ux, uy, vx, vy, vxy = filtered[:, :n]
+
+        # Same operations as skimage structural_similarity, in place
+        sx, sy, s = squares_x[:n], squares_y[:n], products[:n]
+        np.multiply(ux, ux, out=sx)
+        np.multiply(uy, uy, out=sy)
+        np.multiply(ux, uy, out=s)
+        vx -= sx
+        vx *= cov_norm
+        vy -= sy
+        vy *= cov_norm
+        vxy -= s
+        vxy *= cov_norm
+        # s = (2 * ux * uy + c1) * (2 * vxy + c2) / ((ux ** 2 + uy ** 2 + c1) * (vx + vy + c2))
+        s *= 2
+        s += c1
+        vxy *= 2
+        vxy += c2
+        sx += sy
+        sx += c1
+        vx += vy
+        vx += c2
+        sx *= vx
+        s *= vxy
+        s /= sx
+
+        band_cropped = cropped[:, :n]
+        band_cropped[...] = s[:, :, pad:width - pad].transpose(1, 0, 2)
+        for channel, accumulator in enumerate(accumulators):
+            accumulator.add(band_cropped[channel].reshape(-1))
+    return [accumulator.mean() for accumulator in accumulators]
+
+
+def create_ssim_statistics(img: np.ndarray, win_size: int = DEFAULT_WIN_SIZE, multichannel: bool = False,
+                           backend: str = SSIM_BACKEND_SCIKIT) -> SSIMStatistics:
+    """
+    Calculates SSIM statistics using filter and precision of the backend.
+    :param img: image, channels (if any) on the last axis
+    :param win_size: size of the uniform window
+    :param multichannel: True for images with channels
+    :param backend: one of SSIM_BACKENDS
+    :return: SSIMStatistics
+    """
+    filter_backend, float_type = _BACKEND_SETTINGS[backend]
+    return SSIMStatistics(img, win_size, multichannel, filter_backend, float_type)
+
+
+@timed(STAGE_SSIM)
+def structural_similarity_channels(image1: np.ndarray, image2: np.ndarray, data_range,
+                                   win_size: int = DEFAULT_WIN_SIZE, backend: str = SSIM_BACKEND_SCIKIT) -> list:
+    """
+    Calculates SSIM of every channel of two images with channels on the last axis in one vectorized pass.
+    With scikit backend scores are bit-identical to calling skimage structural_similarity on every channel,
+    8 and 16 bits images are compared band by band without the SSIM map (see
+    banded_channels_structural_similarity). OpenCV backends filter interleaved channels with cv2.boxFilter.
+    :return: list of mean SSIM of every channel
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    if backend == SSIM_BACKEND_SCIKIT and supports_banded_structural_similarity(image1.dtype) \
+            and image1.dtype == image2.dtype:
+        return banded_channels_structural_similarity(image1, image2, data_range, win_size)
+    scores, _ = channels_structural_similarity_from_statistics(
+        create_ssim_statistics(image1, win_size, multichannel=True, backend=backend),
+        create_ssim_statistics(image2, win_size, multichannel=True, backend=backend),
+        data_range)
+    return scores
+
+
+@timed(STAGE_SSIM)
+def structural_similarity(im1: np.ndarray, im2: np.ndarray, win_size=None, data_range=None, channel_axis=None,
+                          full=False, backend=None):
+    """
+    Drop-in replacement of skimage.metrics.structural_similarity (uniform window) with selectable backend.
+    :param im1: first image
+    :param im2: second image
+    :param win_size: size of the uniform window, 7 by default
+    :param data_range: data range of the images, taken from the integer image type when omitted
+    :param channel_axis: axis holding colour channels, None for single channel images
+    :param full: when True, the full SSIM map is returned as well
+    :param backend: one of SSIM_BACKENDS, global backend or scikit when omitted
+    :return: mean SSIM, or tuple of mean SSIM and the SSIM map when full is True
+    """
+    backend = resolve_ssim_backend(backend)
+    if backend == SSIM_BACKEND_SCIKIT:
+        return skimage_structural_similarity(im1, im2, win_size=win_size, data_range=data_range,
+                                             channel_axis=channel_axis, full=full)
+    if im1.shape != im2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    if data_range is None:
+        if not np.issubdtype(im1.dtype, np.integer):
+            raise ValueError("Since image dtype is floating point, you must specify the data_range parameter.")
+        data_range = int(np.iinfo(im1.dtype).max) - int(np.iinfo(im1.dtype).min)
+    win_size = win_size or DEFAULT_WIN_SIZE
+
+    if channel_axis is None:
+        mssim, s = structural_similarity_from_statistics(create_ssim_statistics(im1, win_size, backend=backend),
+                                                         create_ssim_statistics(im2, win_size, backend=backend),
+                                                         data_range)
+    else:
+        im1, im2 = np.moveaxis(im1, channel_axis, -1), np.moveaxis(im2, channel_axis, -1)
+        scores, s = channels_structural_similarity_from_statistics(
+            create_ssim_statistics(im1, win_size, multichannel=True, backend=backend),
+            create_ssim_statistics(im2, win_size, multichannel=True, backend=backend),
+            data_range)
+        mssim = np.array(scores, dtype=s.dtype).mean()
+        s = np.moveaxis(s, -1, channel_axis)
+    return (mssim, s) if full else mssim
+
+
+def channels_statistics(img: np.ndarray, win_size: int = DEFAULT_WIN_SIZE) -> list:
+    """
+    Calculates SSIM statistics for every channel of the image with channels on the last axis.
+    :param img: multichannel image
+    :param win_size: size of the uniform window
+    :return: list of SSIMStatistics
+    """
+    return [SSIMStatistics(img[..., channel], win_size) for channel in range(img.shape[-1])]
+
+
+def multichannel_structural_similarity_from_statistics(stats_1: list, stats_2: list, data_range) -> tuple:
+    """
+    Calculates SSIM of two multichannel images (channels on the last axis) from their per-channel statistics,
+    the same way as structural_similarity with channel_axis does.
+    :param stats_1: per-channel statistics of the first image
+    :param stats_2: per-channel statistics of the second image
+    :param data_range: data range of the images
+    :return: tuple containing mean SSIM across channels and the full SSIM map
+    """
+    if len(stats_1) != len(stats_2):
+        raise ValueError("Input images must have the same dimensions.")
+    float_type = stats_1[0].image.dtype
+    mssim = np.empty(len(stats_1), dtype=float_type)
+    s = np.empty(stats_1[0].shape + (len(stats_1),), dtype=float_type)
+    for channel, (channel_stats_1, channel_stats_2) in enumerate(zip(stats_1, stats_2)):
+        mssim[channel], s[..., channel] = structural_similarity_from_statistics(channel_stats_1, channel_stats_2,
+                                                                                data_range)
+    return mssim.mean(), s
@@ -0,0 +1,179 @@
+import filecmp
+
+import cv2
+import numpy as np
+import imagehash
+from image_comparison.metrics import *
+from image_comparison.image_hash_comparrison import load_image
+from image_comparison.image_source import is_image_path, is_image_buffer
+from image_comparison.tiled_comparison import get_band_rows, iter_row_bands, check_same_size, DIFF_BYTES_PER_PIXEL
+
+
+###########################
+# THIS MODULE CONTAINS PASS/FAIL COMPARISON AGAINST A THRESHOLD.
+# CHEAP CHECKS ARE DONE FIRST AND THE FULL METRIC IS CALCULATED ONLY WHEN THEY CAN NOT DECIDE.
+STAGE_BYTES = "bytes"
+STAGE_PIXELS = "pixels"
+STAGE_HASH = "hash"
+STAGE_DOWNSCALED_MSE = "downscaled_mse"
+STAGE_ABS_DIFF_BUDGET = "abs_diff_budget"
+STAGE_FULL = "full"
+
+# Metrics where higher score means more similar images; for other metrics lower is better
+SIMILARITY_METRICS = {
+    METRIC_HISTOGRAM_GRAYSCALE, METRIC_HISTOGRAM_COLORED, METRIC_SSIM_GRAY, METRIC_SSIM_COLORED,
+    METRIC_SCIKIT_SSIM_GRAYSCALE, METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED, METRIC_SCIKIT_SSIM_COLOURED,
+    METRIC_SCIKIT_SSIM_COLOURED_RESIZED,
+}
+GREYSCALE_METRICS = {
+    METRIC_MSE, METRIC_HISTOGRAM_GRAYSCALE, METRIC_ABS_DIFF_GREYSCALE, METRIC_SSIM_GRAY,
+    METRIC_SCIKIT_SSIM_GRAYSCALE, METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED,
+}
+COLOURED_METRICS = {
+    METRIC_HISTOGRAM_COLORED, METRIC_ABS_DIFF_COLOURED, METRIC_SSIM_COLORED, METRIC_SCIKIT_SSIM_COLOURED,
+    METRIC_SCIKIT_SSIM_COLOURED_RESIZED,
+}
+# Values returned by comparator methods for images with identical pixels
+IDENTICAL_SCORES = {
+    METRIC_MSE: 0.0,
+    METRIC_HISTOGRAM_GRAYSCALE: 1.0,
+    METRIC_HISTOGRAM_COLORED: 1.0,
+    METRIC_ABS_DIFF_GREYSCALE: (0, 0.0),
+    METRIC_ABS_DIFF_COLOURED: (0, 0.0),
+    METRIC_SSIM_GRAY: 1.0,
+    METRIC_SSIM_COLORED: 1.0,
+    METRIC_SCIKIT_SSIM_GRAYSCALE: (1.0, 1.0),
+    METRIC_SCIKIT_SSIM_GRAYSCALE_RESIZED: (1.0, 1.0),
+    METRIC_SCIKIT_SSIM_COLOURED: (1.0, 1.0),
+    METRIC_SCIKIT_SSIM_COLOURED_RESIZED: (1.0, 1.0),
+    METRIC_AVERAGE_HASH: 0,
+    METRIC_PERCEPTUAL_HASH: 0,
+    METRIC_DIFFERENCE_HASH: 0,
+    METRIC_WAVELET_HASH: 0,
+}
+# Downscaled images used for MSE lower bound have at most that many pixels
+DOWNSCALED_MAX_PIXELS = 256 * 256
+
+
+def get_threshold_score(metric, value) -> float:
+    """
+    :return: score compared with the threshold; total difference for absolute difference
+        and similarity for scikit-image metrics, which return tuples.
+    """
+    return value[0] if isinstance(value, tuple) else value
+
+
+def is_passed(metric, score, threshold) -> bool:
+    """
+    :return: True when similarity score is at least the threshold or distance score is at most the threshold
+    """
+    if metric in SIMILARITY_METRICS:
+        return bool(score >= threshold)
+    return bool(score <= threshold)
+
+
+def create_verdict(passed: bool, stage: str, score=None) -> dict:
+    """
+    :param passed: pass/fail verdict
+    :param stage: name of the check which decided the verdict
+    :param score: value of the metric, None when the verdict was decided without calculating it
+    :return: dictionary describing the verdict
+    """
+    return {"passed": passed, "stage": stage, "score": score}
+
+
+def downscaled_mse_lower_bound(image1: np.ndarray, image2: np.ndarray, max_pixels=DOWNSCALED_MAX_PIXELS) -> float:
+    """
+    Calculates lower bound of MSE of two images from their area-downscaled versions.
+    Area downscaling averages pixels, so by Jensen's inequality squared difference of the averages never exceeds
+    the average of the squared differences. Downscaled images are rounded to 8 bits, which is compensated
+    by subtracting 1 from every absolute difference.
+    :return: value which is never greater than MSE of the full images
+    """
+    height, width = image1.shape[:2]
+    factor = max(1.0, np.sqrt(height * width / max_pixels))
+    size = (max(1, int(width / factor)), max(1, int(height / factor)))
+    small1 = cv2.resize(image1, size, interpolation=cv2.INTER_AREA)
+    small2 = cv2.resize(image2, size, interpolation=cv2.INTER_AREA)
+    diff = np.maximum(cv2.absdiff(small1, small2).astype(np.float64) - 1, 0)
+    return float(np.mean(diff ** 2))
+
+
+def abs_diff_exceeds_budget(image1: np.ndarray, image2: np.ndarray, budget) -> tuple:
+    """
+    Accumulates absolute differences band by band and stops as soon as the total exceeds the budget.
+    :return: tuple of (exceeded, total and mean differences or None when stopped early)
+    """
+    check_same_size(image1, image2)
+    band_rows = get_band_rows(image1, DIFF_BYTES_PER_PIXEL, 4 * 1024 * 1024)
+    total_diff = np.uint64(0)
+    for start, stop in iter_row_bands(image1.shape[0], band_rows):
+        total_diff += np.sum(cv2.absdiff(image1[start:stop], image2[start:stop]), dtype=np.uint64)
+        if total_diff > budget:
+            return True, None
+    return False, (total_diff, np.float64(total_diff) / image1.size)
+
+
+def are_sources_identical(image_path_1, image_path_2) -> bool:
+    """
+    :return: True for files with the same content or equal encoded image buffers
+    """
+    if is_image_path(image_path_1) and is_image_path(image_path_2):
+        return filecmp.cmp(image_path_1, image_path_2, shallow=False)
+    if is_image_buffer(image_path_1) and is_image_buffer(image_path_2):
+        return memoryview(image_path_1).cast("B") == memoryview(image_path_2).cast("B")
+    return False
+
+
+def _load_pair(image_path_1, image_path_2, metric) -> tuple:
+    if metric in GREYSCALE_METRICS:
+        return load_image_greyscale(image_path_1), load_image_greyscale(image_path_2)
+    return load_image_colored(image_path_1), load_image_colored(image_path_2)
+
+
+def compare_with_threshold(image_path_1, image_path_2, metric, threshold, hash_fail_distance=None) -> dict:
+    """
+    Decides if two images pass the threshold of the metric, doing as little work as possible:
+        1. byte-identical files (or encoded image buffers) pass,
+        2. optionally, images with perceptual hash distance above hash_fail_distance fail,
+        3. images with identical decoded pixels pass,
+        4. MSE fails when its lower bound from downscaled images exceeds the threshold,
+           absolute difference fails as soon as the accumulated total exceeds the threshold,
+        5. otherwise the metric is calculated by the comparator method.
+    Steps 1, 3 and 4 never change the verdict compared to calculating the metric; step 2 is a heuristic
+    and is disabled by default.
+    :param image_path_1: File path to the first image, or in-memory image (see image_source module)
+    :param image_path_2: File path to the second image, or in-memory image
+    :param metric: metric name (see COMPARATOR_METRICS)
+    :param threshold: minimal similarity for histogram and SSIM metrics, maximal distance for other metrics
+        (for absolute difference it is the total difference)
+    :param hash_fail_distance: perceptual hash distance above which images fail without further checks
+    :return: verdict dictionary (see create_verdict)
+    """
+    check_metrics([metric])
+    if are_sources_identical(image_path_1, image_path_2):
+        return create_verdict(True, STAGE_BYTES, IDENTICAL_SCORES[metric])
+
+    if hash_fail_distance is not None:
+        distance = imagehash.phash(load_image(image_path_1)) - imagehash.phash(load_image(image_path_2))
+        if distance > hash_fail_distance:
+            return create_verdict(False, STAGE_HASH)
+
+    if metric in GREYSCALE_METRICS or metric in COLOURED_METRICS:
+        image1, image2 = _load_pair(image_path_1, image_path_2, metric)
+        if image1.shape == image2.shape and np.array_equal(image1, image2):
+            return create_verdict(True, STAGE_PIXELS, IDENTICAL_SCORES[metric])
+
+        if metric == METRIC_MSE:
+            image1, image2 = resize_to_smaller_image(image1, image2)
+            if downscaled_mse_lower_bound(image1, image2) > threshold:
+                return create_verdict(False, STAGE_DOWNSCALED_MSE)
+
+        if metric in (METRIC_ABS_DIFF_GREYSCALE, METRIC_ABS_DIFF_COLOURED):
+            exceeded, value = abs_diff_exceeds_budget(image1, image2, threshold)
+            if exceeded:
+                return create_verdict(False, STAGE_ABS_DIFF_BUDGET)
+            return create_verdict(is_passed(metric, value[0], threshold), STAGE_FULL, value)
+
+    value = compare_pair(image_path_1, image_path_2, metric)
+    return create_verdict(is_passed(metric, get_threshold_score(metric, value), threshold), STAGE_FULL, value)
@@ -0,0 +1,211 @@
+import cv2
+import numpy as np
+from image_comparison.abstract_image_comparator import AbstractImageComparison
+from image_comparison.opencv_image_comparator import load_image_colored, load_image_greyscale, resize_to_smaller_image
+from image_comparison.scikit_image_comparator import get_channel_axis, get_data_range, convert_image_to_float
+from image_comparison.ssim_statistics import (
+    SSIMStatistics, structural_similarity_from_statistics, get_ssim_float_type, DEFAULT_WIN_SIZE, UINT8_DATA_RANGE,
+)
+
+
+###########################
+# THIS MODULE CONTAINS TILED COMPARISON OF VERY LARGE IMAGES.
+# METRICS ARE CALCULATED ON ROW BANDS, SO FLOAT TEMPORARIES ARE ALLOCATED ONLY FOR ONE BAND
+# AND PEAK MEMORY (ON TOP OF THE DECODED IMAGES) IS CAPPED BY THE CONFIGURED BUDGET.
+DEFAULT_TILE_MAX_BYTES = 256 * 1024 * 1024
+
+# Approximate memory of temporaries allocated per pixel of a band
+DIFF_BYTES_PER_PIXEL = 16
+SSIM_BYTES_PER_PIXEL = 12 * 8
+
+
+def get_band_rows(image: np.ndarray, bytes_per_pixel: int, max_bytes: int, min_rows: int = 1) -> int:
+    """
+    Calculates how many image rows fit into the memory budget.
+    :param image: compared image
+    :param bytes_per_pixel: memory of temporaries allocated per pixel
+    :param max_bytes: memory budget
+    :param min_rows: minimal number of rows of a band
+    :return: number of rows in one band
+    """
+    row_pixels = int(np.prod(image.shape[1:], dtype=np.int64))
+    return max(min_rows, max_bytes // max(1, row_pixels * bytes_per_pixel))
+
+
+def iter_row_bands(height: int, band_rows: int):
+    """
+    :return: generator of (start, stop) row ranges covering the whole image
+    """
+    for start in range(0, height, band_rows):
+        yield start, min(start + band_rows, height)
+
+
+def check_same_size(image1: np.ndarray, image2: np.ndarray):
+    if image1.shape != image2.shape:
+        raise ValueError("Error: Images must be of the same size and type.")
+
+
+def tiled_abs_diff(image1: np.ndarray, image2: np.ndarray, max_bytes=DEFAULT_TILE_MAX_BYTES) -> tuple:
+    """
+    Calculates total and mean absolute differences band by band. Results are exactly the same as abs_diff_images.
+    :return: total and mean differences of the images.
+    """
+    check_same_size(image1, image2)
+    band_rows = get_band_rows(image1, DIFF_BYTES_PER_PIXEL, max_bytes)
+    total_diff = np.uint64(0)
+    for start, stop in iter_row_bands(image1.shape[0], band_rows):
+        total_diff += np.sum(cv2.absdiff(image1[start:stop], image2[start:stop]), dtype=np.uint64)
+    return total_diff, np.float64(total_diff) / image1.size
+
+
+def tiled_mse(image1: np.ndarray, image2: np.ndarray, max_bytes=DEFAULT_TILE_MAX_BYTES) -> float:
+    """
+    Calculates Mean Squared Error of 8 bits images band by band, accumulating squared differences as integers.
+    The integer sum is exact, so the result may differ from the float64 mean only in the last digits.
+    :return: MSE value
+    """
+    check_same_size(image1, image2)
+    band_rows = get_band_rows(image1, DIFF_BYTES_PER_PIXEL, max_bytes)
+    total = 0
+    for start, stop in iter_row_bands(image1.shape[0], band_rows):
+        abs_diff = cv2.absdiff(image1[start:stop], image2[start:stop]).astype(np.uint32)
+        total += int(np.sum(abs_diff * abs_diff, dtype=np.uint64))
+    return total / image1.size
+
+
+def tiled_structural_similarity(image1: np.ndarray, image2: np.ndarray, data_range, win_size=DEFAULT_WIN_SIZE,
+                                to_float=None, max_bytes=DEFAULT_TILE_MAX_BYTES) -> tuple:
+    """
+    Calculates SSIM of single channel images band by band.
+    Every band is extended by half of the window on both sides, so local statistics at band borders
+    are calculated from the same pixels as for the whole image, and only the inner rows are kept.
+    Scores match skimage structural_similarity up to floating point rounding of the filters
+    (below 1e-10 for 8 bits images calculated in float64, below 1e-5 for float32 images).
+    :param image1: first image
+    :param image2: second image
+    :param data_range: data range of the images
+    :param win_size: size of the uniform window
+    :param to_float: optional conversion applied to every band before calculating statistics
+    :param max_bytes: memory budget of the band temporaries
+    :return: tuple containing mean SSIM and mean of the full SSIM map
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    height, width = image1.shape
+    pad = (win_size - 1) // 2
+    band_rows = get_band_rows(image1, SSIM_BYTES_PER_PIXEL, max_bytes, min_rows=win_size)
+    cropped_sum = 0.0
+    full_sum = 0.0
+    for start, stop in iter_row_bands(height, band_rows):
+        extended_stop = min(height, stop + pad)
+        # Short last band is extended further up, so the window always fits into it
+        extended_start = max(0, min(start - pad, extended_stop - win_size))
+        band1 = image1[extended_start:extended_stop]
+        band2 = image2[extended_start:extended_stop]
+        if to_float is not None:
+            band1, band2 = to_float(band1), to_float(band2)
+        _, s = structural_similarity_from_statistics(SSIMStatistics(band1, win_size), SSIMStatistics(band2, win_size),
+                                                     data_range)
+        s = s[start - extended_start:stop - extended_start]
+        full_sum += np.sum(s, dtype=np.float64)
+        first_row, last_row = max(start, pad) - start, min(stop, height - pad) - start
+        if first_row < last_row:
+            cropped_sum += np.sum(s[first_row:last_row, pad:width - pad], dtype=np.float64)
+    mssim = cropped_sum / ((height - 2 * pad) * (width - 2 * pad))
+    return mssim, full_sum / (height * width)
+
+
+def tiled_multichannel_structural_similarity(image1: np.ndarray, image2: np.ndarray, data_range,
+                                             win_size=DEFAULT_WIN_SIZE, to_float=None,
+                                             max_bytes=DEFAULT_TILE_MAX_BYTES) -> tuple:
+    """
+    Calculates SSIM of images with channels on the last axis band by band (see tiled_structural_similarity).
+    :return: tuple containing mean SSIM across channels and mean of the full SSIM map
+    """
+    if image1.shape != image2.shape:
+        raise ValueError("Input images must have the same dimensions.")
+    float_type = get_ssim_float_type(image1.dtype if to_float is None else to_float(image1[:1, :1]).dtype)
+    results = [tiled_structural_similarity(image1[..., channel], image2[..., channel], data_range, win_size,
+                                           to_float, max_bytes) for channel in range(image1.shape[-1])]
+    mssim = np.array([result[0] for result in results], dtype=float_type).mean()
+    return mssim, np.mean([result[1] for result in results])
+
+
+class TiledImageComparator(AbstractImageComparison):
+    """
+    Comparator for very large images. Methods return the same values as the corresponding methods
+    of OpenCVImageComparator and SciKitImageComparator (SSIM up to floating point rounding, see
+    tiled_structural_similarity), but float temporaries are allocated for one row band at a time,
+    so peak memory is capped by max_bytes instead of growing with the image size.
+    """
+    def __init__(self, image_path_1, image_path_2, max_bytes=DEFAULT_TILE_MAX_BYTES):
+        super().__init__(image_path_1, image_path_2)
+        self.max_bytes = max_bytes
+
+    def compare_images_mse(self) -> float:
+        """
+        Calculate the Mean Squared Error (MSE) between two grayscale images resized to the smaller one.
+        :return: MSE value representing the similarity between the images. Lower values mean more similar.
+        """
+        image1, image2 = resize_to_smaller_image(load_image_greyscale(self.image_path_1),
+                                                 load_image_greyscale(self.image_path_2))
+        return tiled_mse(image1, image2, self.max_bytes)
+
+    def absolute_difference_greyscale(self) -> tuple:
+        """
+        :return: total and mean absolute differences of the grayscale images.
+        """
+        return tiled_abs_diff(load_image_greyscale(self.image_path_1), load_image_greyscale(self.image_path_2),
+                              self.max_bytes)
+
+    def absolute_difference_coloured(self) -> tuple:
+        """
+        :return: total and mean absolute differences of the coloured images.
+        """
+        return tiled_abs_diff(load_image_colored(self.image_path_1), load_image_colored(self.image_path_2),
+                              self.max_bytes)
+
+    def compare_images_ssim_gray(self):
+        """
+        :return: SSIM score of the grayscale images
+        """
+        score, _ = tiled_structural_similarity(load_image_greyscale(self.image_path_1),
+                                               load_image_greyscale(self.image_path_2), UINT8_DATA_RANGE,
+                                               max_bytes=self.max_bytes)
+        return score
+
+    def compare_images_ssim_colored(self):
+        """
+        :return: SSIM score averaged across colour channels
+        """
+        image1 = load_image_colored(self.image_path_1)
+        image2 = load_image_colored(self.image_path_2)
+        if image1.shape != image2.shape:
+            raise ValueError("Input images must have the same dimensions.")
+        score_b, score_g, score_r = [tiled_structural_similarity(image1[..., channel], image2[..., channel],
+                                                                 UINT8_DATA_RANGE, max_bytes=self.max_bytes)[0]
+                                     for channel in range(3)]
+        return (score_r + score_g + score_b) / 3
+
+    def compare_grayscale_images_ssim(self) -> tuple:
+        """
+        :return: tuple containing similarity and mean difference of the grayscale images.
+        """
+        return tiled_structural_similarity(load_image_greyscale(self.image_path_1),
+                                           load_image_greyscale(self.image_path_2), UINT8_DATA_RANGE,
+                                           max_bytes=self.max_bytes)
+
+    def compare_coloured_images_ssim(self) -> tuple:
+        """
+        :return: tuple containing similarity and mean difference of the coloured images,
+        calculated the same way as SciKitImageComparator.compare_coloured_images_ssim.
+        """
+        img1 = load_image_colored(self.image_path_1)
+        img2 = load_image_colored(self.image_path_2)
+        if get_channel_axis(img1) != get_channel_axis(img2):
+            raise ValueError("The two images have different channel axes, cannot compare")
+        data_range = get_data_range(img1)
+        if data_range != get_data_range(img2):
+            raise ValueError("Data ranges of the images are different")
+        return tiled_multichannel_structural_similarity(img1, img2, data_range, win_size=3,
+                                                        to_float=convert_image_to_float, max_bytes=self.max_bytes)
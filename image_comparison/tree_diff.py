@@ -0,0 +1,172 @@
+import hashlib
+import os
+from itertools import islice
+
+import cv2
+from image_comparison import instrumentation
+from image_comparison.abstract_image_comparator import check_image_loaded
+from image_comparison.batch_comparison import (
+    walk_directory_pairs, run_chunks_in_pool, IMAGE_EXTENSIONS, DEFAULT_CHUNK_SIZE,
+)
+from image_comparison.feature_store import get_file_digest, load_image_feature
+from image_comparison.instrumentation import STAGE_DECODE
+from image_comparison.metrics import check_metrics, compare_pair, METRIC_SSIM_GRAY
+from image_comparison.threshold_comparison import get_threshold_score, is_passed
+
+
+###########################
+# THIS MODULE CONTAINS DIFFING OF TWO DIRECTORY TREES, E.G. BASELINE AND CURRENT SCREENSHOTS.
+# FILES ARE MATCHED BY RELATIVE PATH AND CHECKED IN TIERS, EACH ONLY WHEN THE CHEAPER ONE CAN NOT DECIDE:
+#   1. FILES OF THE SAME SIZE WITH THE SAME CONTENT DIGEST ARE IDENTICAL (NOTHING IS DECODED),
+#   2. FILES WITH THE SAME RAW PIXEL DIGEST ARE IDENTICAL, E.G. A PNG RE-ENCODED WITH OTHER COMPRESSION,
+#   3. OTHER FILES ARE CHANGED AND THEIR METRICS ARE CALCULATED.
+# Pixel digests are kept in the feature store when it is enabled, so an unchanged baseline is not decoded
+# again by later runs. Content digests are memoized only within the process, so files are still read and hashed
+# once per run to find their feature store entries.
+STATUS_IDENTICAL = "identical"
+STATUS_CHANGED = "changed"
+STATUS_MISSING = "missing"
+STATUS_ADDED = "added"
+STATUS_ERROR = "error"
+TREE_STATUSES = (STATUS_IDENTICAL, STATUS_CHANGED, STATUS_MISSING, STATUS_ADDED, STATUS_ERROR)
+
+TIER_DIGEST = "digest"
+TIER_PIXELS = "pixels"
+TIER_METRICS = "metrics"
+
+DEFAULT_TREE_METRICS = (METRIC_SSIM_GRAY,)
+
+
+def calculate_pixel_digest(image_path) -> str:
+    """
+    Decodes the image as stored (cv2.IMREAD_UNCHANGED keeps alpha channel and 16 bits depth)
+    and calculates BLAKE2b digest of its shape, dtype and pixels. EXIF orientation is not applied.
+    :param image_path: path to the image file
+    :return: hexadecimal digest
+    """
+    with instrumentation.stage(STAGE_DECODE, mode="unchanged"):
+        img = check_image_loaded(cv2.imread(image_path, cv2.IMREAD_UNCHANGED), image_path)
+    hasher = hashlib.blake2b(f"{img.shape}{img.dtype.str}".encode(), digest_size=20)
+    hasher.update(memoryview(img).cast("B"))
+    return hasher.hexdigest()
+
+
+def load_pixel_digest(image_path) -> str:
+    """
+    :return: raw pixel digest of the image (see calculate_pixel_digest), kept in the feature store
+    """
+    return str(load_image_feature(image_path, "pixel_digest", {}, lambda: [calculate_pixel_digest(image_path)])[0])
+
+
+def create_file_record(relative_path, status, tier=None, scores=None, passed=None, error=None) -> dict:
+    """
+    :param relative_path: path of the file relative to the roots of the trees
+    :param status: one of TREE_STATUSES
+    :param tier: tier which decided the status of a file present in both trees
+    :param scores: dictionary of metric values of changed files
+    :param passed: whether all thresholds of a changed file passed, None without thresholds
+    :param error: error description for STATUS_ERROR
+    :return: dictionary describing one file of the trees
+    """
+    return {"path": relative_path, "status": status, "tier": tier, "scores": scores or {}, "passed": passed,
+            "error": error}
+
+
+def diff_files(relative_path, image_path_1, image_path_2, metrics=DEFAULT_TREE_METRICS, thresholds=None) -> dict:
+    """
+    Compares one file of the first tree with the file of the same relative path in the second tree.
+    :param relative_path: path of the file relative to the roots of the trees
+    :param image_path_1: path in the first tree, None when missing
+    :param image_path_2: path in the second tree, None when missing
+    :param metrics: metrics calculated for changed files
+    :param thresholds: optional dictionary of metric thresholds deciding if a changed file passes
+    :return: file record (see create_file_record)
+    """
+    if image_path_2 is None:
+        return create_file_record(relative_path, STATUS_MISSING)
+    if image_path_1 is None:
+        return create_file_record(relative_path, STATUS_ADDED)
+    try:
+        if os.path.getsize(image_path_1) == os.path.getsize(image_path_2):
+            digest_1 = get_file_digest(image_path_1)
+            if digest_1 is not None and digest_1 == get_file_digest(image_path_2):
+                return create_file_record(relative_path, STATUS_IDENTICAL, TIER_DIGEST)
+        # Sizes differ or the bytes changed, decoding is needed
+        if load_pixel_digest(image_path_1) == load_pixel_digest(image_path_2):
+            return create_file_record(relative_path, STATUS_IDENTICAL, TIER_PIXELS)
+        scores = {}
+        verdicts = []
+        for metric in metrics:
+            scores[metric] = compare_pair(image_path_1, image_path_2, metric)
+            if thresholds and metric in thresholds:
+                verdicts.append(is_passed(metric, get_threshold_score(metric, scores[metric]), thresholds[metric]))
+        passed = all(verdicts) if verdicts else None
+        return create_file_record(relative_path, STATUS_CHANGED, TIER_METRICS, scores, passed)
+    except Exception as e:
+        return create_file_record(relative_path, STATUS_ERROR, error=f"{type(e).__name__}: {e}")
+
+
+def _diff_chunk(chunk, metrics, thresholds) -> list:
+    return [diff_files(*pair, metrics, thresholds) for pair in chunk]
+
+
+def _crash_record(pair, error) -> dict:
+    return create_file_record(pair[0], STATUS_ERROR, error=error)
+
+
+def diff_trees(dir_1, dir_2, metrics=DEFAULT_TREE_METRICS, thresholds=None, extensions=IMAGE_EXTENSIONS,
+               max_workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Diffs two directory trees file by file (see diff_files). Files are processed in a pool of worker processes,
+    a limited number of chunks at a time, so memory does not grow with the size of the trees. When a worker
+    process dies, its chunks are diffed again (see run_chunks_in_pool) and only the file killing it gets
+    an error record.
+    :param dir_1: root of the first (baseline) tree
+    :param dir_2: root of the second tree
+    :param metrics: metrics calculated for changed files
+    :param thresholds: optional dictionary of metric thresholds
+    :param extensions: lowercase extensions of the compared files
+    :param max_workers: number of worker processes, defaults to number of CPUs; 1 diffs in the calling process
+    :param chunk_size: number of files sent to a worker at once
+    :return: generator of file records in the order of walk_directory_pairs
+    """
+    check_metrics(metrics)
+    pairs = walk_directory_pairs(dir_1, dir_2, extensions)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        for pair in pairs:
+            yield diff_files(*pair, metrics, thresholds)
+        return
+    chunks = iter(lambda: list(islice(pairs, chunk_size)), [])
+    yield from run_chunks_in_pool(_diff_chunk, chunks, (metrics, thresholds), _crash_record, max_workers,
+                                  ordered=True)
+
+
+class TreeDiffSummary:
+    """
+    Aggregates file records of a tree diff: number of files per status and tier, number of changed files
+    failing their thresholds and (when keep_files is True) records of all files which are not identical.
+    Without keep_files the memory does not grow with the number of files.
+    """
+    def __init__(self, keep_files=True):
+        self.counts = dict.fromkeys(TREE_STATUSES, 0)
+        self.identical_tiers = dict.fromkeys((TIER_DIGEST, TIER_PIXELS), 0)
+        self.failed = 0
+        self.files = {status: [] for status in TREE_STATUSES if status != STATUS_IDENTICAL} if keep_files else None
+
+    def add(self, record: dict):
+        status = record["status"]
+        self.counts[status] += 1
+        if status == STATUS_IDENTICAL:
+            self.identical_tiers[record["tier"]] += 1
+            return
+        if status == STATUS_CHANGED and record["passed"] is False:
+            self.failed += 1
+        if self.files is not None:
+            self.files[status].append(record)
+
+    def to_dict(self) -> dict:
+        result = {"counts": dict(self.counts), "identical_tiers": dict(self.identical_tiers), "failed": self.failed}
+        if self.files is not None:
+            result["files"] = {status: list(records) for status, records in self.files.items()}
+        return result
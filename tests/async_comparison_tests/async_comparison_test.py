@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison import async_comparison
+from image_comparison.async_comparison import AsyncImageComparator, ComparisonQueueFullError
+from image_comparison.image_cache import get_image_cache, MODE_COLOURED
+from image_comparison.metrics import COMPARATOR_METRICS, compare_pair
+
+
+class TestAsyncComparison(BaseTest):
+
+    def test_async_results_match_comparators(self, get_different_image_paths):
+        img1, img2 = get_different_image_paths
+        get_image_cache().clear()
+
+        async def compare_all():
+            async with AsyncImageComparator(max_workers=2) as comparator:
+                return await comparator.compare_many([(img1, img2, metric) for metric in COMPARATOR_METRICS])
+
+        results = [str(result) if isinstance(result, Exception) else result for result in asyncio.run(compare_all())]
+        assert results == [self.compare_pair_or_error(img1, img2, metric) for metric in COMPARATOR_METRICS]
+
+    @staticmethod
+    def compare_pair_or_error(image_path_1, image_path_2, metric):
+        try:
+            return compare_pair(image_path_1, image_path_2, metric)
+        except ValueError as e:
+            return str(e)
+
+    def test_async_errors(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+
+        async def compare():
+            async with AsyncImageComparator(max_workers=1) as comparator:
+                return await comparator.compare_many([(img1, img2, "ssim_gray"), (img1, img2, "unknown"),
+                                                      (img1, img1 + ".missing", "mse")])
+
+        size_error, metric_error, missing_error = asyncio.run(compare())
+        assert str(size_error) == "Input images must have the same dimensions."
+        assert str(metric_error) == "Unknown metrics: ['unknown']"
+        assert isinstance(missing_error, FileNotFoundError)
+
+    def test_read_uncached_image_does_not_count_cache_hits(self, get_identical_image_path):
+        img1, _ = get_identical_image_path
+        cache = get_image_cache()
+        cache.clear()
+        assert async_comparison.read_uncached_image(img1, MODE_COLOURED) is not None
+        async_comparison.load_image_from_bytes(img1, MODE_COLOURED, None)
+        hits, misses = cache.hits, cache.misses
+        assert async_comparison.read_uncached_image(img1, MODE_COLOURED) is None
+        assert (cache.hits, cache.misses) == (hits, misses)
+
+    def test_async_in_memory_images(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        with open(img1, "rb") as image_file:
+            buffer = image_file.read()
+        assert async_comparison.read_uncached_image(buffer, MODE_COLOURED) is None
+
+        async def compare():
+            async with AsyncImageComparator(max_workers=1) as comparator:
+                return await comparator.compare(buffer, img2, "mse")
+
+        assert asyncio.run(compare()) == compare_pair(img1, img2, "mse")
+
+    def test_async_backpressure_and_cancellation(self, get_identical_image_path, monkeypatch):
+        img1, img2 = get_identical_image_path
+        started = threading.Event()
+        finish = threading.Event()
+
+        def blocking_compare(*args):
+            started.set()
+            finish.wait(5)
+            return 0
+
+        monkeypatch.setattr(async_comparison, "_decode_and_compare", blocking_compare)
+
+        async def run():
+            async with AsyncImageComparator(max_workers=1, max_queued=1) as comparator:
+                # One computation runs, one waits in the executor, one waits in the event loop
+                tasks = [asyncio.create_task(comparator.compare(img1, img2, "mse")) for _ in range(3)]
+                while comparator.queued < 1:
+                    await asyncio.sleep(0.01)
+                with pytest.raises(ComparisonQueueFullError):
+                    await comparator.compare(img1, img2, "mse")
+                tasks[1].cancel()
+                tasks[2].cancel()
+                await asyncio.sleep(0.01)
+                assert comparator.queued == 0
+                finish.set()
+                assert await tasks[0] == 0
+                for task in tasks[1:]:
+                    with pytest.raises(asyncio.CancelledError):
+                        await task
+                # All slots are free again
+                assert await comparator.compare(img1, img2, "mse") == 0
+
+        asyncio.run(run())
+        assert started.is_set()
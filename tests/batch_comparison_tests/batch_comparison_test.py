@@ -0,0 +1,98 @@
+import json
+import os
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.batch_comparison import run_batch, load_manifest, walk_directory_pairs
+from image_comparison.metrics import compare_pair
+
+
+class KillWorker:
+    """
+    Image path which kills the worker process receiving it.
+    """
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+class TestBatchComparison(BaseTest):
+
+    def test_batch_results_match_pairwise_methods(self, get_identical_image_path,
+                                                  get_same_shape_mages_with_small_change):
+        jobs = [get_identical_image_path + ("mse",),
+                get_same_shape_mages_with_small_change + ("ssim_gray",),
+                get_same_shape_mages_with_small_change + ("perceptual_hash",)]
+        records = list(run_batch(jobs, max_workers=2, chunk_size=1, ordered=True))
+        assert [record["index"] for record in records] == [0, 1, 2]
+        for record, job in zip(records, jobs):
+            assert record["error"] is None
+            assert record["result"] == compare_pair(*job)
+
+    def test_batch_failed_job_does_not_abort_batch(self, get_same_image_scaled, get_identical_image_path):
+        jobs = [get_same_image_scaled + ("ssim_gray",),
+                get_identical_image_path + ("unknown",),
+                get_identical_image_path + ("mse",)]
+        records = sorted(run_batch(jobs, max_workers=2), key=lambda record: record["index"])
+        assert records[0]["error"] == "ValueError: Input images must have the same dimensions."
+        assert records[1]["error"].startswith("ValueError: Unknown metrics")
+        assert records[2]["result"] == 0
+
+    def test_load_jsonl_manifest(self, tmp_path, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        manifest = tmp_path / "manifest.jsonl"
+        manifest.write_text(json.dumps({"image_path_1": img1, "image_path_2": img2, "metric": "mse"}) + "\n")
+        assert list(load_manifest(str(manifest))) == [(img1, img2, "mse")]
+
+    def test_load_csv_manifest(self, tmp_path, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        manifest = tmp_path / "manifest.csv"
+        manifest.write_text(f"image_path_1,image_path_2,metric\n{img1},{img2},ssim_gray\n")
+        records = list(run_batch(load_manifest(str(manifest)), max_workers=1))
+        assert records[0]["result"] == 1
+
+    def test_walk_directory_pairs(self, tmp_path):
+        for tree, names in (("a", ["x.png", "sub/y.JPG", "only_a.png", "notes.txt"]), ("b", ["x.png", "sub/y.JPG"])):
+            for name in names:
+                (tmp_path / tree / name).parent.mkdir(parents=True, exist_ok=True)
+                (tmp_path / tree / name).write_bytes(b"")
+        dir_1, dir_2 = str(tmp_path / "a"), str(tmp_path / "b")
+        pairs = list(walk_directory_pairs(dir_1, dir_2))
+        assert [relative_path for relative_path, _, _ in pairs] == ["only_a.png", "x.png", os.path.join("sub", "y.JPG")]
+        assert pairs[0][2] is None
+        assert pairs[1][1:] == (os.path.join(dir_1, "x.png"), os.path.join(dir_2, "x.png"))
+
+    def test_batch_thresholds_and_skipped_jobs(self, get_identical_image_path, get_same_shape_mages_with_small_change):
+        jobs = [get_identical_image_path + ("mse",),
+                get_same_shape_mages_with_small_change + ("mse",),
+                get_same_shape_mages_with_small_change + ("ssim_gray",)]
+        records = list(run_batch(jobs, max_workers=1, ordered=True, thresholds={"ssim_gray": 0.99}, skip_indexes={0}))
+        assert [record["index"] for record in records] == [1, 2]
+        assert "passed" not in records[0]
+        assert (records[1]["passed"], records[1]["stage"]) == (True, "full")
+
+    def test_ordered_batch_buffers_limited_number_of_chunks(self, get_same_shape_mages_with_small_change):
+        consumed = []
+
+        def jobs():
+            # Slow first job, the other workers complete many fast (failing) jobs meanwhile
+            consumed.append(0)
+            yield get_same_shape_mages_with_small_change + ("ssim_colored",)
+            for index in range(1, 200):
+                consumed.append(index)
+                yield "missing_1.png", "missing_2.png", "mse"
+
+        records = run_batch(jobs(), max_workers=2, chunk_size=1, ordered=True)
+        first = next(records)
+        assert first["index"] == 0 and first["error"] is None
+        # At most max_workers * 2 chunks are calculated or waiting for the first one
+        assert len(consumed) <= 2 * 2 + 1
+        assert [record["index"] for record in records] == list(range(1, 200))
+
+    @pytest.mark.parametrize("ordered", [True, False])
+    def test_killed_worker_does_not_abort_batch(self, get_identical_image_path, ordered):
+        jobs = [get_identical_image_path + ("mse",)] * 12
+        jobs[5] = (KillWorker(), get_identical_image_path[1], "mse")
+        records = sorted(run_batch(jobs, max_workers=2, chunk_size=2, ordered=ordered),
+                         key=lambda record: record["index"])
+        assert [record["index"] for record in records] == list(range(12))
+        assert records[5]["error"].startswith("BrokenProcessPool")
+        assert all(record["result"] == 0 for index, record in enumerate(records) if index != 5)
@@ -0,0 +1,67 @@
+import json
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.benchmark import (
+    write_benchmark_images, run_benchmark, find_regressions, get_public_methods, main, BENCHMARKED_COMPARATORS,
+)
+from image_comparison.feature_store import get_feature_store, set_feature_store
+from image_comparison.pixel_store import get_pixel_store, set_pixel_store
+
+
+class TestBenchmark(BaseTest):
+
+    def test_every_public_method_is_benchmarked(self, tmp_path):
+        cases = write_benchmark_images(tmp_path, sizes=(64,), channels=(1, 4), formats=("png", "jpg"))
+        assert [case["name"] for case in cases] == ["64x64_1ch_png", "64x64_1ch_jpg", "64x64_4ch_png"]
+        results = run_benchmark(cases[:1], repeat=2)
+        methods = {(record["comparator"], record["method"]) for record in results["results"]}
+        assert methods == {(comparator.__name__, method) for comparator in BENCHMARKED_COMPARATORS
+                           for method in get_public_methods(comparator)}
+        assert ("OpenCVImageComparator", "compare_images_mse") in methods
+        for record in results["results"]:
+            assert "error" not in record
+            assert record["min"] <= record["p50"] <= record["p99"] <= record["max"]
+            assert record["peak_memory_bytes"] > 0
+            assert record["megapixels_per_second"] > 0
+
+    def test_stores_are_disabled_during_benchmark(self, tmp_path):
+        cases = write_benchmark_images(tmp_path, sizes=(64,), formats=("png",))
+        set_feature_store(str(tmp_path / "features.sqlite"))
+        set_pixel_store(str(tmp_path / "pixels"))
+        feature_store, pixel_store = get_feature_store(), get_pixel_store()
+        try:
+            run_benchmark(cases, repeat=1, measure_memory=False)
+            assert get_feature_store() is feature_store and get_pixel_store() is pixel_store
+            assert feature_store.stats()["algorithms"] == {}
+            assert pixel_store.stats()["images"] == 0
+            run_benchmark(cases, repeat=1, measure_memory=False, keep_stores=True)
+            assert feature_store.stats()["algorithms"] != {}
+            assert pixel_store.stats()["images"] > 0
+        finally:
+            set_feature_store(None)
+            set_pixel_store(None)
+
+    def test_regressions_against_baseline(self):
+        def results(latency):
+            return {"results": [{"case": "c", "comparator": "OpenCVImageComparator", "method": "m", "p50": latency}]}
+        assert find_regressions(results(1.05), results(1.0), max_regression_percent=10) == []
+        regressions = find_regressions(results(1.2), results(1.0), max_regression_percent=10)
+        assert len(regressions) == 1
+        assert regressions[0]["slowdown_percent"] == pytest.approx(20)
+        # Errors and results missing in the baseline are not compared
+        assert find_regressions({"results": [{"case": "c", "comparator": "OpenCVImageComparator", "method": "m",
+                                              "error": "ValueError"}]}, results(1.0)) == []
+        assert find_regressions(results(2.0), {"results": []}) == []
+
+    def test_command_line_fails_on_regression(self, tmp_path):
+        output = tmp_path / "results.json"
+        arguments = ["--sizes", "64", "--formats", "png", "--repeat", "1", "--no-memory",
+                     "--methods", "compare_images_mse"]
+        assert main(arguments + ["--output", str(output)]) == 0
+        baseline = json.loads(output.read_text())
+        assert [record["method"] for record in baseline["results"]] == ["compare_images_mse"]
+        for record in baseline["results"]:
+            record["p50"] /= 100
+        baseline_path = tmp_path / "baseline.json"
+        baseline_path.write_text(json.dumps(baseline))
+        assert main(arguments + ["--baseline", str(baseline_path)]) == 1
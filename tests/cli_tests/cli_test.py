@@ -0,0 +1,107 @@
+import json
+import shutil
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.cli import main, parse_thresholds, load_completed_indexes
+from image_comparison.metrics import compare_pair
+
+
+def create_trees(tmp_path):
+    dir_1, dir_2 = tmp_path / "baseline", tmp_path / "current"
+    (dir_1 / "sub").mkdir(parents=True)
+    (dir_2 / "sub").mkdir(parents=True)
+    shutil.copy(IMAGE_1, dir_1 / "same.jpg")
+    shutil.copy(IMAGE_1, dir_2 / "same.jpg")
+    shutil.copy(IMAGE_3_LARGER, dir_1 / "sub" / "changed.png")
+    shutil.copy(IMAGE_3_LARGER_SMALL_CHANGE, dir_2 / "sub" / "changed.png")
+    shutil.copy(IMAGE_2, dir_2 / "added.jpg")
+    (dir_1 / "notes.txt").write_text("not an image")
+    return str(dir_1), str(dir_2)
+
+
+def read_records(output_path):
+    with open(output_path) as output:
+        return [json.loads(line) for line in output]
+
+
+class TestCommandLine(BaseTest):
+
+    def test_parse_thresholds(self):
+        assert parse_thresholds(["0.9"], ["ssim_gray", "ssim_colored"]) == {"ssim_gray": 0.9, "ssim_colored": 0.9}
+        assert parse_thresholds(["mse=10", "ssim_gray=0.95"], ["ssim_gray"]) == {"mse": 10, "ssim_gray": 0.95}
+        with pytest.raises(ValueError):
+            parse_thresholds(["unknown=1"], ["mse"])
+
+    def test_directory_trees(self, tmp_path):
+        dir_1, dir_2 = create_trees(tmp_path)
+        output_path = str(tmp_path / "results.jsonl")
+        exit_code = main(["--dirs", dir_1, dir_2, "--metric", "mse", "--threshold", "1",
+                          "--workers", "1", "--ordered", "--output", output_path])
+        records = read_records(output_path)
+        assert exit_code == 1
+        assert [record["index"] for record in records] == [0, 1, 2]
+        same, changed, added = records
+        assert (same["passed"], same["result"]) == (True, 0)
+        assert changed["passed"] is False
+        assert added["image_path_1"] is None
+        assert added["error"] == "FileNotFoundError: Image is missing"
+
+    def test_manifest_results_match_pairwise_methods(self, tmp_path, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        manifest = tmp_path / "manifest.csv"
+        manifest.write_text(f"image_path_1,image_path_2,metric\n{img1},{img2},\n{img1},{img2},perceptual_hash\n")
+        output_path = str(tmp_path / "results.jsonl")
+        assert main(["--manifest", str(manifest), "--metric", "ssim_gray", "mse", "--workers", "2",
+                     "--ordered", "--output", output_path]) == 0
+        records = read_records(output_path)
+        assert [record["metric"] for record in records] == ["ssim_gray", "mse", "perceptual_hash"]
+        for record in records:
+            assert record["result"] == compare_pair(img1, img2, record["metric"])
+
+    def test_resume_after_crash(self, tmp_path):
+        dir_1, dir_2 = create_trees(tmp_path)
+        output_path = str(tmp_path / "results.jsonl")
+        arguments = ["--dirs", dir_1, dir_2, "--metric", "mse", "ssim_gray", "--workers", "1", "--ordered",
+                     "--output", output_path]
+        main(arguments)
+        complete = read_records(output_path)
+        # Simulate a crash: two records written, the third one only partially
+        with open(output_path) as output:
+            lines = output.readlines()
+        with open(output_path, "w") as output:
+            output.writelines(lines[:2] + [lines[2][:20]])
+        assert load_completed_indexes(output_path) == {0, 1}
+        main(arguments + ["--resume"])
+        assert read_records(output_path) == complete
+
+    def test_resume_after_crash_before_newline(self, tmp_path):
+        dir_1, dir_2 = create_trees(tmp_path)
+        output_path = str(tmp_path / "results.jsonl")
+        arguments = ["--dirs", dir_1, dir_2, "--metric", "mse", "--workers", "1", "--ordered", "--output", output_path]
+        main(arguments)
+        complete = read_records(output_path)
+        # The last record is valid JSON, but its newline was not written
+        with open(output_path) as output:
+            lines = output.readlines()
+        with open(output_path, "w") as output:
+            output.writelines(lines[:1] + [lines[1].rstrip("\n")])
+        assert load_completed_indexes(output_path) == {0}
+        main(arguments + ["--resume"])
+        assert read_records(output_path) == complete
+
+    def test_resume_keeps_failures_of_interrupted_run(self, tmp_path, capsys):
+        dir_1, dir_2 = create_trees(tmp_path)
+        os.remove(os.path.join(dir_2, "added.jpg"))
+        output_path = str(tmp_path / "results.jsonl")
+        arguments = ["--dirs", dir_1, dir_2, "--metric", "mse", "--threshold", "1", "--workers", "1",
+                     "--output", output_path]
+        assert main(arguments) == 1
+        # All records were written before the crash, the failed pair is only in the output file
+        assert main(arguments + ["--resume"]) == 1
+        summary = json.loads(capsys.readouterr().err.strip().splitlines()[-1])
+        assert summary == {"compared": 0, "skipped": 2, "failed": 1, "errors": 0}
+
+    def test_resume_needs_output(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main(["--dirs", str(tmp_path), str(tmp_path), "--resume"])
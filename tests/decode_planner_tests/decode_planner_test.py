@@ -0,0 +1,75 @@
+import asyncio
+import cv2
+import imagehash
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.async_comparison import AsyncImageComparator
+from image_comparison.decode_planner import (
+    plan_decode_scale, decode_reduced_pil, load_reduced_image, set_reduced_decoding,
+    get_reduced_decoding,
+)
+from image_comparison.image_hash_comparrison import (
+    ImageHashComparison, HASH_METHODS, HASH_MIN_DECODED_SIDES, REDUCED_DECODE_MAX_HASH_DISTANCE, load_image,
+)
+
+
+@pytest.fixture()
+def get_large_jpeg_paths(tmp_path):
+    paths = []
+    for index, image_path in enumerate((IMAGE_2, IMAGE_3_LARGER)):
+        img = cv2.resize(cv2.imread(image_path), (3000, 2000), interpolation=cv2.INTER_CUBIC)
+        path = str(tmp_path / f"large_{index}.jpg")
+        cv2.imwrite(path, img)
+        paths.append(path)
+    return tuple(paths)
+
+
+@pytest.fixture()
+def reduced_decoding_enabled():
+    set_reduced_decoding(True)
+    yield
+    set_reduced_decoding(False)
+
+
+class TestDecodePlanner(BaseTest):
+
+    def test_plan_decode_scale(self):
+        assert plan_decode_scale((4000, 3000), 128) == 8
+        assert plan_decode_scale((4000, 3000), 512) == 4
+        assert plan_decode_scale((4000, 3000), 3000) == 1
+        # Sides are rounded up by the codecs
+        assert plan_decode_scale((1000, 1025), 129) == 4
+        assert plan_decode_scale((100, 100), 128) == 1
+
+    def test_reduced_decode_sizes(self, get_large_jpeg_paths):
+        image_path = get_large_jpeg_paths[0]
+        assert decode_reduced_pil(image_path, 128).size == (375, 250)
+        assert decode_reduced_pil(image_path, 512).size == (1500, 1000)
+        assert decode_reduced_pil(image_path, 500).size == (750, 500)
+        assert decode_reduced_pil(image_path, 4000).size == (3000, 2000)
+        assert load_reduced_image(image_path, 128) is load_reduced_image(image_path, 128)
+
+    def test_png_is_decoded_in_full(self):
+        assert decode_reduced_pil(IMAGE_3_LARGER, 128).size == (1761, 1479)
+
+    def test_reduced_hashes_within_bound(self, get_large_jpeg_paths):
+        for image_path in get_large_jpeg_paths + (IMAGE_1, IMAGE_2):
+            for metric, hash_method in HASH_METHODS.items():
+                full = hash_method(load_image(image_path))
+                reduced = hash_method(load_image(image_path, HASH_MIN_DECODED_SIDES[metric]))
+                assert full - reduced <= REDUCED_DECODE_MAX_HASH_DISTANCE
+
+    def test_reduced_decoding_is_opt_in(self, get_large_jpeg_paths):
+        assert not get_reduced_decoding()
+        comparator = ImageHashComparison(*get_large_jpeg_paths)
+        full = comparator.compare_images_perceptual_hash()
+        assert full == imagehash.phash(load_image(get_large_jpeg_paths[0])) - \
+               imagehash.phash(load_image(get_large_jpeg_paths[1]))
+        reduced = comparator.compare_images_perceptual_hash(reduced_decode=True)
+        assert abs(full - reduced) <= 2 * REDUCED_DECODE_MAX_HASH_DISTANCE
+
+    def test_async_uses_reduced_decoding(self, get_large_jpeg_paths, reduced_decoding_enabled):
+        async def compare():
+            async with AsyncImageComparator(max_workers=2) as comparator:
+                return await comparator.compare(*get_large_jpeg_paths, "average_hash")
+        assert asyncio.run(compare()) == ImageHashComparison(*get_large_jpeg_paths).compare_images_average_hash()
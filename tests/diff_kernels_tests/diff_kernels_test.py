@@ -0,0 +1,99 @@
+import math
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.diff_kernels import diff_statistics, abs_diff_statistics, psnr_from_mse
+from image_comparison.opencv_image_comparator import (
+    OpenCVImageComparator, load_image_colored, load_image_greyscale, abs_diff_images,
+)
+
+# Small bands split test images into many bands
+SMALL_BAND_BYTES = 4096
+
+
+def numpy_statistics(image1, image2) -> tuple:
+    abs_diff = cv2.absdiff(image1, image2)
+    return np.sum(abs_diff), np.mean(abs_diff), float(np.mean(abs_diff.astype("float") ** 2)), int(abs_diff.max())
+
+
+class TestDiffKernels(BaseTest):
+
+    @pytest.mark.parametrize("shape", [(1, 1), (37, 53), (64, 48, 3), (29, 31, 4), (5, 7, 7)])
+    @pytest.mark.parametrize("band_bytes", [1, SMALL_BAND_BYTES, 1 << 30])
+    def test_statistics_equal_numpy_formulas(self, shape, band_bytes):
+        rng = np.random.default_rng(sum(shape) + band_bytes)
+        image1 = rng.integers(0, 256, shape, dtype=np.uint8)
+        image2 = rng.integers(0, 256, shape, dtype=np.uint8)
+        total, mean, mse, max_diff = numpy_statistics(image1, image2)
+        statistics = diff_statistics(image1, image2, band_bytes)
+        assert (statistics["sum"], statistics["mean"], statistics["mse"], statistics["max_diff"]) == \
+            (total, mean, mse, max_diff)
+        assert statistics["sum"].dtype == total.dtype and type(statistics["mse"]) is float
+        assert abs_diff_statistics(cv2.absdiff(image1, image2), band_bytes) == statistics
+
+    def test_maximal_differences(self):
+        image1 = np.zeros((300, 400, 3), dtype=np.uint8)
+        image2 = np.full_like(image1, 255)
+        statistics = diff_statistics(image1, image2, SMALL_BAND_BYTES)
+        assert statistics["sum"] == image1.size * 255
+        assert statistics["mse"] == 255 * 255
+        assert statistics["max_diff"] == 255
+        assert statistics["psnr"] == 0
+
+    def test_non_contiguous_images(self):
+        rng = np.random.default_rng(3)
+        image1 = rng.integers(0, 256, (80, 90, 3), dtype=np.uint8)[::2, 5:70]
+        image2 = rng.integers(0, 256, (40, 65, 3), dtype=np.uint8)
+        total, mean, mse, max_diff = numpy_statistics(image1, image2)
+        statistics = diff_statistics(image1, image2, SMALL_BAND_BYTES)
+        assert (statistics["sum"], statistics["mean"], statistics["mse"], statistics["max_diff"]) == \
+            (total, mean, mse, max_diff)
+
+    def test_float_images_use_numpy_formulas(self):
+        rng = np.random.default_rng(5)
+        image1 = rng.random((20, 30), dtype=np.float32)
+        image2 = rng.random((20, 30), dtype=np.float32)
+        total, mean, mse, _ = numpy_statistics(image1, image2)
+        statistics = diff_statistics(image1, image2)
+        assert (statistics["sum"], statistics["mean"], statistics["mse"]) == (total, mean, mse)
+        assert statistics["psnr"] == psnr_from_mse(mse, 1.0)
+
+    def test_identical_images_psnr(self, get_identical_image_path):
+        img = load_image_colored(get_identical_image_path[0])
+        statistics = diff_statistics(img, img)
+        assert statistics["sum"] == 0 and statistics["mse"] == 0 and statistics["max_diff"] == 0
+        assert statistics["psnr"] == math.inf
+
+    def test_different_shapes_raise(self):
+        with pytest.raises(ValueError):
+            diff_statistics(np.zeros((2, 3), dtype=np.uint8), np.zeros((3, 2), dtype=np.uint8))
+        with pytest.raises(ValueError):
+            diff_statistics(np.zeros((2, 3), dtype=np.uint8), np.zeros((2, 3), dtype=np.uint16))
+
+    def test_comparator_results_unchanged(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        comparator = OpenCVImageComparator(img1, img2)
+        greyscale_1, greyscale_2 = load_image_greyscale(img1), load_image_greyscale(img2)
+        coloured_1, coloured_2 = load_image_colored(img1), load_image_colored(img2)
+        assert comparator.compare_images_mse() == numpy_statistics(greyscale_1, greyscale_2)[2]
+        assert comparator.absolute_difference_greyscale() == numpy_statistics(greyscale_1, greyscale_2)[:2]
+        assert comparator.absolute_difference_coloured() == numpy_statistics(coloured_1, coloured_2)[:2]
+        assert abs_diff_images(coloured_1, coloured_2) == numpy_statistics(coloured_1, coloured_2)[:2]
+
+    def test_no_image_sized_allocations(self):
+        rng = np.random.default_rng(7)
+        image1 = rng.integers(0, 256, (1000, 1000, 3), dtype=np.uint8)
+        image2 = rng.integers(0, 256, (1000, 1000, 3), dtype=np.uint8)
+        diff_statistics(image1, image2)
+        tracemalloc.start()
+        try:
+            diff_statistics(image1, image2)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # Scratch buffers of the first call are reused, far less than the 3 MB difference image
+        assert peak < image1.nbytes // 10
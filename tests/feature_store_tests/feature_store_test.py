@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.batch_comparison import run_batch
+from image_comparison.benchmark import get_public_methods
+from image_comparison.feature_store import FeatureStore, set_feature_store, encode_feature, decode_feature
+from image_comparison.image_cache import get_image_cache
+from image_comparison.image_hash_comparrison import ImageHashComparison
+from image_comparison.instrumentation import InMemorySink, sink_installed, EVENT_TIMER, STAGE_DECODE
+from image_comparison.metrics import compare_pair
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.scikit_image_comparator import SciKitImageComparator
+
+STORED_METHODS = {
+    OpenCVImageComparator: ["compare_images_mse", "compare_images_histograms_correlation_grayscale",
+                            "compare_images_histograms_correlation_colored", "absolute_difference_greyscale",
+                            "absolute_difference_coloured", "compare_images_ssim_gray", "compare_images_ssim_colored"],
+    SciKitImageComparator: get_public_methods(SciKitImageComparator),
+    ImageHashComparison: get_public_methods(ImageHashComparison),
+}
+
+
+@pytest.fixture()
+def feature_store(tmp_path):
+    store = FeatureStore(tmp_path / "features.db")
+    set_feature_store(store)
+    yield store
+    set_feature_store(None)
+    store.close()
+
+
+def compare_all_methods(image_path_1, image_path_2) -> dict:
+    results = {}
+    for comparator_class, methods in STORED_METHODS.items():
+        for method in methods:
+            results[method] = getattr(comparator_class(image_path_1, image_path_2), method)()
+    return results
+
+
+def count_decodes(sink) -> int:
+    return sum(record["count"] for record in sink.snapshot()
+               if (record["kind"], record["name"]) == (EVENT_TIMER, STAGE_DECODE))
+
+
+class TestFeatureStore(BaseTest):
+
+    def test_encode_feature_keeps_types(self):
+        parts = decode_feature(encode_feature([np.uint64(5), np.float64(0.5), 0.25, 3, np.arange(4, dtype=np.float32)]))
+        assert [type(part) for part in parts[:4]] == [np.uint64, np.float64, float, int]
+        assert parts[:4] == [5, 0.5, 0.25, 3]
+        assert parts[4].dtype == np.float32 and parts[4].tolist() == [0, 1, 2, 3]
+
+    def test_unchanged_pair_is_not_decoded_again(self, feature_store, get_same_shape_mages_with_small_change):
+        expected = compare_all_methods(*get_same_shape_mages_with_small_change)
+        set_feature_store(None)
+        assert compare_all_methods(*get_same_shape_mages_with_small_change) == expected
+        set_feature_store(feature_store)
+        get_image_cache().clear()
+        with sink_installed(InMemorySink()) as sink:
+            results = compare_all_methods(*get_same_shape_mages_with_small_change)
+        assert count_decodes(sink) == 0
+        assert results == expected
+        assert {type(value) for value in results.values()} == {type(value) for value in expected.values()}
+
+    def test_only_changed_image_is_decoded(self, feature_store, tmp_path, get_same_image_scaled):
+        image_path_1, image_path_2 = get_same_image_scaled
+        copy = str(tmp_path / "copy.png")
+        shutil.copy(image_path_2, copy)
+        OpenCVImageComparator(image_path_1, copy).compare_images_histograms_correlation_colored()
+        ImageHashComparison(image_path_1, copy).compare_images_perceptual_hash()
+        # Same content under another path is found by its digest
+        get_image_cache().clear()
+        with sink_installed(InMemorySink()) as sink:
+            stored = OpenCVImageComparator(image_path_1, image_path_2).compare_images_histograms_correlation_colored()
+        assert count_decodes(sink) == 0
+        set_feature_store(None)
+        comparator = OpenCVImageComparator(image_path_1, image_path_2)
+        assert stored == comparator.compare_images_histograms_correlation_colored()
+        set_feature_store(feature_store)
+
+        cv2.imwrite(copy, cv2.imread(IMAGE_3_LARGER_SMALL_CHANGE))
+        get_image_cache().clear()
+        with sink_installed(InMemorySink()) as sink:
+            changed = OpenCVImageComparator(image_path_1, copy).compare_images_histograms_correlation_colored()
+            ImageHashComparison(image_path_1, copy).compare_images_perceptual_hash()
+        # Only the changed image is decoded, in coloured mode for the histograms and by PIL for the hash
+        assert count_decodes(sink) == 2
+        set_feature_store(None)
+        assert changed == OpenCVImageComparator(image_path_1, copy).compare_images_histograms_correlation_colored()
+
+    def test_size_based_eviction(self, tmp_path):
+        store = FeatureStore(tmp_path / "small.db", max_bytes=64 * 1024)
+        blob = bytes(1024)
+        for index in range(200):
+            store.put(f"key{index}", "test", blob)
+        store.evict()
+        assert store.current_bytes <= 64 * 1024
+        # Least recently used values are evicted first
+        assert store.get("key199") == blob
+        assert store.get("key0") is None
+        assert store.stats()["algorithms"]["test"] == len(store)
+
+    def test_concurrent_readers_and_writers(self, feature_store, get_same_image_scaled,
+                                            get_same_shape_mages_with_small_change):
+        jobs = [pair + (metric,) for pair in (get_same_image_scaled, get_same_shape_mages_with_small_change)
+                for metric in ("mse", "histogram_correlation_colored", "perceptual_hash")] * 2
+        with ThreadPoolExecutor(4) as executor:
+            threaded = list(executor.map(lambda job: compare_pair(*job), jobs))
+        records = sorted(run_batch(jobs, max_workers=2, chunk_size=1), key=lambda record: record["index"])
+        set_feature_store(None)
+        expected = [compare_pair(*job) for job in jobs]
+        assert threaded == expected
+        assert [record["result"] for record in records] == expected
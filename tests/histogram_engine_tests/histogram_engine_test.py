@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.histogram_engine import *
+from image_comparison.opencv_image_comparator import load_image_colored
+
+OPENCV_METHODS = {COMPARE_CORRELATION: cv2.HISTCMP_CORREL, COMPARE_CHI_SQUARE: cv2.HISTCMP_CHISQR,
+                  COMPARE_INTERSECTION: cv2.HISTCMP_INTERSECT, COMPARE_BHATTACHARYYA: cv2.HISTCMP_BHATTACHARYYA}
+GALLERY = [IMAGE_1, IMAGE_2, IMAGE_3, IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE]
+
+
+class TestHistogramEngine(BaseTest):
+
+    @pytest.mark.parametrize("histogram_type", HISTOGRAM_TYPES)
+    def test_histogram_shapes(self, histogram_type):
+        histograms = HistogramGallery(histogram_type, bins=4).calculate(IMAGE_1)
+        expected_shape = {HISTOGRAM_GREYSCALE: (1, 4), HISTOGRAM_CHANNELS: (3, 4)}.get(histogram_type, (1, 64))
+        assert histograms.shape == expected_shape
+        assert histograms.dtype == np.float32
+        assert np.allclose(histograms.sum(axis=1), 1)
+
+    def test_joint_histogram_needs_colour_image(self):
+        with pytest.raises(ValueError):
+            calculate_histograms(np.zeros((4, 4), dtype=np.uint8), HISTOGRAM_JOINT_BGR)
+
+    @pytest.mark.parametrize("histogram_type", HISTOGRAM_TYPES)
+    @pytest.mark.parametrize("method", COMPARE_METHODS)
+    def test_gallery_matches_opencv(self, histogram_type, method):
+        gallery = HistogramGallery(histogram_type)
+        gallery.add(GALLERY)
+        query = gallery.calculate(IMAGE_3)
+        expected = [np.mean([cv2.compareHist(query[row], histograms[row], OPENCV_METHODS[method])
+                             for row in range(query.shape[0])])
+                    for histograms in (gallery.calculate(image_path) for image_path in GALLERY)]
+        assert np.allclose(gallery.compare(IMAGE_3, method), expected, rtol=1e-5, atol=1e-9)
+
+    def test_identical_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        assert compare_image_histograms(img1, img2) == pytest.approx(1)
+        assert compare_image_histograms(img1, img2, COMPARE_CHI_SQUARE) == 0
+        assert compare_image_histograms(img1, img2, COMPARE_INTERSECTION) == pytest.approx(1)
+        assert compare_image_histograms(img1, img2, COMPARE_BHATTACHARYYA) == pytest.approx(0, abs=1e-6)
+
+    def test_scaled_image_is_more_similar_than_different_image(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        for method, higher_is_similar in COMPARE_METHODS.items():
+            scaled = compare_image_histograms(img1, img2, method, HISTOGRAM_JOINT_HSV)
+            different = compare_image_histograms(img1, IMAGE_1, method, HISTOGRAM_JOINT_HSV)
+            assert (scaled > different) == higher_is_similar
+
+    def test_in_memory_images(self):
+        assert np.array_equal(load_histograms(load_image_colored(IMAGE_1)), load_histograms(IMAGE_1))
+
+    def test_block_size_does_not_change_scores(self):
+        gallery = HistogramGallery()
+        gallery.add(GALLERY)
+        for method in COMPARE_METHODS:
+            assert np.array_equal(gallery.compare(IMAGE_1, method, block_bytes=1), gallery.compare(IMAGE_1, method))
+
+    @pytest.mark.parametrize("dtype", [np.float16, np.uint16])
+    def test_compact_storage(self, dtype):
+        exact, compact = HistogramGallery(HISTOGRAM_JOINT_BGR), HistogramGallery(HISTOGRAM_JOINT_BGR, dtype=dtype)
+        exact.add(GALLERY)
+        compact.add(GALLERY)
+        assert compact.values.dtype == dtype
+        assert compact.values.nbytes == exact.values.nbytes // 2
+        for method in (COMPARE_CORRELATION, COMPARE_INTERSECTION, COMPARE_BHATTACHARYYA):
+            assert np.allclose(compact.compare(IMAGE_2, method), exact.compare(IMAGE_2, method), atol=1e-2)
+
+    def test_unsupported_storage_dtype(self):
+        with pytest.raises(ValueError):
+            HistogramGallery(dtype=np.int8)
+
+    def test_best_matches(self):
+        gallery = HistogramGallery(HISTOGRAM_JOINT_HSV)
+        gallery.add(GALLERY)
+        assert gallery.best_matches(IMAGE_3, 1)[0] == (IMAGE_3, pytest.approx(1))
+        assert gallery.best_matches(IMAGE_3, 1, COMPARE_CHI_SQUARE)[0] == (IMAGE_3, 0)
+        matches = gallery.best_matches(IMAGE_3, 10, COMPARE_BHATTACHARYYA)
+        assert matches[0][0] == IMAGE_3
+        assert {path for path, _ in matches[1:3]} == {IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE}
+        assert len(matches) == len(GALLERY)
+
+    def test_unknown_method(self):
+        gallery = HistogramGallery()
+        gallery.add([IMAGE_1])
+        with pytest.raises(ValueError):
+            gallery.compare(IMAGE_1, "earth_movers")
+
+    def test_save_and_open(self, tmp_path):
+        gallery = HistogramGallery(HISTOGRAM_CHANNELS, bins=32, dtype=np.uint16)
+        gallery.add(GALLERY)
+        gallery.save(tmp_path)
+        opened = HistogramGallery.open(tmp_path)
+        assert isinstance(opened.values, np.memmap)
+        assert (opened.histogram_type, opened.bins, opened.dtype) == (HISTOGRAM_CHANNELS, 32, np.uint16)
+        assert opened.paths == GALLERY
+        assert np.array_equal(opened.compare(IMAGE_2), gallery.compare(IMAGE_2))
@@ -0,0 +1,55 @@
+import numpy as np
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.image_cache import ImageCache, get_image_cache
+from image_comparison.opencv_image_comparator import load_image_colored, load_image_greyscale
+
+
+class TestImageCache(BaseTest):
+
+    def test_cache_returns_same_decoded_image(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        cache = get_image_cache()
+        cache.clear()
+        image_1 = load_image_colored(img1)
+        image_2 = load_image_colored(img2)
+        assert image_1 is image_2
+        assert not image_1.flags.writeable
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_cache_separates_colour_modes(self, get_identical_image_path):
+        img1, _ = get_identical_image_path
+        get_image_cache().clear()
+        coloured = load_image_colored(img1)
+        greyscale = load_image_greyscale(img1)
+        assert coloured.ndim == 3
+        assert greyscale.ndim == 2
+        assert get_image_cache().misses == 2
+
+    def test_cache_evicts_least_recently_used_images(self):
+        cache = ImageCache(max_bytes=200)
+        cache.put("a", np.zeros(100, dtype=np.uint8))
+        cache.put("b", np.zeros(100, dtype=np.uint8))
+        cache.get("a")
+        cache.put("c", np.zeros(100, dtype=np.uint8))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.evictions == 1
+        assert cache.current_bytes == 200
+
+    def test_cache_skips_images_larger_than_limit(self):
+        cache = ImageCache(max_bytes=10)
+        cache.put("a", np.zeros(100, dtype=np.uint8))
+        assert len(cache) == 0
+
+    def test_contains_does_not_count_or_reorder(self):
+        cache = ImageCache(max_bytes=200)
+        cache.put("a", np.zeros(100, dtype=np.uint8))
+        cache.put("b", np.zeros(100, dtype=np.uint8))
+        assert "a" in cache
+        assert "c" not in cache
+        assert (cache.hits, cache.misses) == (0, 0)
+        cache.put("c", np.zeros(100, dtype=np.uint8))
+        assert "a" not in cache
+        assert "b" in cache
@@ -0,0 +1,38 @@
+import imagehash
+import numpy as np
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.hash_distance import *
+from image_comparison.image_hash_comparrison import load_image, get_difference
+
+
+class TestImageHashDistance(BaseTest):
+
+    def test_distance_matrix_matches_hash_difference(self):
+        paths = [IMAGE_1, IMAGE_2, IMAGE_3, IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE]
+        hashes = [imagehash.phash(load_image(path)) for path in paths]
+        matrix = hamming_distance_matrix(hashes)
+        for i, hash1 in enumerate(hashes):
+            for j, hash2 in enumerate(hashes):
+                assert matrix[i, j] == get_difference(hash1, hash2)
+
+    def test_distance_matrix_in_blocks(self):
+        rng = np.random.default_rng(1)
+        hashes_1 = rng.integers(0, 2 ** 64, size=300, dtype=np.uint64)
+        hashes_2 = rng.integers(0, 2 ** 64, size=200, dtype=np.uint64)
+        expected = hamming_distance_matrix(hashes_1, hashes_2)
+        assert expected.shape == (300, 200)
+        assert np.array_equal(hamming_distance_matrix(hashes_1, hashes_2, block_bytes=1000), expected)
+
+    def test_nearest_neighbours(self):
+        rng = np.random.default_rng(2)
+        hashes = rng.integers(0, 2 ** 64, size=500, dtype=np.uint64)
+        queries = hashes[:50] ^ np.uint64(1)
+        indices, distances = hamming_nearest_neighbours(queries, hashes, 5, block_bytes=10000)
+        matrix = hamming_distance_matrix(queries, hashes)
+        assert np.array_equal(indices[:, 0], np.arange(50))
+        assert np.all(distances[:, 0] == 1)
+        for row in range(50):
+            expected = sorted(range(500), key=lambda column: (matrix[row, column], column))[:5]
+            assert list(indices[row]) == expected
+            assert list(distances[row]) == list(matrix[row, expected])
@@ -0,0 +1,108 @@
+import imagehash
+import numpy as np
+from PIL import Image
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison import instrumentation
+from image_comparison.feature_store import set_feature_store, COUNTER_STORE_HITS
+from image_comparison.hash_fingerprint import *
+from image_comparison.image_hash_comparrison import ImageHashComparison, load_image
+from image_comparison.instrumentation import InMemorySink, EVENT_COUNTER, EVENT_TIMER, STAGE_COLOUR_CONVERSION
+
+PATHS = [IMAGE_1, IMAGE_2, IMAGE_3, IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE]
+IMAGEHASH_METHODS = {
+    METRIC_AVERAGE_HASH: imagehash.average_hash,
+    METRIC_PERCEPTUAL_HASH: imagehash.phash,
+    METRIC_DIFFERENCE_HASH: imagehash.dhash,
+    METRIC_WAVELET_HASH: imagehash.whash,
+}
+
+
+class TestImageHashFingerprint(BaseTest):
+
+    def test_exact_fingerprints_match_image_hash_comparison(self):
+        engine = FingerprintEngine(pyramid_side_factor=None)
+        for path in PATHS[1:]:
+            comparison = ImageHashComparison(IMAGE_1, path)
+            result = engine.compare(IMAGE_1, path)
+            assert result[METRIC_AVERAGE_HASH] == comparison.compare_images_average_hash()
+            assert result[METRIC_PERCEPTUAL_HASH] == comparison.compare_images_perceptual_hash()
+            assert result[METRIC_DIFFERENCE_HASH] == comparison.compare_images_difference_hash()
+            assert result[METRIC_WAVELET_HASH] == comparison.compare_images_wavelet_hash()
+
+    @pytest.mark.parametrize("hash_size", [DEFAULT_HASH_SIZE, 16])
+    def test_pyramid_fingerprints_close_to_imagehash(self, hash_size):
+        engine = FingerprintEngine(hash_sizes=hash_size)
+        for path in PATHS:
+            fingerprint = engine.fingerprint(path)
+            for metric, hash_method in IMAGEHASH_METHODS.items():
+                distance = engine.unpack_hash(fingerprint, metric) - hash_method(load_image(path), hash_size)
+                assert distance <= get_pyramid_max_hash_distance(hash_size)
+
+    def test_configured_hash_sizes(self):
+        hash_sizes = {METRIC_AVERAGE_HASH: 16, METRIC_PERCEPTUAL_HASH: 12, METRIC_DIFFERENCE_HASH: 5,
+                      METRIC_WAVELET_HASH: 4}
+        engine = FingerprintEngine(hash_sizes=hash_sizes, pyramid_side_factor=None)
+        assert engine.dtype.itemsize == 32 + 18 + 4 + 2
+        fingerprint = engine.fingerprint(IMAGE_1)
+        img = load_image(IMAGE_1)
+        for metric, hash_size in hash_sizes.items():
+            assert engine.unpack_hash(fingerprint, metric) == IMAGEHASH_METHODS[metric](img, hash_size)
+
+    def test_wavelet_hash_with_equal_middle_blocks(self):
+        # Flat blocks make the median ties which imagehash decides by floating point rounding
+        rng = np.random.default_rng(4)
+        for _ in range(50):
+            pixels = (rng.integers(0, 3, (rng.integers(8, 64), rng.integers(8, 64))) * 100).astype(np.uint8)
+            img = Image.fromarray(pixels)
+            for hash_size in (2, 4, 8):
+                engine = FingerprintEngine([METRIC_WAVELET_HASH], hash_size, pyramid_side_factor=None)
+                fingerprint = engine.calculate_fingerprint(img)
+                assert engine.unpack_hash(fingerprint, METRIC_WAVELET_HASH) == imagehash.whash(img, hash_size)
+
+    def test_combined_distance(self):
+        engine = FingerprintEngine()
+        fingerprints = engine.fingerprint_many(PATHS)
+        assert fingerprints.shape == (5,)
+        matrix = engine.combined_distance(fingerprints[:, None], fingerprints[None, :])
+        assert matrix.shape == (5, 5)
+        assert np.all(np.diag(matrix) == 0)
+        assert np.array_equal(matrix, matrix.T)
+        assert np.all((matrix >= 0) & (matrix <= 1))
+        result = engine.compare(IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE)
+        assert result["combined"] == matrix[3, 4]
+        assert result["combined"] < matrix[0, 3]
+        weighted = engine.compare(IMAGE_1, IMAGE_2, {METRIC_PERCEPTUAL_HASH: 1.0})
+        assert weighted["combined"] == weighted[METRIC_PERCEPTUAL_HASH] / 64
+
+    def test_identical_images(self, get_identical_image_path):
+        result = FingerprintEngine().compare(*get_identical_image_path)
+        assert set(result.values()) == {0}
+
+    def test_single_greyscale_conversion(self):
+        with instrumentation.sink_installed(InMemorySink()) as sink:
+            FingerprintEngine().calculate_fingerprint(load_image(IMAGE_1))
+        assert sink.get(EVENT_TIMER, STAGE_COLOUR_CONVERSION, mode="greyscale")["count"] == 1
+
+    def test_fingerprints_are_stored(self, tmp_path):
+        set_feature_store(str(tmp_path / "features.sqlite"))
+        try:
+            engine = FingerprintEngine()
+            expected = engine.fingerprint(IMAGE_3)
+            with instrumentation.sink_installed(InMemorySink()) as sink:
+                fingerprint = engine.fingerprint(IMAGE_3)
+            assert sink.get(EVENT_COUNTER, COUNTER_STORE_HITS)["count"] == 1
+            assert fingerprint.dtype == engine.dtype
+            assert np.array_equal(fingerprint, expected)
+        finally:
+            set_feature_store(None)
+
+    def test_invalid_configuration(self):
+        with pytest.raises(ValueError):
+            FingerprintEngine(["color_hash"])
+        with pytest.raises(ValueError):
+            FingerprintEngine(hash_sizes=1)
+        with pytest.raises(ValueError):
+            FingerprintEngine(hash_sizes={METRIC_WAVELET_HASH: 6})
+        with pytest.raises(ValueError):
+            FingerprintEngine(wavelet_image_scale=4)
@@ -0,0 +1,34 @@
+import numpy as np
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.hash_index import HashIndex, HASH_DTYPE
+from image_comparison.image_hash_comparrison import ImageHashComparison
+
+
+class TestImageHashIndex(BaseTest):
+
+    def test_hash_index_search_matches_pairwise_difference(self, tmp_path):
+        paths = [IMAGE_1, IMAGE_2, IMAGE_3, IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE]
+        index = HashIndex(str(tmp_path))
+        index.add(paths)
+        index.save()
+
+        reopened = HashIndex(str(tmp_path))
+        assert len(reopened) == 5
+        assert isinstance(reopened.hashes, np.memmap)
+        found = dict(reopened.search(IMAGE_3, 2, "perceptual_hash"))
+        assert found == {IMAGE_3: 0, IMAGE_3_LARGER: 2, IMAGE_3_LARGER_SMALL_CHANGE: 2}
+        for path, distance in reopened.search(IMAGE_1, 64, "average_hash"):
+            assert distance == ImageHashComparison(IMAGE_1, path).compare_images_average_hash()
+
+    def test_hash_index_search_matches_linear_scan(self):
+        rng = np.random.default_rng(0)
+        index = HashIndex("unused")
+        index.hashes = np.zeros(2000, dtype=HASH_DTYPE)
+        index.hashes["perceptual_hash"] = rng.integers(0, 2 ** 64, size=2000, dtype=np.uint64)
+        index.paths = [str(i) for i in range(2000)]
+        query = index.hashes["perceptual_hash"][7] ^ np.uint64(0b1011)
+        for max_distance in (0, 3, 8, 20, 30):
+            distances = np.bitwise_count(index.hashes["perceptual_hash"] ^ query)
+            expected = {str(i) for i in np.nonzero(distances <= max_distance)[0]}
+            assert {path for path, _ in index.search_hash(query, max_distance)} == expected
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.metrics import COMPARATOR_METRICS, compare_pair
+from image_comparison.opencv_image_comparator import OpenCVImageComparator, load_image_colored, load_image_greyscale
+from image_comparison.image_hash_comparrison import load_image
+from image_comparison.threshold_comparison import compare_with_threshold, STAGE_BYTES
+
+
+def read_bytes(image_path) -> bytes:
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+
+class TestImageSources(BaseTest):
+
+    def test_buffers_match_paths(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        buffer1, buffer2 = read_bytes(img1), memoryview(bytearray(read_bytes(img2)))
+        for metric in COMPARATOR_METRICS:
+            assert compare_pair(buffer1, buffer2, metric) == compare_pair(img1, img2, metric), metric
+
+    def test_arrays_pass_through(self, get_identical_image_path):
+        img1, _ = get_identical_image_path
+        coloured = cv2.imread(img1)
+        greyscale = cv2.imread(img1, cv2.IMREAD_GRAYSCALE)
+        assert load_image_colored(coloured) is coloured
+        assert load_image_greyscale(greyscale) is greyscale
+        assert (load_image_greyscale(coloured) == cv2.cvtColor(coloured, cv2.COLOR_BGR2GRAY)).all()
+        assert (load_image_colored(greyscale) == cv2.cvtColor(greyscale, cv2.COLOR_GRAY2BGR)).all()
+        assert OpenCVImageComparator(coloured, img1).absolute_difference_coloured() == (0, 0)
+
+    def test_pil_images(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        pil1, pil2 = Image.open(img1), Image.open(img2)
+        assert (load_image_colored(pil1) == load_image_colored(img1)).all()
+        assert load_image(pil1) is pil1
+        for metric in ("absolute_difference_coloured", "ssim_colored", "perceptual_hash"):
+            assert compare_pair(pil1, pil2, metric) == compare_pair(img1, img2, metric), metric
+        # PIL and OpenCV images can be mixed
+        assert compare_pair(pil1, cv2.imread(img1), "mse") == 0
+
+    def test_invalid_buffer(self):
+        with pytest.raises(ValueError) as exc_info:
+            load_image_colored(b"not an image")
+        assert str(exc_info.value) == "Error loading image from: <bytes of 12 bytes>"
+        with pytest.raises(TypeError):
+            load_image_colored(12)
+
+    def test_threshold_identical_buffers(self, get_identical_image_path):
+        img1, _ = get_identical_image_path
+        verdict = compare_with_threshold(read_bytes(img1), bytearray(read_bytes(img1)), "mse", 0)
+        assert verdict["stage"] == STAGE_BYTES
@@ -0,0 +1,87 @@
+import io
+import json
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.image_cache import get_image_cache
+from image_comparison.instrumentation import (
+    InMemorySink, JsonLinesSink, PrometheusSink, sink_installed, is_enabled, stage, count,
+    EVENT_TIMER, EVENT_COUNTER, EVENT_VALUE, STAGE_DECODE, STAGE_METRIC, STAGE_SSIM, STAGE_RESIZE,
+    STAGE_FLOAT_CONVERSION, COUNTER_CACHE_HITS, COUNTER_CACHE_MISSES, COUNTER_DECODED_BYTES,
+)
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.scikit_image_comparator import SciKitImageComparator
+
+
+class TestInstrumentation(BaseTest):
+
+    def test_comparison_stages_are_recorded(self, get_same_image_scaled, get_same_shape_mages_with_small_change):
+        get_image_cache().clear()
+        with sink_installed(InMemorySink()) as sink:
+            assert is_enabled()
+            comparator = OpenCVImageComparator(*get_same_image_scaled)
+            comparator.compare_images_mse()
+            comparator.compare_images_histograms_correlation_colored()
+            OpenCVImageComparator(*get_same_image_scaled).compare_images_mse()
+            score = OpenCVImageComparator(*get_same_shape_mages_with_small_change).compare_images_ssim_colored()
+        assert not is_enabled()
+
+        assert sink.get(EVENT_COUNTER, COUNTER_CACHE_MISSES, mode="greyscale")["sum"] == 2
+        assert sink.get(EVENT_COUNTER, COUNTER_CACHE_HITS, mode="greyscale")["sum"] == 2
+        # The larger image is shared by both pairs, so it is decoded once
+        assert sink.get(EVENT_TIMER, STAGE_DECODE, mode="coloured")["count"] == 3
+        assert sink.get(EVENT_COUNTER, COUNTER_DECODED_BYTES, mode="greyscale")["sum"] == (493 * 587 + 1479 * 1761)
+        # Resized greyscale and coloured images are shared by the metrics of one comparator
+        assert sink.get(EVENT_TIMER, STAGE_RESIZE)["count"] == 3
+        assert sink.get(EVENT_TIMER, STAGE_METRIC, metric="mse")["count"] == 2
+        assert sink.get(EVENT_TIMER, STAGE_SSIM)["count"] == 1
+        assert sink.get(EVENT_VALUE, "ssim_score", metric="ssim_colored")["last"] == score
+        # Timers are inclusive, the metric contains decoding of its images
+        assert sink.get(EVENT_TIMER, STAGE_METRIC, metric="mse")["sum"] >= \
+               sink.get(EVENT_TIMER, STAGE_DECODE, mode="greyscale")["sum"]
+
+    def test_no_output_without_sinks(self, capsys, get_same_shape_mages_with_small_change):
+        sink = InMemorySink()
+        with sink_installed(sink):
+            pass
+        SciKitImageComparator(*get_same_shape_mages_with_small_change).compare_coloured_images_ssim()
+        assert sink.snapshot() == []
+        assert capsys.readouterr().out == ""
+        with stage(STAGE_DECODE):
+            count(COUNTER_DECODED_BYTES, 10)
+
+    def test_scikit_values_replace_prints(self, capsys, get_same_shape_mages_with_small_change):
+        with sink_installed(InMemorySink()) as sink:
+            SciKitImageComparator(*get_same_shape_mages_with_small_change).compare_coloured_images_ssim()
+        assert capsys.readouterr().out == ""
+        assert sink.get(EVENT_VALUE, "channel_axis")["last"] == 2
+        assert sink.get(EVENT_VALUE, "image_max_value")["max"] <= 255
+        assert sink.get(EVENT_TIMER, STAGE_FLOAT_CONVERSION)["count"] == 2
+
+    def test_json_lines_sink(self):
+        output = io.StringIO()
+        sink = JsonLinesSink(output)
+        with sink_installed(sink):
+            with stage(STAGE_DECODE, mode="coloured"):
+                pass
+            count(COUNTER_DECODED_BYTES, 10, mode="coloured")
+        sink.close()
+        events = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert [(event["kind"], event["name"], event["labels"]) for event in events] == [
+            (EVENT_TIMER, STAGE_DECODE, {"mode": "coloured"}),
+            (EVENT_COUNTER, COUNTER_DECODED_BYTES, {"mode": "coloured"})]
+        assert events[1]["value"] == 10
+
+    def test_prometheus_export(self, tmp_path):
+        sink = PrometheusSink()
+        with sink_installed(sink):
+            for _ in range(2):
+                with stage(STAGE_DECODE, mode="coloured"):
+                    pass
+                count(COUNTER_DECODED_BYTES, 10, mode='a"b')
+        text = sink.export()
+        assert "# TYPE image_comparison_decode_seconds summary" in text
+        assert 'image_comparison_decode_seconds_count{mode="coloured"} 2' in text
+        assert "# TYPE image_comparison_decoded_bytes_total counter" in text
+        assert 'image_comparison_decoded_bytes_total{mode="a\\"b"} 20.0' in text
+        sink.write(tmp_path / "metrics.prom")
+        assert (tmp_path / "metrics.prom").read_text() == text
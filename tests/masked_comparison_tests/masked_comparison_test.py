@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.metrics import COMPARATOR_METRICS, compare_pair
+from image_comparison.batch_comparison import run_batch
+from image_comparison.masked_comparison import ImageMask, MaskedImageComparator
+
+# Rectangle (x, y, width, height) around the change of the selection_1_large_with_small_change image
+CHANGED_AREA = (700, 600, 200, 250)
+# Bounding box of the changed pixels
+CHANGED_BOUNDING_BOX = (771, 629, 71, 171)
+
+
+class TestMaskedComparison(BaseTest):
+
+    def test_empty_mask_matches_unmasked_metrics(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image_mask = ImageMask(tile_size=50)
+        for metric, (comparator_class, method_name) in COMPARATOR_METRICS.items():
+            expected = getattr(comparator_class(img1, img2), method_name)()
+            value = getattr(MaskedImageComparator(img1, img2, image_mask), method_name)()
+            assert value == pytest.approx(expected, abs=1e-6), metric
+
+    def test_ignored_change(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image_mask = ImageMask(ignore=[CHANGED_AREA])
+        comparator = MaskedImageComparator(img1, img2, image_mask)
+        assert comparator.compare_images_mse() == 0
+        assert comparator.absolute_difference_coloured() == (0, 0)
+        assert comparator.compare_images_histograms_correlation_colored() == pytest.approx(1)
+        assert comparator.compare_images_ssim_gray() == 1
+        assert comparator.compare_images_ssim_colored() == 1
+        assert comparator.compare_coloured_images_ssim() == (1, 1)
+        assert comparator.compare_images_perceptual_hash() == 0
+
+    def test_tight_mask_over_change(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        comparator = MaskedImageComparator(img1, img2, ImageMask(ignore=[CHANGED_BOUNDING_BOX]))
+        assert comparator.compare_images_mse() == 0
+        # Masked changes must not leak into the windows of the neighbouring pixels
+        assert comparator.compare_images_ssim_gray() == 1
+        assert comparator.compare_images_ssim_colored() == 1
+        assert comparator.compare_grayscale_images_ssim() == (1, 1)
+
+    def test_roi_with_change(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image_mask = ImageMask(roi=[CHANGED_AREA])
+        x, y, width, height = CHANGED_AREA
+        total, mean = MaskedImageComparator(img1, img2, image_mask).absolute_difference_greyscale()
+        full_total, _ = compare_pair(img1, img2, "absolute_difference_greyscale")
+        assert total == full_total
+        assert mean == pytest.approx(total / (width * height))
+        assert image_mask.get_unmasked_count(1479, 1761) == width * height
+
+    def test_mask_array_and_slices(self):
+        mask = np.ones((300, 400), dtype=np.uint8)
+        mask[:, 200:] = 0
+        image_mask = ImageMask(roi=[(0, 0, 400, 100)], mask=mask, tile_size=64)
+        assert image_mask.get_bounding_box(300, 400) == (0, 0, 200, 100)
+        assert image_mask.get_slices(300, 400) == [(0, 64, 0, 256, False), (64, 128, 0, 256, False)]
+        # Mask arrays of other sizes are resized with nearest neighbour, rectangles are in pixels of the images
+        assert image_mask.get_unmasked_count(150, 200) == 100 * 100
+        assert image_mask.get_mask(300, 400) is image_mask.get_mask(300, 400)
+
+    def test_fully_masked_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        comparator = MaskedImageComparator(img1, img2, ImageMask(roi=[]))
+        with pytest.raises(ValueError) as exc_info:
+            comparator.compare_images_mse()
+        assert str(exc_info.value) == "All pixels of the images are masked."
+
+    def test_batch_with_mask(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        records = list(run_batch([(img1, img2, "mse"), (img1, img2, "ssim_gray")], max_workers=2, ordered=True,
+                                 image_mask=ImageMask(ignore=[CHANGED_AREA])))
+        assert [record["result"] for record in records] == [0, 1]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.changed_regions import find_changed_regions, max_pool
+
+
+class TestOpenCVChangedRegionsMethod(BaseTest):
+
+    def test_changed_regions_identical_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        comparator = OpenCVImageComparator(img1, img2)
+        assert comparator.find_changed_regions_abs_diff() == []
+        assert comparator.find_changed_regions_abs_diff(coloured=True) == []
+        assert comparator.find_changed_regions_ssim() == []
+
+    def test_changed_regions_same_images_with_small_change(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        comparator = OpenCVImageComparator(img1, img2)
+        regions = comparator.find_changed_regions_abs_diff()
+        assert len(regions) == 2
+        largest = regions[0]
+        assert (largest["x"], largest["y"], largest["width"], largest["height"]) == (771, 629, 71, 131)
+        assert largest["area"] == 5605
+        assert 0 < largest["score"] <= largest["max_difference"] <= 255
+
+        ssim_regions = comparator.find_changed_regions_ssim()
+        assert len(ssim_regions) == 1
+        assert ssim_regions[0]["x"] <= largest["x"] and ssim_regions[0]["y"] <= largest["y"]
+        assert ssim_regions[0]["score"] < 0.9
+        assert comparator.compare_images_ssim_gray() > 0.99
+
+    def test_changed_regions_scaled_images(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        regions = OpenCVImageComparator(img1, img2).find_changed_regions_abs_diff(min_area=100)
+        assert all(region["area"] >= 100 for region in regions)
+
+    def test_find_changed_regions_keeps_components_apart(self):
+        difference_map = np.zeros((40, 40), dtype=np.uint8)
+        # L-shaped component and a single pixel inside its bounding box, not adjacent to it
+        difference_map[1, 0:20] = 100
+        difference_map[0:20, 18] = 50
+        difference_map[13, 5] = 80
+        regions = find_changed_regions(difference_map, 25, cell_size=4)
+        assert [(region["x"], region["y"], region["width"], region["height"], region["area"])
+                for region in regions] == [(0, 0, 20, 20, 39), (5, 13, 1, 1, 1)]
+        assert regions[0]["max_difference"] == 100
+        assert regions[1]["score"] == 80
+
+    def test_max_pool_pads_partial_cells(self):
+        image = np.arange(25, dtype=np.uint8).reshape(5, 5)
+        assert (max_pool(image, 2) == np.array([[6, 8, 9], [16, 18, 19], [21, 23, 24]])).all()
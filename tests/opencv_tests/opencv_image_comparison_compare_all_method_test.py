@@ -0,0 +1,62 @@
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.opencv_image_comparator import *
+
+METRIC_METHODS = {
+    METRIC_MSE: OpenCVImageComparator.compare_images_mse,
+    METRIC_HISTOGRAM_GRAYSCALE: OpenCVImageComparator.compare_images_histograms_correlation_grayscale,
+    METRIC_HISTOGRAM_COLORED: OpenCVImageComparator.compare_images_histograms_correlation_colored,
+    METRIC_ABS_DIFF_GREYSCALE: OpenCVImageComparator.absolute_difference_greyscale,
+    METRIC_ABS_DIFF_COLOURED: OpenCVImageComparator.absolute_difference_coloured,
+    METRIC_SSIM_GRAY: OpenCVImageComparator.compare_images_ssim_gray,
+    METRIC_SSIM_COLORED: OpenCVImageComparator.compare_images_ssim_colored,
+}
+
+
+class TestOpenCVCompareAll(BaseTest):
+
+    def test_compare_all_identical_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        results = self.compare_using_opencv_method(img1, img2, lambda comp: comp.compare_all())
+        assert set(results) == set(ALL_METRICS)
+        assert results[METRIC_MSE] == 0
+        assert results[METRIC_ABS_DIFF_COLOURED] == (0, 0)
+        assert results[METRIC_SSIM_COLORED] == 1
+
+    def test_compare_all_matches_single_methods(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        results = OpenCVImageComparator(img1, img2).compare_all()
+        assert set(results) == set(METRIC_METHODS)
+        for metric, method in METRIC_METHODS.items():
+            # Every metric is compared with a new comparator, so no intermediate result is shared
+            assert results[metric] == method(OpenCVImageComparator(img1, img2))
+
+    def test_compare_all_reports_failed_metrics(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        errors = {}
+        results = OpenCVImageComparator(img1, img2).compare_all(errors=errors)
+        failed = (METRIC_ABS_DIFF_GREYSCALE, METRIC_ABS_DIFF_COLOURED, METRIC_SSIM_GRAY, METRIC_SSIM_COLORED)
+        assert set(errors) == set(failed)
+        for metric in failed:
+            assert isinstance(errors[metric], ValueError)
+        assert list(results) == [METRIC_MSE, METRIC_HISTOGRAM_GRAYSCALE, METRIC_HISTOGRAM_COLORED]
+        for metric in results:
+            assert results[metric] == METRIC_METHODS[metric](OpenCVImageComparator(img1, img2))
+
+    def test_compare_all_raises_failed_metric(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        with pytest.raises(ValueError):
+            OpenCVImageComparator(img1, img2).compare_all()
+
+    def test_compare_all_selected_metrics_on_scaled_images(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        results = self.compare_using_opencv_method(
+            img1, img2, lambda comp: comp.compare_all([METRIC_MSE, METRIC_HISTOGRAM_GRAYSCALE]))
+        assert list(results) == [METRIC_MSE, METRIC_HISTOGRAM_GRAYSCALE]
+        assert 0.0 <= results[METRIC_MSE] <= 150.0
+
+    def test_compare_all_unknown_metric(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        with pytest.raises(ValueError):
+            OpenCVImageComparator(img1, img2).compare_all(["unknown"])
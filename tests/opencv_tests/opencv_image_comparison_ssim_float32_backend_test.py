@@ -0,0 +1,23 @@
+import pytest
+from tests.conftest import *
+# Imported as a module, so pytest does not collect the base tests here a second time
+import tests.opencv_tests.opencv_image_comparison_ssim_method_test as ssim_method_test
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.ssim_statistics import *
+
+
+@pytest.fixture(autouse=True)
+def use_float32_backend():
+    set_ssim_backend(SSIM_BACKEND_OPENCV_FLOAT32)
+    yield
+    set_ssim_backend(None)
+
+
+class TestOpenCVAndSSIMFloat32Backend(ssim_method_test.TestOpenCVAndSSIMGrayscaleMethod):
+
+    def test_ssim_backend_passed_to_method_overrides_global_backend(self, get_same_shape_mages_with_small_change):
+        comparator = OpenCVImageComparator(*get_same_shape_mages_with_small_change)
+        assert comparator.compare_images_ssim_gray(backend=SSIM_BACKEND_SCIKIT) == \
+               pytest.approx(comparator.compare_images_ssim_gray(), abs=OPENCV_FLOAT32_MAX_DEVIATION)
+        assert comparator.compare_images_ssim_colored(backend=SSIM_BACKEND_SCIKIT) == \
+               pytest.approx(comparator.compare_images_ssim_colored(), abs=OPENCV_FLOAT32_MAX_DEVIATION)
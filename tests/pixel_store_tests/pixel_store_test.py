@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison import instrumentation
+from image_comparison.image_cache import get_image_cache, MODE_COLOURED, MODE_GREYSCALE
+from image_comparison.instrumentation import InMemorySink, EVENT_COUNTER
+from image_comparison.metrics import compare_pair
+from image_comparison.opencv_image_comparator import load_image_colored, load_image_greyscale, store_decoded_images
+from image_comparison.pixel_store import *
+
+METRICS = ["mse", "histogram_correlation_colored", "absolute_difference_coloured", "ssim_gray", "ssim_colored",
+           "scikit_ssim_coloured", "perceptual_hash"]
+
+
+@pytest.fixture
+def pixel_store(tmp_path):
+    store = PixelStore(tmp_path / "pixels")
+    set_pixel_store(store)
+    get_image_cache().clear()
+    yield store
+    set_pixel_store(None)
+    get_image_cache().clear()
+
+
+class TestPixelStore(BaseTest):
+
+    def test_images_are_memory_mapped(self, pixel_store):
+        load_image_colored(IMAGE_1)
+        get_image_cache().clear()
+        img = load_image_colored(IMAGE_1)
+        assert isinstance(img, np.memmap)
+        assert not img.flags.writeable
+        assert np.array_equal(img, cv2.imread(IMAGE_1, cv2.IMREAD_COLOR))
+        assert np.array_equal(load_image_greyscale(IMAGE_1), cv2.imread(IMAGE_1, cv2.IMREAD_GRAYSCALE))
+        assert pixel_store.stats()["images"] == 2
+
+    def test_results_do_not_change(self, get_same_shape_mages_with_small_change, tmp_path):
+        img1, img2 = get_same_shape_mages_with_small_change
+        expected = {metric: compare_pair(img1, img2, metric) for metric in METRICS}
+        set_pixel_store(tmp_path / "pixels")
+        try:
+            for _ in range(2):
+                get_image_cache().clear()
+                assert {metric: compare_pair(img1, img2, metric) for metric in METRICS} == expected
+        finally:
+            set_pixel_store(None)
+
+    def test_stored_images_are_not_decoded(self, pixel_store):
+        store_decoded_images([IMAGE_1, IMAGE_2], [MODE_COLOURED])
+        assert pixel_store.stats()["images"] == 2
+        with instrumentation.sink_installed(InMemorySink()) as sink:
+            load_image_colored(IMAGE_1)
+            load_image_greyscale(IMAGE_2)
+        assert sink.get(EVENT_COUNTER, COUNTER_PIXEL_STORE_HITS, mode=MODE_COLOURED)["sum"] == 1
+        assert sink.get(EVENT_COUNTER, COUNTER_PIXEL_STORE_MISSES, mode=MODE_GREYSCALE)["sum"] == 1
+
+    def test_copies_of_file_share_pixels(self, pixel_store, tmp_path):
+        copy_path = str(tmp_path / "copy.jpg")
+        with open(IMAGE_1, "rb") as source, open(copy_path, "wb") as copy:
+            copy.write(source.read())
+        load_image_colored(IMAGE_1)
+        assert isinstance(load_image_colored(copy_path), np.memmap)
+        assert pixel_store.stats()["images"] == 1
+
+    def test_truncated_file_is_replaced(self, pixel_store):
+        load_image_colored(IMAGE_2)
+        pixel_path, = pixel_store.iter_pixel_paths()
+        with open(pixel_path, "r+b") as pixel_file:
+            pixel_file.truncate(100)
+        get_image_cache().clear()
+        assert np.array_equal(load_image_colored(IMAGE_2), cv2.imread(IMAGE_2))
+        get_image_cache().clear()
+        assert isinstance(load_image_colored(IMAGE_2), np.memmap)
+
+    def test_read_only_store(self, tmp_path):
+        set_pixel_store(PixelStore(tmp_path / "pixels", write=False))
+        try:
+            get_image_cache().clear()
+            assert not isinstance(load_image_colored(IMAGE_1), np.memmap)
+            assert get_pixel_store().stats()["images"] == 0
+        finally:
+            set_pixel_store(None)
+
+    def test_store_must_be_enabled(self):
+        with pytest.raises(ValueError):
+            store_decoded_images([IMAGE_1])
@@ -0,0 +1,93 @@
+import cv2
+import numpy as np
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.image_cache import MODE_COLOURED, MODE_GREYSCALE, build_cache_key, get_image_cache
+from image_comparison.opencv_image_comparator import (
+    OpenCVImageComparator, load_image_colored, resize_to_smaller_image, resize_image_keep_aspect_ratio, abs_diff_images,
+)
+from image_comparison.pyramid_comparison import (
+    PyramidImageComparator, build_digest_pyramid, coarse_to_fine_changed_tiles,
+)
+
+
+class TestPyramidComparison(BaseTest):
+
+    def test_pyramid_identical_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        comparator = PyramidImageComparator(img1, img2)
+        assert comparator.find_different_tiles() == []
+        assert comparator.compare_images_mse() == 0
+        assert comparator.absolute_difference_coloured() == (0, 0)
+
+    def test_pyramid_levels_have_matching_shapes(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        pyramid_1, pyramid_2 = PyramidImageComparator(img1, img2).get_pyramids(MODE_COLOURED)
+        assert [level.shape for level in pyramid_1] == [level.shape for level in pyramid_2]
+        assert pyramid_1[0].shape == load_image_colored(img1).shape
+        assert pyramid_1[-1].shape[:2] == (1, 1)
+
+    def test_pyramid_metrics_match_opencv_for_scaled_images(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        comparator = PyramidImageComparator(img1, img2)
+        assert comparator.compare_images_mse() == OpenCVImageComparator(img1, img2).compare_images_mse()
+        image1, image2 = resize_to_smaller_image(load_image_colored(img1), load_image_colored(img2))
+        assert comparator.absolute_difference_coloured() == abs_diff_images(image1, image2)
+
+    def test_pyramid_small_change_is_localized(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        comparator = PyramidImageComparator(img1, img2)
+        opencv_comparator = OpenCVImageComparator(img1, img2)
+        assert comparator.compare_images_mse() == opencv_comparator.compare_images_mse()
+        assert comparator.absolute_difference_greyscale() == opencv_comparator.absolute_difference_greyscale()
+        tiles = comparator.find_different_tiles()
+        height, width = load_image_colored(img1).shape[:2]
+        assert 0 < len(tiles) < (height // 32) * (width // 32) // 10
+        assert comparator.find_different_tiles(MODE_COLOURED) == tiles
+
+    def test_pyramid_high_frequency_change_is_not_pruned(self, tmp_path):
+        # Blurred coarser levels would cancel out alternating +1/-1 differences, digests do not
+        image = np.full((256, 256), 128, dtype=np.uint8)
+        checkerboard = image.copy()
+        checkerboard[(np.indices(image.shape).sum(axis=0) % 2) == 0] += 1
+        checkerboard[(np.indices(image.shape).sum(axis=0) % 2) == 1] -= 1
+        img1, img2 = str(tmp_path / "flat.png"), str(tmp_path / "checkerboard.png")
+        cv2.imwrite(img1, image)
+        cv2.imwrite(img2, checkerboard)
+        comparator = PyramidImageComparator(img1, img2)
+        assert comparator.compare_images_mse() == OpenCVImageComparator(img1, img2).compare_images_mse() == 1.0
+        assert comparator.absolute_difference_greyscale() == (256 * 256, 1.0)
+        assert len(comparator.find_different_tiles()) == (256 // 32) ** 2
+
+    def test_digest_pyramid_odd_sizes(self):
+        pyramid = build_digest_pyramid(np.zeros((493, 587), dtype=np.uint8))
+        assert pyramid[0].shape == (493, 587)
+        assert [level.shape[:2] for level in pyramid[1:]] == [(16, 19), (8, 10), (4, 5), (2, 3), (1, 2), (1, 1)]
+
+    def test_only_changed_tile_is_refined(self, tmp_path):
+        image = np.random.default_rng(0).integers(0, 256, (250, 300, 3), dtype=np.uint8)
+        changed = image.copy()
+        changed[100, 200, 1] ^= 1
+        pyramid_1, pyramid_2 = build_digest_pyramid(image), build_digest_pyramid(changed)
+        assert list(zip(*np.nonzero(coarse_to_fine_changed_tiles(pyramid_1, pyramid_2)))) == [(100 // 32, 200 // 32)]
+        assert not coarse_to_fine_changed_tiles(pyramid_1, build_digest_pyramid(image.copy())).any()
+        img1, img2 = str(tmp_path / "image.png"), str(tmp_path / "changed.png")
+        cv2.imwrite(img1, image)
+        cv2.imwrite(img2, changed)
+        comparator = PyramidImageComparator(img1, img2)
+        opencv_comparator = OpenCVImageComparator(img1, img2)
+        assert comparator.absolute_difference_coloured() == opencv_comparator.absolute_difference_coloured()
+        assert comparator.find_different_tiles(MODE_COLOURED) == [(192, 96, 32, 32)]
+
+    def test_decoded_images_are_not_cached_with_pyramids(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        get_image_cache().clear()
+        PyramidImageComparator(img1, img2).compare_images_mse()
+        assert build_cache_key(img1, MODE_GREYSCALE) not in get_image_cache()
+        assert build_cache_key(img2, MODE_GREYSCALE) not in get_image_cache()
+
+    def test_resize_keep_aspect_ratio_rounds_height(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        resized = resize_image_keep_aspect_ratio(load_image_colored(img2), new_width=587)
+        assert resized.shape == load_image_colored(img1).shape
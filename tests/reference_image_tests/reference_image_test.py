@@ -0,0 +1,67 @@
+import cv2
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.reference_image import *
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.scikit_image_comparator import SciKitImageComparator
+from image_comparison.image_hash_comparrison import ImageHashComparison
+
+
+class TestReferenceImage(BaseTest):
+
+    def test_reference_identical_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        results = ReferenceImage(img1).compare(img2)
+        assert set(results) == set(REFERENCE_METRICS)
+        assert results[METRIC_MSE] == 0
+        assert results[METRIC_SSIM_COLORED] == 1
+        assert results[METRIC_SCIKIT_SSIM_GRAYSCALE] == (1.0, 1.0)
+        assert results["perceptual_hash"] == 0
+
+    def test_reference_matches_pairwise_methods(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        results = next(ReferenceImage(img1).compare_many([img2, img1]))
+        assert results[METRIC_MSE] == OpenCVImageComparator(img1, img2).compare_images_mse()
+        assert results[METRIC_HISTOGRAM_COLORED] == \
+               OpenCVImageComparator(img1, img2).compare_images_histograms_correlation_colored()
+        assert results[METRIC_SSIM_GRAY] == OpenCVImageComparator(img1, img2).compare_images_ssim_gray()
+        assert results[METRIC_SSIM_COLORED] == OpenCVImageComparator(img1, img2).compare_images_ssim_colored()
+        assert results[METRIC_SCIKIT_SSIM_GRAYSCALE] == \
+            SciKitImageComparator(img1, img2).compare_grayscale_images_ssim()
+        assert results[METRIC_SCIKIT_SSIM_COLOURED] == SciKitImageComparator(img1, img2).compare_coloured_images_ssim()
+        assert results["wavelet_hash"] == ImageHashComparison(img1, img2).compare_images_wavelet_hash()
+
+    def test_reference_resized_candidates(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        reference = ReferenceImage(img2)
+        metrics = [METRIC_MSE, METRIC_SCIKIT_SSIM_COLOURED_RESIZED]
+        first, second = reference.compare_many([img1, img1], metrics)
+        assert first == second
+        assert first[METRIC_MSE] == OpenCVImageComparator(img2, img1).compare_images_mse()
+        assert first[METRIC_SCIKIT_SSIM_COLOURED_RESIZED] == \
+               SciKitImageComparator(img2, img1).compare_coloured_resized_images_ssim()
+
+    def test_reference_features_are_bounded(self, get_same_image_scaled, tmp_path):
+        img1, img2 = get_same_image_scaled
+        candidates = []
+        for width in range(100, 180, 10):
+            candidates.append(str(tmp_path / f"candidate_{width}.png"))
+            cv2.imwrite(candidates[-1], cv2.resize(cv2.imread(img2), (width, width)))
+        reference = ReferenceImage(img2, max_features=4)
+        results = reference.compare_many(candidates, [METRIC_MSE])
+        assert not isinstance(results, list)
+        for candidate_path, result in zip(candidates, results):
+            assert result[METRIC_MSE] == OpenCVImageComparator(img2, candidate_path).compare_images_mse()
+            assert len(reference._features) <= 4
+
+    def test_reference_different_dimensions(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        with pytest.raises(ValueError) as exc_info:
+            ReferenceImage(img1).compare(img2, [METRIC_SSIM_GRAY])
+        assert str(exc_info.value) == "Input images must have the same dimensions."
+
+    def test_reference_unknown_metric(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        with pytest.raises(ValueError):
+            ReferenceImage(img1).compare_many([img2], ["unknown"])
@@ -0,0 +1,41 @@
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+# Imported as modules, so pytest does not collect the base tests here a second time
+import tests.skikit_image_tests.skikit_grayscale_images_ssim_comparison_test as grayscale_test
+import tests.skikit_image_tests.scikit_coloured_images_ssim_comparison_test as coloured_test
+from image_comparison.scikit_image_comparator import SciKitImageComparator
+from image_comparison.ssim_statistics import *
+
+
+@pytest.fixture(autouse=True)
+def use_float32_backend():
+    set_ssim_backend(SSIM_BACKEND_OPENCV_FLOAT32)
+    yield
+    set_ssim_backend(None)
+
+
+class TestSkiKitGrayscaleImageComparisonFloat32Backend(grayscale_test.TestSkiKitGrayscaleImageComparison):
+    pass
+
+
+class TestSkiKitColouredImageComparisonFloat32Backend(coloured_test.TestSkiKitColouredImageComparison):
+    pass
+
+
+class TestSSIMBackendAccuracy(BaseTest):
+
+    @pytest.mark.parametrize("backend, max_deviation", [(SSIM_BACKEND_OPENCV, OPENCV_MAX_DEVIATION),
+                                                        (SSIM_BACKEND_OPENCV_FLOAT32, OPENCV_FLOAT32_MAX_DEVIATION)])
+    def test_backend_deviation_from_scikit(self, get_same_shape_mages_with_small_change, backend, max_deviation):
+        comparator = SciKitImageComparator(*get_same_shape_mages_with_small_change)
+        for method in (comparator.compare_grayscale_images_ssim, comparator.compare_coloured_images_ssim):
+            similarity, diff_mean = method(backend=backend)
+            expected_similarity, expected_diff_mean = method(backend=SSIM_BACKEND_SCIKIT)
+            assert similarity == pytest.approx(expected_similarity, abs=max_deviation)
+            assert diff_mean == pytest.approx(expected_diff_mean, abs=max_deviation)
+
+    def test_unknown_backend(self, get_identical_image_path):
+        with pytest.raises(ValueError) as exc_info:
+            SciKitImageComparator(*get_identical_image_path).compare_grayscale_images_ssim(backend="integral")
+        assert str(exc_info.value) == "Unknown SSIM backend: integral"
@@ -0,0 +1,65 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+from skimage.metrics import structural_similarity as ssim
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.opencv_image_comparator import load_image_colored, load_image_greyscale
+from image_comparison.ssim_statistics import *
+
+
+class TestSSIMStatistics(BaseTest):
+
+    def test_statistics_ssim_identical_to_scikit(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image1, image2 = load_image_greyscale(img1), load_image_greyscale(img2)
+        score, diff = structural_similarity_from_statistics(SSIMStatistics(image1), SSIMStatistics(image2),
+                                                            UINT8_DATA_RANGE)
+        expected_score, expected_diff = ssim(image1, image2, full=True)
+        assert score == expected_score
+        assert (diff == expected_diff).all()
+
+    def test_channels_ssim_identical_to_scikit(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image1, image2 = load_image_colored(img1), load_image_colored(img2)
+        scores = structural_similarity_channels(image1, image2, UINT8_DATA_RANGE)
+        assert scores == [ssim(image1[:, :, channel], image2[:, :, channel]) for channel in range(3)]
+
+    @pytest.mark.parametrize("dtype", [np.uint8, np.int8, np.uint16, np.int16])
+    @pytest.mark.parametrize("band_rows", [1, 3, SSIM_BAND_ROWS])
+    def test_banded_ssim_identical_to_scikit(self, dtype, band_rows):
+        rng = np.random.default_rng(band_rows)
+        info = np.iinfo(dtype)
+        data_range = int(info.max) - int(info.min)
+        for shape in [(7, 7, 3), (40, 33, 3), (100, 17, 4), (29, 31, 1)]:
+            image1 = rng.integers(info.min, info.max, shape, dtype=dtype, endpoint=True)
+            image2 = rng.integers(info.min, info.max, shape, dtype=dtype, endpoint=True)
+            scores = banded_channels_structural_similarity(image1, image2, data_range, band_rows=band_rows)
+            assert scores == [ssim(image1[..., channel], image2[..., channel], data_range=data_range)
+                              for channel in range(shape[2])]
+
+    def test_banded_ssim_without_image_sized_buffers(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image1, image2 = load_image_colored(img1), load_image_colored(img2)
+        tracemalloc.start()
+        try:
+            structural_similarity_channels(image1, image2, UINT8_DATA_RANGE)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # Buffers of a band of rows, a float64 SSIM map of the images alone takes 8 times their size
+        assert peak < 2 * image1.nbytes
+
+    def test_channels_ssim_opencv_filter(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        image1, image2 = load_image_colored(img1), load_image_colored(img2)
+        scores = structural_similarity_channels(image1, image2, UINT8_DATA_RANGE, backend=SSIM_BACKEND_OPENCV)
+        for channel, score in enumerate(scores):
+            assert score == pytest.approx(ssim(image1[:, :, channel], image2[:, :, channel]), abs=1e-12)
+
+    def test_channels_ssim_different_dimensions(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        with pytest.raises(ValueError) as exc_info:
+            structural_similarity_channels(load_image_colored(img1), load_image_colored(img2), UINT8_DATA_RANGE)
+        assert str(exc_info.value) == "Input images must have the same dimensions."
@@ -0,0 +1,47 @@
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.threshold_comparison import *
+
+
+class TestThresholdComparison(BaseTest):
+
+    def test_threshold_identical_files(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        verdict = compare_with_threshold(img1, img2, METRIC_SSIM_COLORED, 0.99)
+        assert verdict == {"passed": True, "stage": STAGE_BYTES, "score": 1.0}
+
+    def test_threshold_identical_pixels(self, tmp_path):
+        image = cv2.imread(IMAGE_3)
+        copy_path = str(tmp_path / "copy.png")
+        cv2.imwrite(copy_path, image, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+        verdict = compare_with_threshold(IMAGE_3, copy_path, METRIC_SSIM_GRAY, 0.99)
+        assert verdict == {"passed": True, "stage": STAGE_PIXELS, "score": 1.0}
+
+    def test_threshold_full_ssim(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        verdict = compare_with_threshold(img1, img2, METRIC_SSIM_GRAY, 0.99)
+        assert verdict["passed"]
+        assert verdict["stage"] == STAGE_FULL
+        assert verdict["score"] == OpenCVImageComparator(img1, img2).compare_images_ssim_gray()
+        assert not compare_with_threshold(img1, img2, METRIC_SSIM_GRAY, 0.999)["passed"]
+
+    def test_threshold_mse_lower_bound(self, get_different_image_paths):
+        img1, img2 = get_different_image_paths
+        image1, image2 = resize_to_smaller_image(load_image_greyscale(img1), load_image_greyscale(img2))
+        assert downscaled_mse_lower_bound(image1, image2, max_pixels=100) <= \
+               OpenCVImageComparator(img1, img2).compare_images_mse()
+        verdict = compare_with_threshold(img1, img2, METRIC_MSE, 10)
+        assert verdict == {"passed": False, "stage": STAGE_DOWNSCALED_MSE, "score": None}
+
+    def test_threshold_abs_diff_budget(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        verdict = compare_with_threshold(img1, img2, METRIC_ABS_DIFF_COLOURED, 100)
+        assert verdict == {"passed": False, "stage": STAGE_ABS_DIFF_BUDGET, "score": None}
+        verdict = compare_with_threshold(img1, img2, METRIC_ABS_DIFF_COLOURED, 10 ** 9)
+        assert verdict["passed"]
+        assert verdict["score"] == OpenCVImageComparator(img1, img2).absolute_difference_coloured()
+
+    def test_threshold_hash_fail_distance(self, get_different_image_paths):
+        img1, img2 = get_different_image_paths
+        verdict = compare_with_threshold(img1, img2, METRIC_SSIM_COLORED, 0.9, hash_fail_distance=10)
+        assert verdict == {"passed": False, "stage": STAGE_HASH, "score": None}
@@ -0,0 +1,48 @@
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison.tiled_comparison import TiledImageComparator
+from image_comparison.opencv_image_comparator import OpenCVImageComparator
+from image_comparison.scikit_image_comparator import SciKitImageComparator
+
+# Small budget splits test images into many bands
+SMALL_BUDGET = 100000
+
+
+class TestTiledComparison(BaseTest):
+
+    def test_tiled_identical_images(self, get_identical_image_path):
+        img1, img2 = get_identical_image_path
+        comparator = TiledImageComparator(img1, img2, SMALL_BUDGET)
+        assert comparator.compare_images_mse() == 0
+        assert comparator.absolute_difference_coloured() == (0, 0)
+        assert comparator.compare_images_ssim_gray() == 1
+        assert comparator.compare_images_ssim_colored() == 1
+
+    def test_tiled_diff_metrics_match_opencv(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        tiled = TiledImageComparator(img1, img2, SMALL_BUDGET)
+        comparator = OpenCVImageComparator(img1, img2)
+        assert tiled.compare_images_mse() == pytest.approx(comparator.compare_images_mse(), rel=1e-12)
+        assert tiled.absolute_difference_greyscale() == comparator.absolute_difference_greyscale()
+        assert tiled.absolute_difference_coloured() == comparator.absolute_difference_coloured()
+
+    def test_tiled_ssim_matches_scikit(self, get_same_shape_mages_with_small_change):
+        img1, img2 = get_same_shape_mages_with_small_change
+        tiled = TiledImageComparator(img1, img2, SMALL_BUDGET)
+        assert tiled.compare_images_ssim_colored() == \
+               pytest.approx(OpenCVImageComparator(img1, img2).compare_images_ssim_colored(), abs=1e-10)
+        similarity, diff = tiled.compare_grayscale_images_ssim()
+        expected_similarity, expected_diff = SciKitImageComparator(img1, img2).compare_grayscale_images_ssim()
+        assert similarity == pytest.approx(expected_similarity, abs=1e-10)
+        assert diff == pytest.approx(expected_diff, abs=1e-10)
+        similarity, diff = tiled.compare_coloured_images_ssim()
+        expected_similarity, expected_diff = SciKitImageComparator(img1, img2).compare_coloured_images_ssim()
+        assert similarity == pytest.approx(expected_similarity, abs=1e-5)
+        assert diff == pytest.approx(expected_diff, abs=1e-5)
+
+    def test_tiled_ssim_different_dimensions(self, get_same_image_scaled):
+        img1, img2 = get_same_image_scaled
+        with pytest.raises(ValueError) as exc_info:
+            TiledImageComparator(img1, img2).compare_images_ssim_gray()
+        assert str(exc_info.value) == "Input images must have the same dimensions."
@@ -0,0 +1,137 @@
+import json
+import shutil
+import cv2
+import pytest
+from tests.base_tests import BaseTest
+from tests.conftest import *
+from image_comparison import instrumentation
+from image_comparison.cli import main
+from image_comparison.feature_store import set_feature_store
+from image_comparison.image_cache import get_image_cache
+from image_comparison.instrumentation import InMemorySink, EVENT_TIMER, STAGE_DECODE
+from image_comparison.metrics import compare_pair
+from image_comparison.tree_diff import *
+
+
+@pytest.fixture
+def trees(tmp_path):
+    dir_1, dir_2 = tmp_path / "baseline", tmp_path / "current"
+    (dir_1 / "sub").mkdir(parents=True)
+    (dir_2 / "sub").mkdir(parents=True)
+    shutil.copy(IMAGE_1, dir_1 / "same.jpg")
+    shutil.copy(IMAGE_1, dir_2 / "same.jpg")
+    # The same pixels encoded with other compression level
+    image = cv2.imread(IMAGE_3)
+    cv2.imwrite(str(dir_1 / "reencoded.png"), image, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+    cv2.imwrite(str(dir_2 / "reencoded.png"), image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    shutil.copy(IMAGE_3_LARGER, dir_1 / "sub" / "changed.png")
+    shutil.copy(IMAGE_3_LARGER_SMALL_CHANGE, dir_2 / "sub" / "changed.png")
+    shutil.copy(IMAGE_2, dir_1 / "removed.jpg")
+    shutil.copy(IMAGE_2, dir_2 / "added.jpg")
+    return str(dir_1), str(dir_2)
+
+
+class KillWorker:
+    # Kills the worker process which unpickles it
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def diff_by_path(dir_1, dir_2, **kwargs) -> dict:
+    return {record["path"]: record for record in diff_trees(dir_1, dir_2, **kwargs)}
+
+
+class TestTreeDiff(BaseTest):
+
+    def test_tree_statuses(self, trees):
+        records = diff_by_path(*trees, max_workers=1)
+        changed_path = os.path.join("sub", "changed.png")
+        assert {path: (record["status"], record["tier"]) for path, record in records.items()} == {
+            "same.jpg": (STATUS_IDENTICAL, TIER_DIGEST),
+            "reencoded.png": (STATUS_IDENTICAL, TIER_PIXELS),
+            changed_path: (STATUS_CHANGED, TIER_METRICS),
+            "removed.jpg": (STATUS_MISSING, None),
+            "added.jpg": (STATUS_ADDED, None),
+        }
+        assert records[changed_path]["scores"] == {METRIC_SSIM_GRAY: compare_pair(
+            IMAGE_3_LARGER, IMAGE_3_LARGER_SMALL_CHANGE, METRIC_SSIM_GRAY)}
+        assert records[changed_path]["passed"] is None
+        assert records["same.jpg"]["scores"] == {}
+
+    def test_identical_files_are_not_decoded(self, trees):
+        get_image_cache().clear()
+        with instrumentation.sink_installed(InMemorySink()) as sink:
+            diff_by_path(*trees, metrics=["mse"], max_workers=1)
+        decodes = sink.total(EVENT_TIMER, STAGE_DECODE)
+        # Pixel digests of the re-encoded and changed pairs, greyscale images of the changed pair
+        assert decodes["count"] == 6
+
+    def test_thresholds_and_workers(self, trees):
+        records = diff_by_path(*trees, metrics=["mse", "ssim_gray"], thresholds={"ssim_gray": 0.99}, max_workers=2,
+                               chunk_size=1)
+        assert records[os.path.join("sub", "changed.png")]["passed"] is True
+        assert diff_by_path(*trees, max_workers=1) == diff_by_path(*trees, max_workers=2, chunk_size=2)
+
+    def test_pixel_digests_are_stored(self, trees, tmp_path):
+        set_feature_store(str(tmp_path / "features.sqlite"))
+        try:
+            diff_by_path(*trees, max_workers=1)
+            with instrumentation.sink_installed(InMemorySink()) as sink:
+                records = diff_by_path(*trees, max_workers=1)
+            assert records["reencoded.png"]["tier"] == TIER_PIXELS
+            assert sink.get(EVENT_TIMER, STAGE_DECODE, mode="unchanged") is None
+        finally:
+            set_feature_store(None)
+
+    def test_summary(self, trees):
+        summary = TreeDiffSummary()
+        for record in diff_trees(*trees, max_workers=1):
+            summary.add(record)
+        result = summary.to_dict()
+        assert result["counts"] == {STATUS_IDENTICAL: 2, STATUS_CHANGED: 1, STATUS_MISSING: 1, STATUS_ADDED: 1,
+                                    STATUS_ERROR: 0}
+        assert result["identical_tiers"] == {TIER_DIGEST: 1, TIER_PIXELS: 1}
+        assert [record["path"] for record in result["files"][STATUS_MISSING]] == ["removed.jpg"]
+
+    def test_summary_without_files(self, trees):
+        summary = TreeDiffSummary(keep_files=False)
+        for record in diff_trees(*trees, thresholds={"ssim_gray": 1.0}, max_workers=1):
+            summary.add(record)
+        result = summary.to_dict()
+        assert "files" not in result
+        assert result["counts"][STATUS_CHANGED] == 1
+        assert result["failed"] == 1
+
+    def test_killed_worker_does_not_abort_diff(self, trees, monkeypatch):
+        dir_1, dir_2 = trees
+        pairs = list(walk_directory_pairs(dir_1, dir_2))
+        pairs.insert(2, ("killer.png", KillWorker(), pairs[0][2]))
+        monkeypatch.setattr("image_comparison.tree_diff.walk_directory_pairs", lambda *args: iter(pairs))
+        records = list(diff_trees(dir_1, dir_2, metrics=["mse"], max_workers=2, chunk_size=2))
+        assert [record["path"] for record in records] == [pair[0] for pair in pairs]
+        killer = records[2]
+        assert killer["status"] == STATUS_ERROR and killer["error"].startswith("BrokenProcessPool")
+        assert [record for record in records if record["status"] == STATUS_ERROR] == [killer]
+
+    def test_unreadable_changed_file(self, trees):
+        dir_1, dir_2 = trees
+        with open(os.path.join(dir_2, "same.jpg"), "r+b") as image_file:
+            image_file.truncate(10)
+        record = diff_by_path(dir_1, dir_2, max_workers=1)["same.jpg"]
+        assert record["status"] == STATUS_ERROR
+        assert record["error"].startswith("ValueError")
+
+    def test_command_line(self, trees, tmp_path):
+        output_path, summary_path = str(tmp_path / "files.jsonl"), str(tmp_path / "summary.json")
+        arguments = ["--dirs", *trees, "--tree-diff", "--workers", "1", "--output", output_path,
+                     "--summary", summary_path]
+        assert main(arguments) == 1
+        with open(output_path) as output:
+            assert len(output.readlines()) == 5
+        with open(summary_path) as summary_file:
+            assert json.load(summary_file)["counts"][STATUS_CHANGED] == 1
+        for name in ("removed.jpg", "added.jpg"):
+            for tree in trees:
+                if os.path.exists(os.path.join(tree, name)):
+                    os.remove(os.path.join(tree, name))
+        assert main(arguments + ["--threshold", "0.99"]) == 0